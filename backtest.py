@@ -0,0 +1,199 @@
+# Backtesting de TechnicalStrategy y BreakoutStrategy sobre velas históricas, sin tener que correrlas en testnet.
+# Usa las mismas reglas de señal (RSI/MACD de _check_signal() y el breakout con min_volume) y los mismos porcentajes
+# de take_profit / stop_loss que las estrategias en vivo.
+# Todo se calcula con operaciones vectorizadas sobre las columnas (NumPy y el ewm de pandas, que corre en C).
+# El único loop de Python es por trade (no por vela): busco la próxima señal y la vela de salida por TP/SL.
+#
+# Las velas se pasan en formato columnar (array estructurado con CANDLE_DTYPE, ver models.candles_to_array() o
+# CandleBuffer.to_array()).
+import typing
+
+import numpy as np
+import pandas as pd
+
+from models import CANDLE_DTYPE
+
+# Cantidad de velas con la que empiezo a buscar la salida de un trade. Si no la encuentro duplico la ventana,
+# así cada búsqueda cuesta proporcional a la duración del trade y no a todo el histórico.
+EXIT_SEARCH_WINDOW = 256
+
+
+class BacktestResult:
+    def __init__(self, trades: typing.List[typing.Dict], candles_count: int):
+        # cada trade: entry_time, exit_time (None si quedó abierto), side, entry_price, exit_price, pnl (en %)
+        self.trades = trades
+        self.candles_count = candles_count
+
+        pnl = np.array([t['pnl'] for t in trades if t['exit_time'] is not None], dtype=np.float64)
+
+        # pnl acumulado (suma de los % de cada trade) y máximo drawdown de esa curva, en puntos %
+        equity = np.cumsum(pnl)
+        peaks = np.maximum.accumulate(np.concatenate(([0.], equity)))[1:]
+
+        self.pnl = float(equity[-1]) if len(equity) > 0 else 0.
+        self.max_drawdown = float(np.max(peaks - equity)) if len(equity) > 0 else 0.
+        self.win_rate = float(np.mean(pnl > 0)) if len(pnl) > 0 else 0.
+
+
+# Mismas fórmulas que TechnicalStrategy (indicators.MacdState / RsiState), pero sobre toda la columna de cierres.
+# El valor del índice i corresponde a la vela i ya cerrada.
+def macd(closes: np.ndarray, ema_fast: int, ema_slow: int, ema_signal: int) -> typing.Tuple[np.ndarray, np.ndarray]:
+    closes = pd.Series(closes)
+
+    macd_line = closes.ewm(span=ema_fast).mean() - closes.ewm(span=ema_slow).mean()
+    macd_signal = macd_line.ewm(span=ema_signal).mean()
+
+    return macd_line.to_numpy(), macd_signal.to_numpy()
+
+
+def rsi(closes: np.ndarray, rsi_length: int) -> np.ndarray:
+    delta = np.diff(closes)
+
+    up = pd.Series(np.where(delta > 0, delta, 0.))
+    down = pd.Series(np.where(delta < 0, -delta, 0.))
+
+    avg_gain = up.ewm(com=(rsi_length - 1), min_periods=rsi_length).mean().to_numpy()
+    avg_loss = down.ewm(com=(rsi_length - 1), min_periods=rsi_length).mean().to_numpy()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result = np.round(100 - 100 / (1 + avg_gain / avg_loss), 2)
+
+    # la primera vela no tiene variación
+    return np.concatenate(([np.nan], result))
+
+
+# Devuelve para cada vela la señal (1 long, -1 short, 0 nada) y el índice / precio de entrada.
+# Technical: igual que en vivo, la señal se evalúa al abrir la vela i con los indicadores de la vela i - 1,
+# y se entra al precio de apertura de la vela i.
+def _technical_signals(candles: np.ndarray, other_params: typing.Dict) -> typing.Tuple[np.ndarray, np.ndarray]:
+    macd_line, macd_signal = macd(candles['close'], other_params['ema_fast'], other_params['ema_slow'],
+                                  other_params['ema_signal'])
+    rsi_values = rsi(candles['close'], other_params['rsi_length'])
+
+    signal = np.zeros(len(candles), dtype=np.int8)
+    signal[1:][(rsi_values[:-1] < 30) & (macd_line[:-1] > macd_signal[:-1])] = 1
+    signal[1:][(rsi_values[:-1] > 70) & (macd_line[:-1] < macd_signal[:-1])] = -1
+
+    return signal, candles['open']
+
+
+# Breakout: en vivo se chequea en cada trade. Con velas sólo puedo saber si la vela i cerró por encima (o debajo) de
+# la vela anterior con volumen suficiente, así que la señal se toma al cierre de la vela i y se entra a ese precio.
+def _breakout_signals(candles: np.ndarray, other_params: typing.Dict) -> typing.Tuple[np.ndarray, np.ndarray]:
+    min_volume = other_params['min_volume']
+
+    signal = np.zeros(len(candles), dtype=np.int8)
+    enough_volume = candles['volume'][1:] > min_volume
+    signal[1:][(candles['close'][1:] > candles['high'][:-1]) & enough_volume] = 1
+    signal[1:][(candles['close'][1:] < candles['low'][:-1]) & enough_volume] = -1
+
+    return signal, candles['close']
+
+
+# Busca la primera vela desde start en la que se toca el take profit o el stop loss.
+# Si en la misma vela se tocan los dos, asumo el stop loss (el caso más conservador).
+def _find_exit(candles: np.ndarray, start: int, side: int, tp_price: typing.Optional[float],
+               sl_price: typing.Optional[float]) -> typing.Optional[typing.Tuple[int, float]]:
+    window = EXIT_SEARCH_WINDOW
+
+    while start < len(candles):
+        end = min(start + window, len(candles))
+        high = candles['high'][start:end]
+        low = candles['low'][start:end]
+
+        if side == 1:
+            sl_hit = low <= sl_price if sl_price is not None else np.zeros(end - start, dtype=bool)
+            tp_hit = high >= tp_price if tp_price is not None else np.zeros(end - start, dtype=bool)
+        else:
+            sl_hit = high >= sl_price if sl_price is not None else np.zeros(end - start, dtype=bool)
+            tp_hit = low <= tp_price if tp_price is not None else np.zeros(end - start, dtype=bool)
+
+        hits = np.flatnonzero(sl_hit | tp_hit)
+
+        if len(hits) > 0:
+            i = int(hits[0])
+            open_price = candles['open'][start + i]
+
+            # si la vela abrió más allá del nivel (gap), la salida es al precio de apertura
+            if sl_hit[i]:
+                price = min(open_price, sl_price) if side == 1 else max(open_price, sl_price)
+            else:
+                price = max(open_price, tp_price) if side == 1 else min(open_price, tp_price)
+
+            return start + i, float(price)
+
+        start = end
+        window *= 2
+
+    return None
+
+
+def run_backtest(strategy_type: str, candles: np.ndarray, take_profit: typing.Optional[float],
+                 stop_loss: typing.Optional[float], other_params: typing.Dict) -> BacktestResult:
+
+    """
+    Backtest a strategy over historical candles with the same rules as the live TechnicalStrategy / BreakoutStrategy.
+    Only one position is open at a time (like ongoing_position). PnL is expressed in % of the entry price.
+    :param strategy_type: "Technical" or "Breakout"
+    :param candles: structured array with CANDLE_DTYPE
+    :param take_profit: % like in the strategy component, None to disable
+    :param stop_loss: % like in the strategy component, None to disable
+    :param other_params: the extra_params of the strategy (ema_fast, ema_slow, ema_signal, rsi_length / min_volume)
+    :return:
+    """
+
+    if candles.dtype != CANDLE_DTYPE:
+        candles = candles.astype(CANDLE_DTYPE)
+
+    if strategy_type == "Technical":
+        signal, entry_prices = _technical_signals(candles, other_params)
+        # se entra al abrir la vela, así que el TP / SL ya se puede tocar en esa misma vela
+        exit_offset = 0
+    elif strategy_type == "Breakout":
+        signal, entry_prices = _breakout_signals(candles, other_params)
+        # se entra al cierre de la vela, el TP / SL recién se puede tocar en la siguiente
+        exit_offset = 1
+    else:
+        raise ValueError(f"Unknown strategy type {strategy_type}")
+
+    signal_indexes = np.flatnonzero(signal)
+    trades = []
+    cursor = 0
+
+    while True:
+        # próxima señal a partir del cursor (no se abre otra posición mientras haya una abierta)
+        position = int(np.searchsorted(signal_indexes, cursor))
+        if position >= len(signal_indexes):
+            break
+
+        entry_index = int(signal_indexes[position])
+        side = int(signal[entry_index])
+        entry_price = float(entry_prices[entry_index])
+
+        tp_price = None
+        sl_price = None
+        if take_profit is not None:
+            tp_price = entry_price * (1 + take_profit / 100) if side == 1 else entry_price * (1 - take_profit / 100)
+        if stop_loss is not None:
+            sl_price = entry_price * (1 - stop_loss / 100) if side == 1 else entry_price * (1 + stop_loss / 100)
+
+        exit_info = _find_exit(candles, entry_index + exit_offset, side, tp_price, sl_price)
+
+        trade = {"entry_time": int(candles['timestamp'][entry_index]), "side": "long" if side == 1 else "short",
+                 "entry_price": entry_price, "exit_time": None, "exit_price": None, "pnl": 0.}
+
+        if exit_info is None:
+            # el trade quedó abierto al final de los datos: lo valúo al último cierre
+            trade['pnl'] = (float(candles['close'][-1]) / entry_price - 1) * 100 * side
+            trades.append(trade)
+            break
+
+        exit_index, exit_price = exit_info
+        trade['exit_time'] = int(candles['timestamp'][exit_index])
+        trade['exit_price'] = exit_price
+        trade['pnl'] = (exit_price / entry_price - 1) * 100 * side
+        trades.append(trade)
+
+        cursor = exit_index + 1
+
+    return BacktestResult(trades, len(candles))
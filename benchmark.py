@@ -0,0 +1,291 @@
+# Benchmarks del hot path del procesamiento de ticks.
+# Micro: cada etapa por separado (json.loads del mensaje contra el decoder de connectors/decoder.py, timestamps de
+# Bitmex, construcción de Candle / OrderStatus, updates del libro de órdenes local, parse_trades, _check_signal de
+# Technical y Breakout, _check_tp_sl).
+# Macro: ticks sintéticos de aggTrade por el camino completo (_on_message -> parse_trades -> check_trade) con
+# ReplayBinanceClient, para distintas cantidades de estrategias y de ticks.
+# De cada etapa reporta percentiles de latencia y throughput. Los resultados se guardan en .benchmarks/<commit>.json
+# y, si existe .benchmarks/baseline.json (o el archivo pasado con --compare), se comparan automáticamente.
+#
+# Uso:
+#   python benchmark.py                                   # escalas por defecto
+#   python benchmark.py --strategies 1 50 500 --ticks 1000 100000 1000000
+#   python benchmark.py --set-baseline                    # guarda estos resultados como baseline
+#   python benchmark.py --compare .benchmarks/abc1234.json
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import subprocess
+import time
+import typing
+
+import dateutil.parser
+import numpy as np
+
+from models import *
+from replay import ReplayBinanceClient
+from connectors.order_book import BinanceOrderBook
+from connectors.decoder import JSON_BACKEND, loads, binance_message_type, decode_agg_trade
+from strategies import TechnicalStrategy, BreakoutStrategy
+
+logger = logging.getLogger()
+
+BENCHMARKS_DIR = ".benchmarks"
+BASELINE_PATH = os.path.join(BENCHMARKS_DIR, "baseline.json")
+
+TF_MS = 60000
+START_TS = 1700000000000
+TECHNICAL_PARAMS = {"ema_fast": 12, "ema_slow": 26, "ema_signal": 9, "rsi_length": 14}
+BREAKOUT_PARAMS = {"min_volume": 50}
+
+
+def _contract(symbol: str) -> Contract:
+    return Contract({'symbol': symbol, 'baseAsset': symbol[:-4], 'quoteAsset': "USDT", 'pricePrecision': 2,
+                     'quantityPrecision': 3}, "binance_futures")
+
+
+def _historical_candles(count: int, last_ts: int) -> typing.List[Candle]:
+    candles = []
+    price = 100.
+    for i in range(count):
+        price *= 1 + random.gauss(0, 0.002)
+        ts = last_ts - (count - 1 - i) * TF_MS
+        candles.append(Candle([ts, price, price * 1.001, price * 0.999, price, 10.], "1m", "binance_futures"))
+
+    return candles
+
+
+def _new_strategy(client, contract: Contract, index: int):
+    if index % 2 == 0:
+        strategy = TechnicalStrategy(client, contract, "Binance", "1m", 1, 2, 2, TECHNICAL_PARAMS)
+    else:
+        strategy = BreakoutStrategy(client, contract, "Binance", "1m", 1, 2, 2, BREAKOUT_PARAMS)
+
+    strategy.load_candles(_historical_candles(300, START_TS))
+
+    return strategy
+
+
+# Mensajes aggTrade sintéticos: random walk del precio, repartidos entre los symbols, unos 20 trades por segundo
+def _synthetic_messages(count: int, symbols: typing.List[str]) -> typing.List[typing.Tuple[int, str]]:
+    rng = np.random.default_rng(count)
+    prices = 100 * np.exp(np.cumsum(rng.normal(0, 0.0005, count)))
+    quantities = rng.exponential(0.5, count)
+    timestamps = START_TS + np.cumsum(rng.integers(0, 100, count))
+
+    messages = []
+    for i in range(count):
+        ts = int(timestamps[i])
+        messages.append((ts, json.dumps({"e": "aggTrade", "E": ts, "s": symbols[i % len(symbols)], "a": i,
+                                         "p": f"{prices[i]:.2f}", "q": f"{quantities[i]:.3f}", "f": i, "l": i,
+                                         "T": ts, "m": bool(i % 2)})))
+
+    return messages
+
+
+def _summary(latencies_ns: np.ndarray, elapsed: float) -> typing.Dict[str, float]:
+    latencies_us = latencies_ns / 1000
+
+    return {"count": int(len(latencies_ns)),
+            "p50_us": float(np.percentile(latencies_us, 50)),
+            "p90_us": float(np.percentile(latencies_us, 90)),
+            "p99_us": float(np.percentile(latencies_us, 99)),
+            "max_us": float(np.max(latencies_us)),
+            "throughput": len(latencies_ns) / elapsed if elapsed > 0 else 0.}
+
+
+# Mide cada llamada a func(i) por separado
+def _measure(func: typing.Callable[[int], typing.Any], iterations: int) -> typing.Dict[str, float]:
+    latencies = np.empty(iterations, dtype=np.int64)
+    clock = time.perf_counter_ns
+
+    start = time.perf_counter()
+    for i in range(iterations):
+        t0 = clock()
+        func(i)
+        latencies[i] = clock() - t0
+    elapsed = time.perf_counter() - start
+
+    return _summary(latencies, elapsed)
+
+
+def run_micro(iterations: int) -> typing.Dict[str, typing.Dict[str, float]]:
+    results = dict()
+
+    messages = [m for _, m in _synthetic_messages(1000, ["BTCUSDT"])]
+    results['json_loads'] = _measure(lambda i: json.loads(messages[i % 1000]), iterations)
+    # lo que hace _on_message() de Binance con un aggTrade: clasificar el texto y decodificarlo con el backend rápido
+    results[f'{JSON_BACKEND}_loads'] = _measure(lambda i: loads(messages[i % 1000]), iterations)
+    results['classify_message'] = _measure(lambda i: binance_message_type(messages[i % 1000]), iterations)
+    results['decode_agg_trade'] = _measure(lambda i: decode_agg_trade(messages[i % 1000]), iterations)
+
+    # timestamps de los trades de Bitmex: dateutil contra el parser de formato fijo de models.py
+    timestamps = ["2023-11-14T22:13:%02d.%03dZ" % (i % 60, i % 1000) for i in range(1000)]
+    results['bitmex_isoparse'] = _measure(lambda i: int(dateutil.parser.isoparse(timestamps[i % 1000]).timestamp()
+                                                        * 1000), iterations)
+    results['bitmex_timestamp_ms'] = _measure(lambda i: bitmex_timestamp_ms(timestamps[i % 1000]), iterations)
+
+    kline = [START_TS, "100.5", "101.0", "99.5", "100.7", "1234.5", START_TS + 59999, "0", 100, "0", "0", "0"]
+    results['candle_init'] = _measure(lambda i: Candle(kline, "1m", "binance_futures"), iterations)
+
+    order = {"orderId": 1, "status": "FILLED", "avgPrice": "100.5", "executedQty": "0.010"}
+    results['order_status_init'] = _measure(lambda i: OrderStatus(order, "binance_futures"), iterations)
+
+    # un nivel de un libro de 1000 niveles por lado, y los mejores 10 niveles
+    book = BinanceOrderBook("BTCUSDT", futures=True)
+    book.load_snapshot({"lastUpdateId": 0, "bids": [[100. - j * 0.1, 1.] for j in range(1, 1001)],
+                        "asks": [[100. + j * 0.1, 1.] for j in range(1, 1001)]})
+    results['order_book_set_level'] = _measure(lambda i: book.asks.set(100. + (i % 1000 + 1) * 0.1, 1. + i % 3),
+                                               iterations)
+    results['order_book_top_10'] = _measure(lambda i: book.top(10), iterations)
+
+    contract = _contract("BTCUSDT")
+    client = ReplayBinanceClient({contract.symbol: contract})
+
+    # parse_trades dentro de la misma vela (el caso más común)
+    strategy = _new_strategy(client, contract, 1)
+    client.replay_now_ms = START_TS
+    results['parse_trades_same_candle'] = _measure(lambda i: strategy.parse_trades(100. + (i % 7) * 0.01, 0.01,
+                                                                                   START_TS + 1), iterations)
+
+    # parse_trades que abre una vela nueva en cada llamada
+    strategy = _new_strategy(client, contract, 1)
+
+    def new_candle(i: int):
+        ts = START_TS + (i + 1) * TF_MS
+        client.replay_now_ms = ts
+        strategy.parse_trades(100., 0.01, ts)
+
+    results['parse_trades_new_candle'] = _measure(new_candle, iterations)
+
+    # _check_signal de Technical: se mide con una vela nueva cerrada antes de cada llamada (el caso real)
+    technical = _new_strategy(client, contract, 0)
+
+    def technical_signal(i: int):
+        ts = START_TS + (i + 1) * TF_MS
+        technical.candles.append(ts, 100., 100., 100., 100. + (i % 11) * 0.1, 1.)
+        technical._check_signal()
+
+    results['technical_check_signal'] = _measure(technical_signal, iterations)
+
+    breakout = _new_strategy(client, contract, 1)
+    results['breakout_check_signal'] = _measure(lambda i: breakout._check_signal(), iterations)
+
+    # _check_tp_sl con un trade abierto que no llega ni al TP ni al SL
+    trade = Trade({"time": START_TS, "entry_price": float(breakout.candles.close[-1]), "contract": contract,
+                   "strategy": "Breakout", "side": "long", "status": "open", "pnl": 0, "quantity": 1,
+                   "entry_id": 1})
+    results['check_tp_sl'] = _measure(lambda i: breakout._check_tp_sl(trade), iterations)
+
+    return results
+
+
+def run_macro(strategies_count: int, ticks: int, symbols_count: int) -> typing.Dict[str, float]:
+    symbols = [f"SYM{i}USDT" for i in range(min(symbols_count, strategies_count))]
+    contracts = {s: _contract(s) for s in symbols}
+
+    client = ReplayBinanceClient(contracts, balances={"USDT": 1000000})
+    for i in range(strategies_count):
+        client.add_strategy(i, _new_strategy(client, contracts[symbols[i % len(symbols)]], i))
+
+    messages = _synthetic_messages(ticks, symbols)
+    latencies = np.empty(ticks, dtype=np.int64)
+    clock = time.perf_counter_ns
+    on_message = client._on_message
+
+    start = time.perf_counter()
+    for i, (received_ms, msg) in enumerate(messages):
+        client.replay_now_ms = received_ms
+        t0 = clock()
+        on_message(None, msg)
+        latencies[i] = clock() - t0
+    elapsed = time.perf_counter() - start
+
+    return _summary(latencies, elapsed)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+# Compara contra un baseline y devuelve las etapas cuya latencia p50 empeoró más que el threshold
+def compare(results: typing.Dict, baseline: typing.Dict, threshold: float) -> typing.List[str]:
+    regressions = []
+
+    print(f"\nComparison against {baseline.get('commit', '?')} (threshold {threshold:.0%})")
+    print(f"{'stage':45} {'p50 base':>10} {'p50 now':>10} {'change':>9}")
+
+    for stage, current in results['results'].items():
+        if stage not in baseline['results']:
+            continue
+
+        previous = baseline['results'][stage]
+        change = current['p50_us'] / previous['p50_us'] - 1 if previous['p50_us'] > 0 else 0.
+        flag = ""
+        if change > threshold:
+            regressions.append(stage)
+            flag = "  REGRESSION"
+
+        print(f"{stage:45} {previous['p50_us']:>10.2f} {current['p50_us']:>10.2f} {change:>+9.1%}{flag}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the tick-processing hot path")
+    parser.add_argument("--strategies", type=int, nargs="+", default=[1, 50, 500])
+    parser.add_argument("--ticks", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--symbols", type=int, default=10, help="symbols the strategies are spread across")
+    parser.add_argument("--iterations", type=int, default=100000, help="calls per micro benchmark")
+    parser.add_argument("--compare", default=BASELINE_PATH, help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="p50 slowdown reported as a regression")
+    parser.add_argument("--set-baseline", action="store_true", help="save these results as the baseline")
+    args = parser.parse_args()
+
+    random.seed(0)
+
+    results = {"commit": _git_commit(), "time": int(time.time()), "results": dict()}
+
+    print(f"{'stage':45} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} {'max us':>10} {'per sec':>12}")
+
+    def report(stage: str, summary: typing.Dict[str, float]):
+        results['results'][stage] = summary
+        print(f"{stage:45} {summary['p50_us']:>9.2f} {summary['p90_us']:>9.2f} {summary['p99_us']:>9.2f} "
+              f"{summary['max_us']:>10.2f} {summary['throughput']:>12.0f}")
+
+    for stage, summary in run_micro(args.iterations).items():
+        report(stage, summary)
+
+    for strategies_count in args.strategies:
+        for ticks in args.ticks:
+            report(f"on_message_{strategies_count}_strategies_{ticks}_ticks",
+                   run_macro(strategies_count, ticks, args.symbols))
+
+    os.makedirs(BENCHMARKS_DIR, exist_ok=True)
+    results_path = os.path.join(BENCHMARKS_DIR, f"{results['commit']}.json")
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {results_path}")
+
+    regressions = []
+    if os.path.exists(args.compare) and os.path.abspath(args.compare) != os.path.abspath(results_path):
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+    if args.set_baseline:
+        shutil.copyfile(results_path, BASELINE_PATH)
+        print(f"Baseline updated: {BASELINE_PATH}")
+
+    if len(regressions) > 0:
+        raise SystemExit(f"{len(regressions)} benchmark(s) slower than the baseline")
+
+
+if __name__ == '__main__':
+    main()
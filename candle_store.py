@@ -0,0 +1,125 @@
+# Caché en disco de las velas históricas (SQLite, en candles.db al lado de database.db), por
+# (platform, symbol, timeframe). Antes cada vez que se prendía una estrategia se bajaban de cero las últimas 1000
+# velas (500 en Bitmex). Con el caché sólo se piden las velas que faltan desde la última guardada.
+# Las velas se devuelven en formato columnar (CANDLE_DTYPE), así que también sirven para backtest.run_backtest().
+import logging
+import sqlite3
+import threading
+import typing
+
+import numpy as np
+
+from models import *
+from strategies import TF_EQUIV
+from history import HISTORY_PAGE_SIZE, download_history
+
+logger = logging.getLogger()
+
+CANDLES_DB = "candles.db"
+
+# Si desde la última vela guardada faltan más páginas que esto, no relleno el hueco (serían demasiados requests) y
+# sólo bajo las últimas velas, como sin caché
+MAX_GAP_FILL_PAGES = 20
+
+
+class CandleStore:
+    def __init__(self, path: str = CANDLES_DB):
+        # el caché se puede usar desde el thread de la interface y desde otros (optimizador, backtests...)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        self.conn.execute("CREATE TABLE IF NOT EXISTS candles (platform TEXT, symbol TEXT, timeframe TEXT, "
+                          "timestamp INTEGER, open REAL, high REAL, low REAL, close REAL, volume REAL, "
+                          "PRIMARY KEY (platform, symbol, timeframe, timestamp)) WITHOUT ROWID")
+        self.conn.commit()
+
+    # Guarda las velas reemplazando las que ya estaban (la última vela guardada puede haber quedado incompleta)
+    def save(self, platform: str, symbol: str, timeframe: str, candles: np.ndarray):
+        rows = [(platform, symbol, timeframe, int(c['timestamp']), float(c['open']), float(c['high']),
+                 float(c['low']), float(c['close']), float(c['volume'])) for c in candles]
+
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+
+    def get(self, platform: str, symbol: str, timeframe: str, start: typing.Optional[int] = None,
+            end: typing.Optional[int] = None, limit: typing.Optional[int] = None) -> np.ndarray:
+
+        """
+        Stored candles, oldest first.
+        :param start: first timestamp (ms) included
+        :param end: last timestamp (ms) included
+        :param limit: only return the most recent `limit` candles of the range
+        :return: structured array with CANDLE_DTYPE
+        """
+
+        sql_statement = "SELECT timestamp, open, high, low, close, volume FROM candles " \
+                        "WHERE platform = ? AND symbol = ? AND timeframe = ?"
+        params = [platform, symbol, timeframe]
+
+        if start is not None:
+            sql_statement += " AND timestamp >= ?"
+            params.append(start)
+        if end is not None:
+            sql_statement += " AND timestamp <= ?"
+            params.append(end)
+
+        # las más nuevas primero para poder cortar con LIMIT, después las doy vuelta
+        sql_statement += " ORDER BY timestamp DESC"
+        if limit is not None:
+            sql_statement += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            rows = self.conn.execute(sql_statement, params).fetchall()
+
+        return np.array(rows[::-1], dtype=CANDLE_DTYPE)
+
+    def last_timestamp(self, platform: str, symbol: str, timeframe: str) -> typing.Optional[int]:
+        with self._lock:
+            row = self.conn.execute("SELECT MAX(timestamp) FROM candles WHERE platform = ? AND symbol = ? "
+                                    "AND timeframe = ?", (platform, symbol, timeframe)).fetchone()
+
+        return row[0]
+
+    def load(self, client, contract: Contract, timeframe: str) -> typing.List[Candle]:
+
+        """
+        Replacement for client.get_historical_candles(contract, timeframe) that only downloads the candles missing
+        since the last stored one.
+        :param client: BinanceClient or BitmexClient
+        :return: the most recent contiguous candles (as many as one get_historical_candles() request), or an empty
+        list if the download failed
+        """
+
+        platform = client.platform
+        page_size = HISTORY_PAGE_SIZE[platform]
+        tf_ms = TF_EQUIV[timeframe] * 1000
+
+        last_ts = self.last_timestamp(platform, contract.symbol, timeframe)
+        gap_fill = last_ts is not None and (client.now_ms() - last_ts) / tf_ms <= page_size * MAX_GAP_FILL_PAGES
+
+        if gap_fill:
+            # vuelvo a pedir la última vela guardada, ya que pudo haber quedado incompleta
+            candles = download_history(client, contract, timeframe, last_ts)
+        else:
+            candles = candles_to_array(client.get_historical_candles(contract, timeframe))
+
+        # Siempre viene al menos la vela actual, así que si no vino nada falló el request
+        if len(candles) == 0:
+            return []
+
+        self.save(platform, contract.symbol, timeframe, candles)
+
+        logger.info("%s %s %s: %s candles downloaded (%s)", platform, contract.symbol, timeframe, len(candles),
+                    "gap fill" if gap_fill else "full download")
+
+        stored = self.get(platform, contract.symbol, timeframe, limit=page_size)
+
+        # si alguna vez no se rellenó un hueco (ver MAX_GAP_FILL_PAGES), me quedo con las velas posteriores. Los huecos
+        # chicos son velas que el exchange no tiene (Bitmex a veces no las trae) y quedan como antes.
+        gaps = np.nonzero(np.diff(stored['timestamp']) > page_size * tf_ms)[0]
+        if len(gaps) > 0:
+            stored = stored[gaps[-1] + 1:]
+
+        return array_to_candles(stored)
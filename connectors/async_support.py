@@ -0,0 +1,320 @@
+# Piezas compartidas por AsyncBinanceClient y AsyncBitmexClient (connectors/binance_async.py y bitmex_async.py).
+#
+# En los clientes asyncio el event loop sólo hace I/O (REST con aiohttp y el websocket) y el procesamiento liviano
+# de los mensajes (precios, pnl). Las estrategias siguen siendo sincrónicas, así que:
+#   - StrategyWorker les pasa los trades en un thread aparte, en el mismo orden en que llegaron;
+#   - BlockingClient es lo que reciben como client: cuando una estrategia pide algo al exchange (place_order(),
+#     get_trade_size()...) la corutina corre en el loop y el thread de la estrategia espera el resultado.
+# Así un request REST lento nunca frena el procesamiento de los datos de mercado.
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import queue
+import threading
+import time
+import typing
+from urllib.parse import urlencode
+
+import aiohttp
+import yarl
+
+from connectors.http_session import IDEMPOTENT_METHODS, RETRY_STATUS_CODES, LatencyStats, RequestSteps
+from connectors.ws_pool import StreamShards, MAX_STREAMS_PER_CONNECTION
+from connectors.ws_health import ConnectionHealth, keep_alive
+
+logger = logging.getLogger()
+
+# Errores en los que el request no llegó a salir. aiohttp distingue el timeout de conexión del de lectura recién
+# desde la 3.10; antes los dos son ServerTimeoutError y se tratan como de lectura (no se reintenta un POST).
+CONNECT_ERRORS = (aiohttp.ClientConnectorError,) + ((aiohttp.ConnectionTimeoutError,)
+                                                    if hasattr(aiohttp, "ConnectionTimeoutError") else ())
+
+
+def create_async_session(pool_size: int, timeout: typing.Tuple[float, float],
+                         headers: typing.Optional[typing.Dict] = None) -> aiohttp.ClientSession:
+    connector = aiohttp.TCPConnector(limit_per_host=pool_size)
+    client_timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+
+    return aiohttp.ClientSession(connector=connector, timeout=client_timeout, headers=headers)
+
+
+async def timed_async_request(session: aiohttp.ClientSession, stats: LatencyStats, method: str, base_url: str,
+                              endpoint: str, data: typing.Dict, headers: typing.Optional[typing.Dict] = None,
+                              max_retries: int = 2,
+                              backoff_factor: float = 0.1) -> typing.Tuple[int, typing.Any, typing.Mapping]:
+
+    """
+    Same retry policy as connectors.http_session.create_session(): connection errors are always retried, read
+    errors (timeout or connection lost while waiting for the response) and 5xx responses only for GET / PUT / DELETE.
+    :return: (status code, decoded json body, response headers)
+    """
+
+    # armo el query string con urlencode(), igual que el que se firma en _generate_signature(), y le digo a yarl
+    # que ya está codificado para que no lo cambie (aiohttp además no acepta bools como params)
+    url = base_url + endpoint
+    if len(data) > 0:
+        url += "?" + urlencode(data)
+    url = yarl.URL(url, encoded=True)
+
+    start = time.perf_counter()
+    retry = 0
+
+    try:
+        while True:
+            try:
+                async with session.request(method, url, headers=headers) as response:
+                    retryable = response.status in RETRY_STATUS_CODES and method in IDEMPOTENT_METHODS
+                    if not retryable or retry >= max_retries:
+                        return response.status, await response.json(content_type=None), response.headers
+            except CONNECT_ERRORS:
+                if retry >= max_retries:
+                    raise
+            except (asyncio.TimeoutError, aiohttp.ServerDisconnectedError, aiohttp.ClientOSError,
+                    aiohttp.ClientPayloadError):
+                # se cortó mientras se esperaba la respuesta: el exchange pudo haber recibido el request
+                if method not in IDEMPOTENT_METHODS or retry >= max_retries:
+                    raise
+
+            retry += 1
+            await asyncio.sleep(backoff_factor * 2 ** (retry - 1))
+    finally:
+        stats.record(method + " " + endpoint, (time.perf_counter() - start) * 1000)
+
+
+# Como connectors.http_session.run_steps(), pero esperando cada request de la corutina make_request
+async def run_async_steps(steps: RequestSteps, make_request: typing.Callable):
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(await make_request(*request))
+    except StopIteration as result:
+        return result.value
+
+
+# Cliente sincrónico para las estrategias y el OrderTracker, que corren fuera del event loop. Los atributos se leen
+# directo del cliente asyncio y sus corutinas (place_order(), get_balances()...) se ejecutan en el loop.
+class BlockingClient:
+    def __init__(self, client, timeout: float = 30.0):
+        self._client = client
+        self._timeout = timeout
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._client, name)
+
+        if inspect.iscoroutinefunction(attr):
+            return functools.partial(self._run, attr)
+
+        return attr
+
+    def _run(self, coroutine_function, *args, **kwargs):
+        loop = self._client.loop
+
+        # esperar desde el mismo loop lo dejaría trabado para siempre
+        if loop is None or threading.get_ident() == self._client.loop_thread_id:
+            raise RuntimeError("BlockingClient can't be used from the event loop thread, await the client instead")
+
+        future = asyncio.run_coroutine_threadsafe(coroutine_function(*args, **kwargs), loop)
+        return future.result(self._timeout)
+
+
+# Thread que le pasa los trades a las estrategias, en orden, fuera del event loop
+class StrategyWorker:
+    def __init__(self, client):
+        self._client = client
+        self._queue = queue.SimpleQueue()
+        self._thread: typing.Optional[threading.Thread] = None
+        self._running = False
+
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    # Los trades que quedaron en la cola se descartan
+    def stop(self):
+        self._running = False
+        self._queue.put(None)
+
+    def submit(self, symbol: str, price: float, size: float, timestamp: int):
+        self._queue.put((symbol, price, size, timestamp))
+
+    # Corre la función en el thread del worker, en orden con los trades (por ejemplo Strategy.backfill_candles())
+    def call(self, function: typing.Callable, *args):
+        self._queue.put(functools.partial(function, *args))
+
+    @property
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None or not self._running:
+                break
+
+            if callable(item):
+                try:
+                    item()
+                except Exception as e:
+                    logger.error("Error in %s strategy worker call: %s", self._client.platform, e)
+                continue
+
+            symbol, price, size, timestamp = item
+
+            for strat in self._client._strategies_by_symbol.get(symbol, ()):
+                try:
+                    strat.on_trade(price, size, timestamp)
+                except Exception as e:
+                    logger.error("Error in %s strategy %s on %s: %s", self._client.platform, strat.strat_name,
+                                 symbol, e)
+
+
+# Lee los mensajes de una conexión abierta con ws_connect(..., autoping=False) hasta que se cierre. Los pings y pongs
+# se contestan y miden acá, y keep_alive() la cierra si no contesta o (si expects_data()) deja de recibir mensajes.
+async def read_messages(ws: aiohttp.ClientWebSocketResponse, health: ConnectionHealth, on_message: typing.Callable,
+                        on_error: typing.Optional[typing.Callable] = None,
+                        expects_data: typing.Callable[[], bool] = lambda: True):
+    pinger = asyncio.create_task(keep_alive(ws, health, expects_data))
+
+    try:
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                health.on_message(len(msg.data))
+                on_message(ws, msg.data)
+            elif msg.type == aiohttp.WSMsgType.PING:
+                await ws.pong(msg.data)
+            elif msg.type == aiohttp.WSMsgType.PONG:
+                health.on_pong_payload(msg.data)
+            elif msg.type == aiohttp.WSMsgType.ERROR:
+                if on_error is not None:
+                    on_error(ws, str(ws.exception()))
+                break
+    finally:
+        pinger.cancel()
+
+
+# Versión asyncio de connectors.ws_pool.BinanceStreamPool: una task del loop por conexión, con el mismo reparto de
+# streams (StreamShards) y la misma reconexión por shard. on_reconnect es una corutina.
+class AsyncBinanceStreamPool:
+    def __init__(self, session: aiohttp.ClientSession, url: str, on_message: typing.Callable,
+                 on_error: typing.Optional[typing.Callable] = None, on_open: typing.Optional[typing.Callable] = None,
+                 on_close: typing.Optional[typing.Callable] = None,
+                 on_reconnect: typing.Optional[typing.Callable] = None, max_streams: int = MAX_STREAMS_PER_CONNECTION):
+        self._session = session
+        self.url = url
+        self.on_message = on_message
+        self.on_error = on_error
+        self.on_open = on_open
+        self.on_close = on_close
+        self.on_reconnect = on_reconnect
+
+        self.shards = StreamShards(max_streams)
+        self._tasks: typing.Dict[int, asyncio.Task] = dict()
+        self._sockets: typing.Dict[int, aiohttp.ClientWebSocketResponse] = dict()
+        self._health: typing.Dict[int, ConnectionHealth] = dict()
+        self._ws_id = 1
+        self._closed = False
+
+    @property
+    def connected(self) -> bool:
+        return any(not ws.closed for ws in self._sockets.values())
+
+    @property
+    def connection_count(self) -> int:
+        return len(self._tasks)
+
+    async def subscribe(self, streams: typing.List[str]):
+        if self._closed:
+            return
+
+        for shard_id, shard_streams in self.shards.add(streams).items():
+            if shard_id in self._tasks:
+                await self._send(shard_id, "SUBSCRIBE", shard_streams)
+            else:
+                self._tasks[shard_id] = asyncio.create_task(self._run(shard_id))
+
+    async def unsubscribe(self, streams: typing.List[str]):
+        for shard_id, shard_streams in self.shards.remove(streams).items():
+            if shard_id not in self.shards.shard_ids():
+                await self._close_shard(shard_id)
+            else:
+                await self._send(shard_id, "UNSUBSCRIBE", shard_streams)
+
+        moves = self.shards.rebalance()
+        if moves is not None:
+            source, moved = moves
+            for shard_id, shard_streams in moved.items():
+                await self._send(shard_id, "SUBSCRIBE", shard_streams)
+            await self._close_shard(source)
+
+    async def close(self):
+        self._closed = True
+
+        for shard_id in list(self._tasks):
+            await self._close_shard(shard_id)
+
+    def stats(self) -> typing.Dict[int, typing.Dict]:
+        return {shard_id: health.stats() for shard_id, health in self._health.items()}
+
+    async def _run(self, shard_id: int):
+        health = self._health[shard_id] = ConnectionHealth("Binance connection " + str(shard_id))
+
+        while True:
+            try:
+                # los pings los manda keep_alive(), así se puede medir la latencia con sus pongs
+                async with self._session.ws_connect(self.url, autoping=False) as ws:
+                    self._sockets[shard_id] = ws
+                    health.on_open()
+                    logger.info("Binance Websocket connection %s opened", shard_id)
+
+                    # vuelve a suscribir sólo los streams de este shard
+                    streams = self.shards.streams(shard_id)
+                    await self._send(shard_id, "SUBSCRIBE", streams)
+                    if self.on_open is not None:
+                        self.on_open(ws)
+
+                    # las velas perdidas se piden antes de leer los trades nuevos
+                    if health.reconnects > 0 and self.on_reconnect is not None:
+                        await self.on_reconnect(streams)
+
+                    await read_messages(ws, health, self.on_message, self.on_error)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Binance error in the websocket task (connection %s): %s", shard_id, e)
+
+            health.on_close()
+            ws = self._sockets.pop(shard_id, None)
+            if self.on_close is not None:
+                self.on_close(ws)
+
+            await asyncio.sleep(health.reconnect_delay())
+
+    async def _send(self, shard_id: int, method: str, streams: typing.List[str]):
+        ws = self._sockets.get(shard_id)
+
+        # si la conexión todavía no se abrió, los streams se mandan al abrirse
+        if ws is None or ws.closed or len(streams) == 0:
+            return
+
+        data = dict()
+        data['method'] = method
+        data['params'] = streams
+        data['id'] = self._ws_id
+        self._ws_id += 1
+
+        try:
+            await ws.send_str(json.dumps(data))
+            logger.info("Binance: %s to: %s", method.lower(), ','.join(streams))
+        except Exception as e:
+            logger.error("Websocket error while sending %s to connection %s: %s", method, shard_id, e)
+
+    async def _close_shard(self, shard_id: int):
+        task = self._tasks.pop(shard_id)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        self._sockets.pop(shard_id, None)
+        self._health.pop(shard_id, None)
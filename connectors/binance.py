@@ -1,7 +1,6 @@
 import logging
 import time
 
-import requests
 import collections
 
 # libreria para hacer más fácil y clara la lectura de los print()
@@ -26,10 +25,61 @@ import json
 from models import *
 import typing
 
+import numpy as np
+
 from strategies import TechnicalStrategy, BreakoutStrategy
+from recorder import TickRecorder
+from connectors.order_tracker import OrderTracker
+from connectors.fill_ledger import FillLedger
+from connectors.order_batcher import OrderBatcher, OrderRequest
+from connectors.http_session import create_session, timed_request, run_steps, LatencyStats, RequestSteps
+from connectors.clock_sync import ClockSync, LagHistogram, CLOCK_SYNC_INTERVAL
+from connectors.request_scheduler import RequestScheduler, RateWindow, PRIORITY_ORDER, PRIORITY_NORMAL, PRIORITY_LOW
+from connectors.ws_pool import BinanceStreamPool
+from connectors.ws_health import ConnectionHealth, missed_candles, PING_INTERVAL, PING_TIMEOUT
+from connectors.order_book import BinanceOrderBook, DEPTH_SNAPSHOT_LIMIT
+from connectors.decoder import loads, binance_message_type, decode_agg_trade, decode_book_ticker, AGG_TRADE, \
+    BOOK_TICKER, DEPTH_UPDATE
 
 logger = logging.getLogger()
 
+# Los balances se mantienen al día con el user data stream del websocket y cada BALANCES_RECONCILE_INTERVAL segundos
+# se reconcilian con get_balances() por si se perdió algún mensaje. El listenKey del stream vence a los 60 minutos
+# si no se renueva.
+BALANCES_RECONCILE_INTERVAL = 60
+LISTEN_KEY_KEEPALIVE_INTERVAL = 30 * 60
+
+# Weight estimado de los endpoints que pesan más de 1 (se corrige con el X-MBX-USED-WEIGHT-1M de cada respuesta)
+# https://binance-docs.github.io/apidocs/futures/en/#limits
+REQUEST_WEIGHTS = {"/fapi/v1/klines": 5, "/api/v3/klines": 2, "/fapi/v2/account": 5, "/api/v3/account": 20,
+                   "/api/v3/exchangeInfo": 20, "/api/v3/myTrades": 20, "/api/v3/openOrders": 6,
+                   "/fapi/v1/depth": 20, "/api/v3/depth": 50, "/fapi/v1/batchOrders": 5}
+
+# Órdenes por request de /fapi/v1/batchOrders
+MAX_BATCH_ORDERS = 5
+MAX_BATCH_CANCELS = 10
+ORDER_ENDPOINTS = ("/fapi/v1/order", "/api/v3/order", "/fapi/v1/batchOrders")
+# históricos, balances y datos de los contratos: esperan si se está cerca del límite
+LOW_PRIORITY_ENDPOINTS = ("/fapi/v1/klines", "/api/v3/klines", "/fapi/v2/account", "/api/v3/account",
+                          "/fapi/v1/exchangeInfo", "/api/v3/exchangeInfo", "/api/v3/myTrades")
+
+# Stream de diferencias del libro de órdenes (ver connectors/order_book.py)
+DEPTH_CHANNEL = "depth@100ms"
+
+
+def create_request_scheduler(futures: bool) -> RequestScheduler:
+    if futures:
+        return RequestScheduler([RateWindow("weight_1m", 2400, 60, used_header="X-MBX-USED-WEIGHT-1M"),
+                                 RateWindow("orders_10s", 300, 10, used_header="X-MBX-ORDER-COUNT-10S",
+                                            orders_only=True),
+                                 RateWindow("orders_1m", 1200, 60, used_header="X-MBX-ORDER-COUNT-1M",
+                                            orders_only=True)])
+
+    return RequestScheduler([RateWindow("weight_1m", 6000, 60, used_header="X-MBX-USED-WEIGHT-1M"),
+                             RateWindow("orders_10s", 100, 10, used_header="X-MBX-ORDER-COUNT-10S", orders_only=True),
+                             RateWindow("orders_1d", 200000, 86400, used_header="X-MBX-ORDER-COUNT-1D",
+                                        orders_only=True)])
+
 
 # hacemos una clase que contendrá varios métodos relacionados
 class BinanceClient:
@@ -39,9 +89,47 @@ class BinanceClient:
     # sobre test o sobre real (true or false)
     # Incorporamos los datos de public_key y secret_key y los instanciamos en la clase main
     # el : a un argumento permite especificar el tipo de dato, para hacerlo tipado
-    def __init__(self, public_key: str, secret_key: str, testnet: bool, futures: bool):
+    def __init__(self, public_key: str, secret_key: str, testnet: bool, futures: bool, pool_size: int = 10,
+                 timeout: typing.Tuple[float, float] = (3.05, 10), max_retries: int = 2):
 
         self.futures = futures
+        self._init_config(public_key, secret_key, testnet)
+
+        # sesión keep-alive para los requests REST (ver connectors/http_session.py). timeout = (connect, read)
+        self._session = create_session(pool_size, max_retries)
+        self._timeout = timeout
+
+        self._init_state()
+
+        self._sync_clock()
+        self.contracts = self.get_contracts()
+        self.balances = self.get_balances()
+
+        # Los streams de mercado se reparten en varias conexiones de 200 streams como máximo (ver ws_pool.py).
+        # Cada conexión se abre cuando se le asigna su primer stream.
+        self.ws = BinanceStreamPool(self._wss_url, on_message=self._on_message, on_error=self._on_error,
+                                    on_open=self._on_open, on_close=self._on_close, on_reconnect=self._on_reconnect)
+
+        # user data stream (balances), en su propia conexión de websocket
+        self._user_ws: typing.Optional[websocket.WebSocketApp] = None
+
+        if "BTCUSDT" in self.contracts:
+            self.subscribe_channel([self.contracts["BTCUSDT"]], "bookTicker")
+
+        t = threading.Thread(target=self._start_user_stream, daemon=True)
+        t.start()
+
+        t = threading.Thread(target=self._maintain_balances, daemon=True)
+        t.start()
+
+        t = threading.Thread(target=self._maintain_clock, daemon=True)
+        t.start()
+
+        logger.info("Binance Futures Client succesfully initialized")
+
+    # urls y claves de la cuenta. Lo comparten BinanceClient y AsyncBinanceClient (connectors/binance_async.py).
+    def _init_config(self, public_key: str, secret_key: str, testnet: bool):
+
         # si es futuros uso las url de futuros, sino las de spot
         if self.futures:
             self.platform = "binance_futures"
@@ -67,33 +155,141 @@ class BinanceClient:
         # Este header se pide como requisito en los docs de Binance para pasar el APIKEY
         self._headers = {'X-MBX-APIKEY': self._public_key}
 
-        self.contracts = self.get_contracts()
-        self.balances = self.get_balances()
+    # Estado del cliente que no depende del transporte (requests/websocket-client o aiohttp): no se conecta a nada
+    # ni arranca threads. Lo usan BinanceClient, AsyncBinanceClient y ReplayBinanceClient (replay.py), así un
+    # atributo nuevo se agrega en un solo lugar.
+    def _init_state(self, orders_client=None):
 
+        """
+        :param orders_client: client used by the OrderTracker and the OrderBatcher, self by default (the async client
+        passes its BlockingClient)
+        """
+
+        if orders_client is None:
+            orders_client = self
+
+        # latencia de los requests por endpoint, ver self.latency.summary()
+        self.latency = LatencyStats()
+        # límites de requests del exchange, ver self.scheduler.stats()
+        self.scheduler = create_request_scheduler(self.futures)
+        # offset del reloj local con el del exchange, para las firmas y el atraso de los trades (ver clock_sync.py)
+        self.clock = ClockSync()
+        self.tick_lag = LagHistogram(self.platform)
+
+        self.contracts: typing.Dict[str, Contract] = dict()
+        self.balances: typing.Dict[str, Balance] = dict()
         self.prices = dict()
 
         # Agrego variable para almacenar las candles de cada estrategia que inicie
         # el Union significa que puede adoptar un valor u otro "Technical o Breakout"
         self.strategies: typing.Dict[int, typing.Union[TechnicalStrategy, BreakoutStrategy]] = dict()
 
+        # índice de las estrategias activas por symbol, para despachar los mensajes del websocket sólo a las
+        # estrategias de ese symbol (ver add_strategy() y remove_strategy())
+        self._strategies_by_symbol: typing.Dict[str, typing.Tuple] = dict()
+        self._strategies_lock = threading.Lock()
+
+        # trades abiertos de todas las estrategias, por symbol, para actualizar su pnl con cada cambio de precio
+        self.open_positions = OpenPositions()
+
+        # si no es None, graba los mensajes de trades crudos del websocket (ver start_recording())
+        self._recorder: typing.Optional[TickRecorder] = None
+
+        # un solo thread que sigue todas las órdenes pendientes de las estrategias (ver get_orders_status())
+        self.order_tracker = OrderTracker(orders_client)
+        # junta en un solo request las órdenes que las estrategias mandan casi al mismo tiempo (ver order_batcher.py)
+        self.order_batcher = OrderBatcher(orders_client)
+        # fills de las órdenes de Spot, para su precio promedio (ver fill_ledger.py)
+        self.fills = FillLedger()
+
         self.logs = []
 
-        self._ws_id = 1
-        self.ws: websocket.WebSocketApp
         self.reconnect = True
 
         self.ws_connected = False
-        self.ws_subscriptions = {"bookTicker": [], "aggTrade": []}
+        self.ws_subscriptions = {"bookTicker": [], "aggTrade": [], DEPTH_CHANNEL: []}
+        # libros de órdenes locales por symbol (ver subscribe_order_book())
+        self.order_books: typing.Dict[str, BinanceOrderBook] = dict()
 
-        t = threading.Thread(target=self._start_ws)
-        t.start()
-
-        logger.info("Binance Futures Client succesfully initialized")
+        # listen key del user data stream (balances)
+        self._listen_key: typing.Optional[str] = None
+        self.user_ws_health = ConnectionHealth("Binance user data stream")
 
     def _add_log(self, msg: str):
         logger.info("%s", msg)
         self.logs.append({"log": msg, "displayed": False})
 
+    # Las estrategias se agregan y quitan sólo con estos métodos, para mantener actualizado el índice symbol ->
+    # estrategias que usa _on_message(). Ambos diccionarios se reemplazan (copy-on-write) en vez de modificarse,
+    # así el thread del websocket y el de la interface siempre iteran una versión completa y nunca ven el error
+    # "dictionary changed size during iteration".
+    def add_strategy(self, b_index: int, strategy: typing.Union[TechnicalStrategy, BreakoutStrategy]):
+        with self._strategies_lock:
+            strategies = dict(self.strategies)
+            strategies[b_index] = strategy
+
+            by_symbol = dict(self._strategies_by_symbol)
+            by_symbol[strategy.contract.symbol] = by_symbol.get(strategy.contract.symbol, ()) + (strategy,)
+
+            self.strategies = strategies
+            self._strategies_by_symbol = by_symbol
+
+    def remove_strategy(self, b_index: int):
+        with self._strategies_lock:
+            strategies = dict(self.strategies)
+            strategy = strategies.pop(b_index, None)
+            if strategy is None:
+                return
+
+            by_symbol = dict(self._strategies_by_symbol)
+            symbol = strategy.contract.symbol
+            remaining = tuple(s for s in by_symbol.get(symbol, ()) if s is not strategy)
+            if len(remaining) > 0:
+                by_symbol[symbol] = remaining
+            else:
+                by_symbol.pop(symbol, None)
+
+            self.strategies = strategies
+            self._strategies_by_symbol = by_symbol
+
+        strategy.stop()
+
+    # Hora actual en milisegundos que usan las estrategias (por ejemplo para medir el atraso de los trades), corregida
+    # con el offset del reloj del exchange. El cliente de replay.py la reemplaza por la hora grabada.
+    def now_ms(self) -> int:
+        return self.clock.now_ms()
+
+    # https://binance-docs.github.io/apidocs/futures/en/#check-server-time
+    def _sync_clock(self):
+        self._run_steps(self._sync_clock_steps())
+
+    def _sync_clock_steps(self) -> RequestSteps:
+        sent = time.time()
+        if self.futures:
+            server_time = yield "GET", "/fapi/v1/time", dict()
+        else:
+            server_time = yield "GET", "/api/v3/time", dict()
+        received = time.time()
+
+        if server_time is not None:
+            self.clock.add_sample(sent, server_time['serverTime'], received)
+
+    def _maintain_clock(self):
+        while self.reconnect:
+            time.sleep(CLOCK_SYNC_INTERVAL)
+            self._sync_clock()
+
+    # Empieza a grabar los mensajes de trades crudos del websocket en path, para reproducirlos con replay.py
+    def start_recording(self, path: str):
+        self.stop_recording()
+        self._recorder = TickRecorder(path)
+
+    def stop_recording(self):
+        if self._recorder is not None:
+            recorder = self._recorder
+            self._recorder = None
+            recorder.close()
+
     # typing es una librería que nos permite asignar un dato como Objeto. Como Integer en java (en vez de int)
     # el _ delante del método, lo indica como privado de la clase. No lo puedo usar de cualquier instancia
     def _generate_signature(self, data: typing.Dict) -> str:
@@ -103,27 +299,22 @@ class BinanceClient:
 
     # method se refiere a los de Http (GET, POST, etc) y el endpoint apunta a la url que usaremos (ver bien test o real)
     def _make_request(self, method: str, endpoint: str, data: typing.Dict):
-        if method == "GET":
-            try:
-                response = requests.get(self._base_url + endpoint, params=data, headers=self._headers)
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
-        elif method == "POST":
-            try:
-                response = requests.post(self._base_url + endpoint, params=data, headers=self._headers)
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
-        elif method == "DELETE":
-            try:
-                response = requests.delete(self._base_url + endpoint, params=data, headers=self._headers)
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
-        else:
+        if method not in ("GET", "POST", "PUT", "DELETE"):
             raise ValueError()
 
+        # si esperó lugar, el timestamp de la firma puede haber quedado fuera del recvWindow
+        if self.scheduler.acquire(*self._request_cost(method, endpoint)) > 0:
+            self._sign_again(data)
+
+        try:
+            response = timed_request(self._session, self.latency, method, self._base_url + endpoint, endpoint,
+                                     self._timeout, params=data, headers=self._headers)
+        except Exception as e:
+            logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+            return None
+
+        self.scheduler.update(response.status_code, response.headers)
+
         if response.status_code == 200:
             return response.json()
         else:
@@ -132,25 +323,47 @@ class BinanceClient:
                          method, endpoint, response.json(), response.status_code)
             return None
 
+    def _sign_again(self, data: typing.Dict):
+        if 'signature' in data:
+            del data['signature']
+            data['timestamp'] = self.clock.now_ms()
+            data['signature'] = self._generate_signature(data)
+
+    # (prioridad, weight estimado, órdenes que crea) del request, para el scheduler
+    @staticmethod
+    def _request_cost(method: str, endpoint: str) -> typing.Tuple[int, int, int]:
+        weight = REQUEST_WEIGHTS.get(endpoint, 1)
+
+        if endpoint in ORDER_ENDPOINTS and method in ("POST", "DELETE"):
+            return PRIORITY_ORDER, weight, 1 if method == "POST" else 0
+        if endpoint in LOW_PRIORITY_ENDPOINTS:
+            return PRIORITY_LOW, weight, 0
+
+        return PRIORITY_NORMAL, weight, 0
+
+    # Los métodos REST son generadores de requests (ver run_steps() en connectors/http_session.py), que comparte
+    # AsyncBinanceClient: acá sólo se ejecutan con el _make_request() sincrónico.
+    def _run_steps(self, steps: RequestSteps):
+        return run_steps(steps, self._make_request)
+
     # --> refiere al tipo que va a devolver el método
     def get_contracts(self) -> typing.Dict[str, Contract]:
+        return self._run_steps(self._get_contracts_steps())
+
+    def _get_contracts_steps(self) -> RequestSteps:
 
         # agrego si es futuros o spot
         if self.futures:
-            exchange_info = self._make_request("GET", "/fapi/v1/exchangeInfo", dict())
+            exchange_info = yield "GET", "/fapi/v1/exchangeInfo", dict()
         else:
-            exchange_info = self._make_request("GET", "/api/v3/exchangeInfo", dict())
+            exchange_info = yield "GET", "/api/v3/exchangeInfo", dict()
         contracts = dict()
 
         if exchange_info is not None:
             for contract_data in exchange_info['symbols']:
-                # Aca lo hardcodeo a solo esos 4 contratos, ya que si paso toda la lista, estoy suscribiendo mas
-                # de los 200 que permite mandar binance por stream. Por ejemplo: btcusdt@bookTicker, btcusdt@aggTrade
-                # Ahí ya tengo 2. Si tengo más de 100 contratos (hay 306) estaría pasando muchos más de 200
-                # por ende, solo traerá los primeros 200 contratos (solo con bookticker) nunca llegará a
-                # aggTrade y el programa fallará.
-                #if contract_data['symbol'] in ['BTCUSDT', 'ETHUSDT', 'BNBUSDT', 'SOLUSDT']:
-                    # estructura de diccionario (key,data), siendo el pair la key y la data es toda la lista
+                # Traigo todos los contratos: el límite de 200 streams por conexión del websocket lo resuelve el pool
+                # de conexiones (ver ws_pool.py)
+                # estructura de diccionario (key,data), siendo el pair la key y la data es toda la lista
                 contracts[contract_data['symbol']] = Contract(contract_data, self.platform)
 
         # Sort keys of the dictionary alphabetically
@@ -158,16 +371,24 @@ class BinanceClient:
 
     # para definir el tipo de dato de contract, especifico su model (su clase).
     # a su vez, puedo especificar el tipo de dato que devuelve el método con -> y el typing correspondiente
-    def get_historical_candles(self, contract: Contract, interval: str) -> typing.List[Candle]:
+    def get_historical_candles(self, contract: Contract, interval: str,
+                               start_time: typing.Optional[int] = None) -> typing.List[Candle]:
+        return self._run_steps(self._get_historical_candles_steps(contract, interval, start_time))
+
+    def _get_historical_candles_steps(self, contract: Contract, interval: str,
+                                      start_time: typing.Optional[int] = None) -> RequestSteps:
         data = dict()
         data['symbol'] = contract.symbol
         data['interval'] = interval
         data['limit'] = 1000
+        # si paso start_time (ms) trae las 1000 velas desde ahí en vez de las últimas 1000
+        if start_time is not None:
+            data['startTime'] = start_time
 
         if self.futures:
-            raw_candles = self._make_request("GET", "/fapi/v1/klines", data)
+            raw_candles = yield "GET", "/fapi/v1/klines", data
         else:
-            raw_candles = self._make_request("GET", "/api/v3/klines", data)
+            raw_candles = yield "GET", "/api/v3/klines", data
 
         candles = []
 
@@ -177,14 +398,42 @@ class BinanceClient:
 
         return candles
 
+    # Una página de velas entre start_time y end_time (ms, incluidos), directo en formato columnar (CANDLE_DTYPE) sin
+    # crear objetos Candle. La usa history.download_history() para bajar rangos más largos que un request.
+    def get_candles_page(self, contract: Contract, interval: str, start_time: int,
+                         end_time: int) -> typing.Optional[np.ndarray]:
+        return self._run_steps(self._get_candles_page_steps(contract, interval, start_time, end_time))
+
+    def _get_candles_page_steps(self, contract: Contract, interval: str, start_time: int,
+                                end_time: int) -> RequestSteps:
+        data = dict()
+        data['symbol'] = contract.symbol
+        data['interval'] = interval
+        data['startTime'] = start_time
+        data['endTime'] = end_time
+        data['limit'] = 1000
+
+        if self.futures:
+            raw_candles = yield "GET", "/fapi/v1/klines", data
+        else:
+            raw_candles = yield "GET", "/api/v3/klines", data
+
+        if raw_candles is None:
+            return None
+
+        return binance_klines_to_array(raw_candles)
+
     def get_bid_ask(self, contract: Contract) -> typing.Dict[str, float]:
+        return self._run_steps(self._get_bid_ask_steps(contract))
+
+    def _get_bid_ask_steps(self, contract: Contract) -> RequestSteps:
         data = dict()
         data['symbol'] = contract.symbol
 
         if self.futures:
-            ob_data = self._make_request("GET", "/fapi/v1/ticker/bookTicker", data)
+            ob_data = yield "GET", "/fapi/v1/ticker/bookTicker", data
         else:
-            ob_data = self._make_request("GET", "/api/v3/ticker/bookTicker", data)
+            ob_data = yield "GET", "/api/v3/ticker/bookTicker", data
 
         if ob_data is not None:
             # si el contract.symbol no está en prices (al principio nunca estará), lo agrega.
@@ -197,20 +446,37 @@ class BinanceClient:
 
             return self.prices[contract.symbol]
 
+    # Snapshot del libro de órdenes, para BinanceOrderBook.load_snapshot()
+    def get_depth_snapshot(self, contract: Contract) -> typing.Optional[typing.Dict]:
+        return self._run_steps(self._get_depth_snapshot_steps(contract))
+
+    def _get_depth_snapshot_steps(self, contract: Contract) -> RequestSteps:
+        data = dict()
+        data['symbol'] = contract.symbol
+        data['limit'] = DEPTH_SNAPSHOT_LIMIT
+
+        if self.futures:
+            return (yield "GET", "/fapi/v1/depth", data)
+        else:
+            return (yield "GET", "/api/v3/depth", data)
+
     def get_balances(self) -> typing.Dict[str, Balance]:
+        return self._run_steps(self._get_balances_steps())
+
+    def _get_balances_steps(self) -> RequestSteps:
         # genero los datos para identificarse, para pasarle al make_request(). El timestamp lo saca de la hora local
         # de la pc, la cual debe estar sincronizada con el huso horario local, ya que sino podría fallar con
         # el time definido por Binance (en este caso) en su servidor.
         data = dict()
-        data['timestamp'] = int(time.time() * 1000)
+        data['timestamp'] = self.clock.now_ms()
         data['signature'] = self._generate_signature(data)
 
         balances = dict()
 
         if self.futures:
-            account_data = self._make_request("GET", "/fapi/v2/account", data)
+            account_data = yield "GET", "/fapi/v2/account", data
         else:
-            account_data = self._make_request("GET", "/api/v3/account", data)
+            account_data = yield "GET", "/api/v3/account", data
 
         if account_data is not None:
             if self.futures:
@@ -224,6 +490,29 @@ class BinanceClient:
 
     def place_order(self, contract: Contract, order_type: str, quantity: float, side: str,
                     price=None, tif=None) -> OrderStatus:
+        return self._run_steps(self._place_order_steps(contract, order_type, quantity, side, price, tif))
+
+    def _place_order_steps(self, contract: Contract, order_type: str, quantity: float, side: str,
+                           price=None, tif=None) -> RequestSteps:
+        data = self._order_data(contract, order_type, quantity, side, price, tif)
+        if not self.futures:
+            # la respuesta trae los fills de la orden, con los que se calcula el precio promedio
+            data['newOrderRespType'] = "FULL"
+
+        data['timestamp'] = self.clock.now_ms()
+        data['signature'] = self._generate_signature(data)
+
+        if self.futures:
+            order_status = yield "POST", "/fapi/v1/order", data
+        else:
+            order_status = yield "POST", "/api/v3/order", data
+
+        return (yield from self._order_status_steps(contract, order_status))
+
+    # Parámetros de una orden, para place_order() y place_orders()
+    @staticmethod
+    def _order_data(contract: Contract, order_type: str, quantity: float, side: str, price=None,
+                    tif=None) -> typing.Dict:
         data = dict()
         data['symbol'] = contract.symbol
         data['side'] = side.upper()
@@ -238,227 +527,459 @@ class BinanceClient:
         if tif is not None:
             data['timeInForce'] = tif
 
-        data['timestamp'] = int(time.time() * 1000)
+        return data
+
+    def place_orders(self, orders: typing.List[OrderRequest]) -> typing.List[typing.Optional[OrderStatus]]:
+
+        """
+        Place several orders with as few requests as possible (POST /fapi/v1/batchOrders, up to 5 orders each).
+        Binance Spot has no batch endpoint, so its orders are placed one by one.
+        :return: the OrderStatus of each order in the same order, None for the ones that failed
+        """
+
+        if not self.futures:
+            return [self.place_order(o.contract, o.order_type, o.quantity, o.side, o.price, o.tif) for o in orders]
+
+        return self._run_steps(self._place_orders_steps(orders))
+
+    def _place_orders_steps(self, orders: typing.List[OrderRequest]) -> RequestSteps:
+        statuses = []
+
+        for i in range(0, len(orders), MAX_BATCH_ORDERS):
+            batch = orders[i:i + MAX_BATCH_ORDERS]
+
+            response = yield "POST", "/fapi/v1/batchOrders", self._batch_orders_data(batch)
+            statuses.extend(self._batch_statuses(response, len(batch), "placing orders"))
+
+        return statuses
+
+    def _batch_orders_data(self, orders: typing.List[OrderRequest]) -> typing.Dict:
+        data = dict()
+        # los parámetros de cada orden van como strings
+        data['batchOrders'] = json.dumps([{k: str(v) for k, v in self._order_data(o.contract, o.order_type, o.quantity,
+                                                                                 o.side, o.price, o.tif).items()}
+                                          for o in orders])
+        data['timestamp'] = self.clock.now_ms()
         data['signature'] = self._generate_signature(data)
 
-        if self.futures:
-            order_status = self._make_request("POST", "/fapi/v1/order", data)
-        else:
-            order_status = self._make_request("POST", "/api/v3/order", data)
+        return data
 
-        if order_status is not None:
-            if not self.futures:
-                if order_status['status'] == "FILLED":
-                    order_status['avgPrice'] = self._get_execution_price(contract, order_status['orderId'])
-                else:
-                    order_status['avgPrice'] = 0
+    # Cada orden de la respuesta de /fapi/v1/batchOrders trae su estado o su error ({"code": -2019, "msg": ...})
+    def _batch_statuses(self, response: typing.Optional[typing.List[typing.Dict]], count: int,
+                        action: str) -> typing.List[typing.Optional[OrderStatus]]:
+        if response is None:
+            return [None] * count
 
-            order_status = OrderStatus(order_status, self.platform)
+        statuses = []
+
+        for result in response:
+            if 'code' in result:
+                logger.error("Binance error while %s: %s", action, result['msg'])
+                statuses.append(None)
+            else:
+                statuses.append(OrderStatus(result, self.platform))
 
-        return order_status
+        return statuses
 
     def cancel_order(self, contract: Contract, order_id: int) -> OrderStatus:
+        return self._run_steps(self._cancel_order_steps(contract, order_id))
+
+    def _cancel_order_steps(self, contract: Contract, order_id: int) -> RequestSteps:
         data = dict()
         data['orderId'] = order_id
         data['symbol'] = contract.symbol
-        data['timestamp'] = int(time.time() * 1000)
+        data['timestamp'] = self.clock.now_ms()
         data['signature'] = self._generate_signature(data)
 
         if self.futures:
-            order_status = self._make_request("DELETE", "/fapi/v1/order", data)
+            order_status = yield "DELETE", "/fapi/v1/order", data
         else:
-            order_status = self._make_request("DELETE", "/api/v3/order", data)
+            order_status = yield "DELETE", "/api/v3/order", data
+
+        return (yield from self._order_status_steps(contract, order_status))
+
+    def cancel_orders(self, contract: Contract,
+                      order_ids: typing.List[int]) -> typing.List[typing.Optional[OrderStatus]]:
+
+        """
+        Cancel several orders of the contract (DELETE /fapi/v1/batchOrders, up to 10 orders each, one by one on Spot).
+        :return: the OrderStatus of each order in the same order, None for the ones that failed
+        """
+
+        if not self.futures:
+            return [self.cancel_order(contract, order_id) for order_id in order_ids]
+
+        return self._run_steps(self._cancel_orders_steps(contract, order_ids))
+
+    def _cancel_orders_steps(self, contract: Contract, order_ids: typing.List[int]) -> RequestSteps:
+        statuses = []
+
+        for i in range(0, len(order_ids), MAX_BATCH_CANCELS):
+            batch = order_ids[i:i + MAX_BATCH_CANCELS]
+
+            response = yield "DELETE", "/fapi/v1/batchOrders", self._batch_cancel_data(contract, batch)
+            statuses.extend(self._batch_statuses(response, len(batch), "cancelling orders on " + contract.symbol))
+
+        return statuses
+
+    def _batch_cancel_data(self, contract: Contract, order_ids: typing.List[int]) -> typing.Dict:
+        data = dict()
+        data['symbol'] = contract.symbol
+        data['orderIdList'] = json.dumps(order_ids)
+        data['timestamp'] = self.clock.now_ms()
+        data['signature'] = self._generate_signature(data)
+
+        return data
+
+    # La respuesta de place_order(), cancel_order() o get_order_status() como OrderStatus. En Spot la API no trae el
+    # precio promedio, así que se calcula (y si hace falta se pide con _execution_price_steps()).
+    def _order_status_steps(self, contract: Contract, order_status: typing.Optional[typing.Dict]) -> RequestSteps:
+        if order_status is None:
+            return None
+
+        if not self.futures:
+            order_status['avgPrice'] = self._spot_avg_price(contract, order_status)
+            if order_status['avgPrice'] is None:
+                order_status['avgPrice'] = yield from self._execution_price_steps(contract, order_status['orderId'])
+
+        return OrderStatus(order_status, self.platform)
+
+    def _spot_avg_price(self, contract: Contract, order: typing.Dict) -> typing.Optional[float]:
+
+        """
+        For Binance Spot only, the equivalent of the 'avgPrice' key on the futures side, without extra requests:
+        from the 'fills' of a FULL order response, from the fill ledger (user data stream) or from
+        cummulativeQuoteQty / executedQty.
+        :param order: order as returned by the API
+        :return: None if the order doesn't carry enough information (see _execution_price_steps())
+        """
+
+        executed_qty = float(order.get('executedQty', 0))
+        if executed_qty == 0:
+            return 0
+
+        if len(order.get('fills', [])) > 0:
+            self.fills.add_fills(order['orderId'], order['fills'])
+
+        avg_price = self.fills.avg_price(order['orderId'], executed_qty)
 
-        if order_status is not None:
-            if not self.futures:
-                # Get the average execution price based on the recent trades
-                order_status['avgPrice'] = self._get_execution_price(contract, order_id)
-            order_status = OrderStatus(order_status, self.platform)
+        if avg_price is None and float(order.get('cummulativeQuoteQty', 0)) > 0:
+            avg_price = float(order['cummulativeQuoteQty']) / executed_qty
 
-        return order_status
+        if avg_price is None:
+            return None
+
+        return round(round(avg_price / contract.tick_size) * contract.tick_size, 8)
 
-    def _get_execution_price(self, contract: Contract, order_id: int) -> float:
+    def _execution_price_steps(self, contract: Contract, order_id: int) -> RequestSteps:
 
         """
-        For Binance Spot only, find the equivalent of the 'avgPrice' key on the futures side.
-        The average price is the weighted sum of each trade price related to the order_id
+        Fallback of _spot_avg_price(): the weighted average price of the trades of the order
         :param contract:
         :param order_id:
         :return:
         """
 
         data = dict()
-        data['timestamp'] = int(time.time() * 1000)
+        data['timestamp'] = self.clock.now_ms()
         data['symbol'] = contract.symbol
+        data['orderId'] = order_id
         data['signature'] = self._generate_signature(data)
 
-        trades = self._make_request("GET", "/api/v3/myTrades", data)
+        trades = yield "GET", "/api/v3/myTrades", data
 
         avg_price = 0
 
-        if trades is not None:
-
-            executed_qty = 0
-            for t in trades:
-                if t['orderId'] == order_id:
-                    executed_qty += float(t['qty'])
-
-            for t in trades:
-                if t['orderId'] == order_id:
-                    fill_pct = float(t['qty']) / executed_qty
-                    avg_price += (float(t['price']) * fill_pct)  # Weighted sum
+        if trades is not None and len(trades) > 0:
+            executed_qty = sum(float(t['qty']) for t in trades)
+            avg_price = sum(float(t['price']) * float(t['qty']) for t in trades) / executed_qty  # Weighted sum
+            self.fills.update(order_id, executed_qty, avg_price * executed_qty)
 
         return round(round(avg_price / contract.tick_size) * contract.tick_size, 8)
 
     def get_order_status(self, contract: Contract, order_id: int) -> OrderStatus:
+        return self._run_steps(self._get_order_status_steps(contract, order_id))
+
+    def _get_order_status_steps(self, contract: Contract, order_id: int) -> RequestSteps:
         data = dict()
-        data['timestamp'] = int(time.time() * 1000)
+        data['timestamp'] = self.clock.now_ms()
         data['symbol'] = contract.symbol
         data['orderId'] = order_id
         data['signature'] = self._generate_signature(data)
 
         if self.futures:
-            order_status = self._make_request("GET", "/fapi/v1/order", data)
+            order_status = yield "GET", "/fapi/v1/order", data
         else:
-            order_status = self._make_request("GET", "/api/v3/order", data)
+            order_status = yield "GET", "/api/v3/order", data
 
-        if order_status is not None:
-            if not self.futures:
-                if order_status['status'] == "FILLED":
-                    # Get the average execution price based on the recent trades
-                    order_status['avgPrice'] = self._get_execution_price(contract, order_id)
-                else:
-                    order_status['avgPrice'] = 0
-
-            order_status = OrderStatus(order_status, self.platform)
+        return (yield from self._order_status_steps(contract, order_status))
 
-        return order_status
+    # Estado de varias órdenes del mismo symbol con una sola consulta de las órdenes abiertas. Sólo las que ya no
+    # están abiertas (llenas, canceladas...) se consultan una por una para tener su precio promedio.
+    def get_orders_status(self, contract: Contract,
+                          order_ids: typing.List[int]) -> typing.Optional[typing.Dict[int, OrderStatus]]:
+        return self._run_steps(self._get_orders_status_steps(contract, order_ids))
 
-    def _start_ws(self):
+    def _get_orders_status_steps(self, contract: Contract, order_ids: typing.List[int]) -> RequestSteps:
+        data = dict()
+        data['timestamp'] = self.clock.now_ms()
+        data['symbol'] = contract.symbol
+        data['signature'] = self._generate_signature(data)
 
-        # lleva como argumentos: url y callback functions
-        self.ws = websocket.WebSocketApp(self._wss_url, on_open=self._on_open, on_close=self._on_close,
-                                         on_error=self._on_error, on_message=self._on_message)
+        if self.futures:
+            open_orders = yield "GET", "/fapi/v1/openOrders", data
+        else:
+            open_orders = yield "GET", "/api/v3/openOrders", data
 
-        # inicia el loop infinito esperando mensajes del websocket server
-        # Si llega a dar error o se cae la conexión, espera 2 segundos para reconectarse automaticamente
-        while True:
-            try:
-                if self.reconnect:
-                    self.ws.run_forever()
-                else:
-                    break
-            except Exception as e:
-                logger.error("Binance error in run_forever() method: %s", e)
-            time.sleep(2)
+        if open_orders is None:
+            return None
 
-    def _on_open(self, ws):
-        logger.info("Binance Websocket connection opened")
-        self.ws_connected = True
-        # Acá se suscribe al channel bookTicker
-        # Las suscripciones a canales deberían hacerse a "demanda" de cuando doy de alta una estrategia,
-        # le suscribo el contrato que doy de alta.
-        # The aggTrade channel is subscribed to in the _switch_strategy() method of strategy_component.py
+        open_orders = {order['orderId']: order for order in open_orders}
+        orders_status = dict()
 
-        for channel in ["bookTicker", "aggTrade"]:
-            for symbol in self.ws_subscriptions[channel]:
-                self.subscribe_channel([self.contracts[symbol]], channel, reconnection=True)
+        for order_id in order_ids:
+            if order_id in open_orders:
+                order = open_orders[order_id]
+                if not self.futures:
+                    # parcialmente llena: el precio promedio de lo ejecutado hasta ahora
+                    order['avgPrice'] = self._spot_avg_price(contract, order) or 0
+                orders_status[order_id] = OrderStatus(order, self.platform)
+            else:
+                order_status = yield from self._get_order_status_steps(contract, order_id)
+                if order_status is not None:
+                    orders_status[order_id] = order_status
 
-        if "BTCUSDT" not in self.ws_subscriptions["bookTicker"]:
-            self.subscribe_channel([self.contracts["BTCUSDT"]], "bookTicker")
+        return orders_status
 
-        # Si esto da un error "invalid close opcode" Es porque Binance permite suscribir un máximo de 200 contratos con
-        # una sola conexión.
-        # ver minuto 7.15 en adelante del video 41
+    # Cada conexión del pool vuelve a suscribir sus propios streams al (re)conectarse.
+    # Las suscripciones a canales se hacen a "demanda": el bookTicker de los symbols de la watchlist y el aggTrade
+    # cuando doy de alta una estrategia (en el _switch_strategy() de strategy_component.py).
+    def _on_open(self, ws):
+        self.ws_connected = True
 
     def _on_close(self, ws):
         logger.warning("Binance Websocket connection closed")
-        self.ws_connected = False
+        self.ws_connected = self.ws.connected
 
     def _on_error(self, ws, msg: str):
         logger.error("Binance Websocket connection error: %s", msg)
 
+    # Una conexión del pool se volvió a abrir: las estrategias de sus symbols perdieron los trades de mientras tanto
+    def _on_reconnect(self, streams: typing.List[str]):
+        self._backfill_candles(self._stream_symbols(streams))
+
+    # Las velas que faltan de cada estrategia de estos symbols, desde la última que tiene guardada. Se piden una vez
+    # por symbol y timeframe.
+    def _backfill_candles(self, symbols: typing.List[str]):
+        for contract, timeframe, start_time, strategies in missed_candles(self.strategies, symbols):
+            candles = self.get_historical_candles(contract, timeframe, start_time)
+            for strat in strategies:
+                strat.backfill_candles(candles)
+
+    # symbols de los streams de trades ("btcusdt@aggTrade"), que son los que alimentan las velas de las estrategias
+    @staticmethod
+    def _stream_symbols(streams: typing.List[str]) -> typing.List[str]:
+        return [s.split("@")[0].upper() for s in streams if s.endswith("@aggTrade")]
+
+    # Métricas de las conexiones de websocket (ver connectors/ws_health.py)
+    def ws_stats(self) -> typing.Dict[str, typing.Dict]:
+        shards = self.ws.stats() if self.ws is not None else dict()
+        stats = {"connection " + str(shard_id): s for shard_id, s in shards.items()}
+        stats["user data stream"] = self.user_ws_health.stats()
+
+        return stats
+
     def _on_message(self, ws, msg: str):
-        # Una vez recibidos los datos del ws, convierto el jsonString a jsonObject, a fin de mostrarlo claramente
-        data = json.loads(msg)
+        # El tipo de mensaje se saca del texto sin parsearlo, y sólo se decodifica lo que se usa (ver decoder.py)
+        msg_type = binance_message_type(msg)
 
-        if "u" in data and "A" in data:
-            # For Binance Spot, to make the data structure uniform with Binance Futures
-            # See the data structure difference here: https://binance-docs.github.io/apidocs/spot/en/#individual-symbol-book-ticker-streams
-            data['e'] = "bookTicker"
+        if msg_type == AGG_TRADE:
+            if self._recorder is not None:
+                self._recorder.record(msg)
 
-        # la e se refiere al evento (al canal) del cual estoy recibiendo la información
-        if "e" in data:
-            if data['e'] == "bookTicker":
+            # paso el trade a las estrategias: symbol, precio, quantity y timestamp
+            self._dispatch_trade(*decode_agg_trade(msg))
 
-                symbol = data['s']
-                if symbol not in self.prices:
-                    self.prices[symbol] = {'bid': float(data['b']), 'ask': float(data['a'])}
-                else:
-                    self.prices[symbol]['bid'] = float(data['b'])
-                    self.prices[symbol]['ask'] = float(data['a'])
+        elif msg_type == BOOK_TICKER:
+            # Spot y Futures traen los mismos campos (s, b, a) aunque el de Spot no tenga "e"
+            # https://binance-docs.github.io/apidocs/spot/en/#individual-symbol-book-ticker-streams
+            symbol, bid, ask = decode_book_ticker(msg)
+
+            if symbol not in self.prices:
+                self.prices[symbol] = {'bid': bid, 'ask': ask}
+            else:
+                self.prices[symbol]['bid'] = bid
+                self.prices[symbol]['ask'] = ask
+
+            # Update del pnl que se muestra en la interface, sólo de los trades abiertos de este symbol
+            self.open_positions.mark_to_market(symbol, bid, ask)
+
+        elif msg_type == DEPTH_UPDATE:
+            event = loads(msg)
+
+            book = self.order_books.get(event['s'])
+            if book is not None and book.on_update(event):
+                self._request_depth_snapshot(book)
+
+    # Hago loop en las estrategias de este symbol cada vez que recibo nueva información de precios de
+    # candles para ir viendo como afecta el nuevo precio a la estrategia (TP, SL , etc)
+    def _dispatch_trade(self, symbol: str, price: float, size: float, timestamp: int):
+        for strat in self._strategies_by_symbol.get(symbol, ()):
+            strat.on_trade(price, size, timestamp)
+
+    # User data stream: https://binance-docs.github.io/apidocs/futures/en/#user-data-streams
+    # Sólo pide el API key (sin firma). Devuelve el listenKey, que va en la url del websocket.
+    def _create_listen_key(self) -> typing.Optional[str]:
+        return self._run_steps(self._create_listen_key_steps())
+
+    def _create_listen_key_steps(self) -> RequestSteps:
+        if self.futures:
+            response = yield "POST", "/fapi/v1/listenKey", dict()
+        else:
+            response = yield "POST", "/api/v3/userDataStream", dict()
+
+        if response is not None:
+            return response['listenKey']
+
+    def _keepalive_listen_key(self):
+        self._run_steps(self._keepalive_listen_key_steps())
+
+    def _keepalive_listen_key_steps(self) -> RequestSteps:
+        if self._listen_key is None:
+            return
+
+        if self.futures:
+            yield "PUT", "/fapi/v1/listenKey", dict()
+        else:
+            yield "PUT", "/api/v3/userDataStream", {'listenKey': self._listen_key}
+
+    def _start_user_stream(self):
+        while self.reconnect:
+            self._listen_key = self._create_listen_key()
 
-                # Para calcular el update del pnl que se muestra en la interface, voy calculando en base a la
-                # posición que tengo (long o short) y comparo contra cerrar la posición contra el bid o ask (dependiendo
-                # la posición que tenga)
+            if self._listen_key is not None:
+                self._user_ws = websocket.WebSocketApp(self._wss_url + "/" + self._listen_key,
+                                                       on_open=self._on_user_open, on_message=self._on_user_ws_message,
+                                                       on_error=self._on_error, on_pong=self._on_user_pong)
                 try:
-                    for b_index, strat in self.strategies.items():
-                        if strat.contract.symbol == symbol:
-                            for trade in strat.trades:
-                                if trade.status == "open" and trade.entry_price is not None:
-                                    if trade.side == "long":
-                                        trade.pnl = (self.prices[symbol]['bid'] - trade.entry_price) * trade.quantity
-                                    elif trade.side == "short":
-                                        trade.pnl = (trade.entry_price - self.prices[symbol]['ask']) * trade.quantity
-                except RuntimeError as e:
-                    logger.error("Error while looping through the Binance strategies: %s", e)
-
-            if data['e'] == "aggTrade":
-                symbol = data['s']
-
-                # Hago loop en la estrategia cada vez que recibo nueva información de precios de candles
-                # para ir viendo como afecta el nuevo precio a la estrategia (TP, SL , etc)
-                for key, strat in self.strategies.items():
-                    if strat.contract.symbol == symbol:
-                        # paso para parsear el trade: precio (p), quantity (q) y timestamp (T)
-                        # lo guardo en una variable result. Ese result es para update la candle o crear una nueva
-                        res = strat.parse_trades(float(data['p']), float(data['q']), data['T'])
-                        strat.check_trade(res)
+                    self._user_ws.run_forever(ping_interval=PING_INTERVAL, ping_timeout=PING_TIMEOUT)
+                except Exception as e:
+                    logger.error("Binance error in the user data stream run_forever() method: %s", e)
+                self.user_ws_health.on_close()
+
+            time.sleep(self.user_ws_health.reconnect_delay())
+
+    def _on_user_open(self, ws):
+        self.user_ws_health.on_open()
+
+    def _on_user_ws_message(self, ws, msg: str):
+        self.user_ws_health.on_message(len(msg))
+        self._on_user_message(ws, msg)
+
+    def _on_user_pong(self, ws, data):
+        self.user_ws_health.on_pong(ws.last_pong_tm - ws.last_ping_tm)
+
+    # Actualiza los balances en memoria (self.balances) con los eventos del user data stream
+    def _on_user_message(self, ws, msg: str):
+        data = loads(msg)
 
+        if "e" not in data:
+            return
+
+        if data['e'] == "ACCOUNT_UPDATE":
+            # Futures: wallet balance de cada asset que cambió
+            for b in data['a']['B']:
+                if b['a'] in self.balances:
+                    self.balances[b['a']].wallet_balance = float(b['wb'])
+                else:
+                    self.balances[b['a']] = Balance({'initialMargin': 0, 'maintMargin': 0, 'marginBalance': b['wb'],
+                                                     'walletBalance': b['wb'], 'unrealizedProfit': 0}, self.platform)
+
+        elif data['e'] == "executionReport":
+            # Spot: cantidad (z) y monto (Z) ejecutados acumulados de la orden (i), para su precio promedio
+            if float(data['z']) > 0:
+                self.fills.update(data['i'], float(data['z']), float(data['Z']))
+
+        elif data['e'] == "outboundAccountPosition":
+            # Spot: free y locked de cada asset que cambió
+            for b in data['B']:
+                self.balances[b['a']] = Balance({'free': b['f'], 'locked': b['l']}, self.platform)
+
+        elif data['e'] == "listenKeyExpired":
+            # al cerrarse la conexión, _start_user_stream() pide un listenKey nuevo
+            logger.warning("Binance listenKey expired, reconnecting the user data stream")
+            ws.close()
+
+    # Reconciliación periódica de los balances por REST y renovación del listenKey
+    def _maintain_balances(self):
+        last_keepalive = time.time()
+
+        while self.reconnect:
+            time.sleep(BALANCES_RECONCILE_INTERVAL)
+
+            balances = self.get_balances()
+            if len(balances) > 0:
+                self.balances = balances
+
+            if time.time() - last_keepalive >= LISTEN_KEY_KEEPALIVE_INTERVAL:
+                self._keepalive_listen_key()
+                last_keepalive = time.time()
 
     # Para obtener data, necesito suscribirme a "canales". Esto es, una especie de endpoint, que envía datos
     # los cuales son recibidos por el ws y transmitidos al programa
     # https://binance-docs.github.io/apidocs/testnet/en/#live-subscribing-unsubscribing-to-streams
+    # El pool reparte los streams entre sus conexiones, así que no hay límite de symbols. reconnection ya no se usa
+    # (cada conexión se resuscribe sola), queda por compatibilidad.
     def subscribe_channel(self, contracts: typing.List[Contract], channel: str, reconnection=False):
-        if len(contracts) > 200:
-            logger.warning("Subscribing to more than 200 symbols will most likely fail. "
-                           "Consider subscribing only when adding a symbol to your Watchlist or when starting a "
-                           "strategy for a symbol.")
+        self.ws.subscribe(self._channel_streams(contracts, channel))
 
-        data = dict()
-        data['method'] = "SUBSCRIBE"
-        data['params'] = []
+        for contract in contracts:
+            if contract.symbol not in self.ws_subscriptions[channel]:
+                self.ws_subscriptions[channel].append(contract.symbol)
 
-        if len(contracts) == 0:
-            data['params'].append(channel)
-        else:
-            for contract in contracts:
-                if contract.symbol not in self.ws_subscriptions[channel] or reconnection:
-                    data['params'].append(contract.symbol.lower() + "@" + channel)
-                    if contract.symbol not in self.ws_subscriptions[channel]:
-                        self.ws_subscriptions[channel].append(contract.symbol)
+    def unsubscribe_channel(self, contracts: typing.List[Contract], channel: str):
+        self.ws.unsubscribe(self._channel_streams(contracts, channel))
 
-        if len(data['params']) == 0:
-            return
-        data['id'] = self._ws_id
+        for contract in contracts:
+            if contract.symbol in self.ws_subscriptions[channel]:
+                self.ws_subscriptions[channel].remove(contract.symbol)
 
-        try:
-            self.ws.send(json.dumps(data))
-            logger.info("Binance: subscribing to: %s", ','.join(data['params']))
-        except Exception as e:
-            logger.error("Websocket error while subscribing to @bookTicker and @aggTrade: %s", e)
+    # Libro de órdenes local del contrato, en self.order_books[symbol]. El snapshot se pide al llegar la primera
+    # diferencia del stream, así las que llegan mientras tanto quedan guardadas en el libro.
+    def subscribe_order_book(self, contract: Contract) -> BinanceOrderBook:
+        if contract.symbol not in self.order_books:
+            self.order_books[contract.symbol] = BinanceOrderBook(contract.symbol, self.futures)
+
+        self.subscribe_channel([contract], DEPTH_CHANNEL)
+
+        return self.order_books[contract.symbol]
+
+    def unsubscribe_order_book(self, contract: Contract):
+        self.unsubscribe_channel([contract], DEPTH_CHANNEL)
+        self.order_books.pop(contract.symbol, None)
+
+    # El request del snapshot va en otro thread, para no frenar los mensajes de la conexión
+    def _request_depth_snapshot(self, book: BinanceOrderBook):
+        t = threading.Thread(target=self._load_depth_snapshot, args=(book,), daemon=True)
+        t.start()
 
-        self._ws_id += 1
+    def _load_depth_snapshot(self, book: BinanceOrderBook):
+        snapshot = self.get_depth_snapshot(self.contracts[book.symbol])
+
+        if snapshot is None:
+            book.snapshot_failed()
+        elif book.load_snapshot(snapshot):
+            logger.warning("Binance %s: order book snapshot older than the depth stream, requesting another one",
+                           book.symbol)
+            self._request_depth_snapshot(book)
+
+    # Nombre de los streams, por ejemplo btcusdt@bookTicker. Sin contratos, el stream de todo el mercado (!bookTicker)
+    @staticmethod
+    def _channel_streams(contracts: typing.List[Contract], channel: str) -> typing.List[str]:
+        if len(contracts) == 0:
+            return [channel]
+
+        return [contract.symbol.lower() + "@" + channel for contract in contracts]
 
     # Determino el tamaño del trade en base a lo establecido en la UI (el número que paso)
     # Necesito pasar como parámetro el contract para determinar a través del redondeo (round) la cant que voy a
@@ -476,8 +997,18 @@ class BinanceClient:
 
         logger.info("Getting Binance trade size...")
 
-        # averiguamos si el balance está updateado.
-        balance = self.get_balances()
+        return self._run_steps(self._get_trade_size_steps(contract, price, balance_pct))
+
+    def _get_trade_size_steps(self, contract: Contract, price: float, balance_pct: float) -> RequestSteps:
+        # los balances se mantienen al día con el user data stream, así que no hace falta pedirlos por REST (salvo que
+        # todavía no se hayan podido cargar)
+        balances = self.balances if len(self.balances) > 0 else (yield from self._get_balances_steps())
+
+        return self._trade_size(contract, balances, price, balance_pct)
+
+    # Cálculo del tamaño del trade a partir de los balances
+    def _trade_size(self, contract: Contract, balance: typing.Optional[typing.Dict[str, Balance]], price: float,
+                    balance_pct: float):
         if balance is not None:
             if contract.quote_asset in balance:  # On Binance Spot, the quote asset isn't necessarily USDT
                 if self.futures:
@@ -0,0 +1,309 @@
+# Versión asyncio de BinanceClient (ver connectors/async_support.py).
+# Tiene los mismos métodos públicos, pero los que van al exchange son corutinas: los requests REST usan una sesión
+# aiohttp y los websockets corren como tasks del event loop, en vez de threads con run_forever(). Así un solo
+# loop puede manejar muchos symbols y cuentas.
+# Lo que no va al exchange (add_strategy(), remove_strategy(), start_recording(), _on_message()...) se hereda tal
+# cual de BinanceClient, y los métodos REST corren los mismos generadores de requests que los de BinanceClient (armado
+# de los requests y parseo de las respuestas), sólo que con aiohttp (ver _run_steps()).
+#
+# Ejemplo:
+#   async def main():
+#       client = AsyncBinanceClient(public_key, secret_key, testnet=True, futures=True)
+#       await client.start()
+#       contract = client.contracts["BTCUSDT"]
+#       candles = await client.get_historical_candles(contract, "1m")
+#       # las estrategias usan client.blocking, que corre las corutinas en el loop desde su thread
+#       strategy = BreakoutStrategy(client.blocking, contract, "Binance", "1m", 10, 1, 1, {"min_volume": 5})
+#       strategy.load_candles(candles)
+#       client.add_strategy(0, strategy)
+#       await client.subscribe_channel([contract], "aggTrade")
+#       ...
+#       await client.close()
+import asyncio
+import logging
+import threading
+import time
+import typing
+
+import aiohttp
+
+import numpy as np
+
+from models import *
+from connectors.binance import BinanceClient, BALANCES_RECONCILE_INTERVAL, LISTEN_KEY_KEEPALIVE_INTERVAL, \
+    DEPTH_CHANNEL
+from connectors.clock_sync import CLOCK_SYNC_INTERVAL
+from connectors.http_session import RequestSteps
+from connectors.order_batcher import OrderRequest
+from connectors.order_book import BinanceOrderBook
+from connectors.async_support import create_async_session, timed_async_request, run_async_steps, BlockingClient, \
+    StrategyWorker, AsyncBinanceStreamPool, read_messages
+from connectors.ws_health import missed_candles
+
+logger = logging.getLogger()
+
+
+class AsyncBinanceClient(BinanceClient):
+    def __init__(self, public_key: str, secret_key: str, testnet: bool, futures: bool, pool_size: int = 10,
+                 timeout: typing.Tuple[float, float] = (3.05, 10), max_retries: int = 2):
+
+        # No se conecta a nada hasta start(), que tiene que correr dentro del event loop. BinanceClient.__init__()
+        # sí se conecta, por eso no se llama: la configuración y el estado vienen de los mismos métodos que usa.
+        self.futures = futures
+        self._init_config(public_key, secret_key, testnet)
+
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._session: typing.Optional[aiohttp.ClientSession] = None
+
+        self.loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: typing.Optional[int] = None
+
+        # cliente sincrónico para las estrategias y el OrderTracker, que corren en sus propios threads
+        self.blocking = BlockingClient(self)
+        self._init_state(self.blocking)
+        self._strategy_worker = StrategyWorker(self)
+
+        # pool de conexiones de los streams de mercado (ver connectors/ws_pool.py), se crea en start()
+        self.ws: typing.Optional[AsyncBinanceStreamPool] = None
+        # tasks del loop: user data stream, reconciliación de balances y sincronización del reloj
+        self._tasks: typing.List[asyncio.Task] = []
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+
+        self._session = create_async_session(self._pool_size, self._timeout, self._headers)
+
+        await self._sync_clock()
+        self.contracts = await self.get_contracts()
+        self.balances = await self.get_balances()
+
+        self._strategy_worker.start()
+
+        self.ws = AsyncBinanceStreamPool(self._session, self._wss_url, on_message=self._on_message,
+                                         on_error=self._on_error, on_open=self._on_open, on_close=self._on_close,
+                                         on_reconnect=self._on_reconnect)
+        # las suscripciones hechas antes de start() se mandan ahora
+        for channel, symbols in self.ws_subscriptions.items():
+            contracts = [self.contracts[s] for s in symbols if s in self.contracts]
+            # sin symbols, _channel_streams() devuelve el canal solo ("aggTrade"), que Binance rechaza
+            if len(contracts) > 0:
+                await self.ws.subscribe(self._channel_streams(contracts, channel))
+        if "BTCUSDT" in self.contracts:
+            await self.subscribe_channel([self.contracts["BTCUSDT"]], "bookTicker")
+
+        self._tasks.append(asyncio.create_task(self._start_user_stream()))
+        self._tasks.append(asyncio.create_task(self._maintain_balances()))
+        self._tasks.append(asyncio.create_task(self._maintain_clock()))
+
+        logger.info("Binance async client succesfully initialized")
+
+    async def close(self):
+        self.reconnect = False
+
+        if self.ws is not None:
+            await self.ws.close()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        self._strategy_worker.stop()
+        self.order_tracker.stop()
+        self.order_batcher.stop()
+
+        if self._session is not None:
+            await self._session.close()
+
+    async def _make_request(self, method: str, endpoint: str, data: typing.Dict):
+        if method not in ("GET", "POST", "PUT", "DELETE"):
+            raise ValueError()
+
+        if await self.scheduler.acquire_async(*self._request_cost(method, endpoint)) > 0:
+            self._sign_again(data)
+
+        try:
+            status, response, headers = await timed_async_request(self._session, self.latency, method,
+                                                                  self._base_url, endpoint, data,
+                                                                  max_retries=self._max_retries)
+        except Exception as e:
+            logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+            return None
+
+        self.scheduler.update(status, headers)
+
+        if status == 200:
+            return response
+        else:
+            logger.error("Error while making %s request to %s: %s (error code %s)",
+                         method, endpoint, response, status)
+            return None
+
+    # Los requests y las respuestas se arman en los generadores de BinanceClient (_get_contracts_steps()...): estos
+    # métodos sólo los corren con el _make_request() de aiohttp
+    async def _run_steps(self, steps: RequestSteps):
+        return await run_async_steps(steps, self._make_request)
+
+    async def get_contracts(self) -> typing.Dict[str, Contract]:
+        return await self._run_steps(self._get_contracts_steps())
+
+    async def get_historical_candles(self, contract: Contract, interval: str,
+                                     start_time: typing.Optional[int] = None) -> typing.List[Candle]:
+        return await self._run_steps(self._get_historical_candles_steps(contract, interval, start_time))
+
+    async def get_candles_page(self, contract: Contract, interval: str, start_time: int,
+                               end_time: int) -> typing.Optional[np.ndarray]:
+        return await self._run_steps(self._get_candles_page_steps(contract, interval, start_time, end_time))
+
+    async def get_bid_ask(self, contract: Contract) -> typing.Dict[str, float]:
+        return await self._run_steps(self._get_bid_ask_steps(contract))
+
+    async def get_depth_snapshot(self, contract: Contract) -> typing.Optional[typing.Dict]:
+        return await self._run_steps(self._get_depth_snapshot_steps(contract))
+
+    async def get_balances(self) -> typing.Dict[str, Balance]:
+        return await self._run_steps(self._get_balances_steps())
+
+    async def place_order(self, contract: Contract, order_type: str, quantity: float, side: str,
+                          price=None, tif=None) -> OrderStatus:
+        return await self._run_steps(self._place_order_steps(contract, order_type, quantity, side, price, tif))
+
+    async def cancel_order(self, contract: Contract, order_id: int) -> OrderStatus:
+        return await self._run_steps(self._cancel_order_steps(contract, order_id))
+
+    # Spot no tiene batch: sus órdenes se mandan a la vez en requests separados
+    async def place_orders(self, orders: typing.List[OrderRequest]) -> typing.List[typing.Optional[OrderStatus]]:
+        if not self.futures:
+            return list(await asyncio.gather(*[self.place_order(o.contract, o.order_type, o.quantity, o.side,
+                                                                o.price, o.tif) for o in orders]))
+
+        return await self._run_steps(self._place_orders_steps(orders))
+
+    async def cancel_orders(self, contract: Contract,
+                            order_ids: typing.List[int]) -> typing.List[typing.Optional[OrderStatus]]:
+        if not self.futures:
+            return list(await asyncio.gather(*[self.cancel_order(contract, order_id) for order_id in order_ids]))
+
+        return await self._run_steps(self._cancel_orders_steps(contract, order_ids))
+
+    async def get_order_status(self, contract: Contract, order_id: int) -> OrderStatus:
+        return await self._run_steps(self._get_order_status_steps(contract, order_id))
+
+    async def get_orders_status(self, contract: Contract,
+                                order_ids: typing.List[int]) -> typing.Optional[typing.Dict[int, OrderStatus]]:
+        return await self._run_steps(self._get_orders_status_steps(contract, order_ids))
+
+    async def get_trade_size(self, contract: Contract, price: float, balance_pct: float):
+        logger.info("Getting Binance trade size...")
+
+        return await self._run_steps(self._get_trade_size_steps(contract, price, balance_pct))
+
+    async def _create_listen_key(self) -> typing.Optional[str]:
+        return await self._run_steps(self._create_listen_key_steps())
+
+    async def _keepalive_listen_key(self):
+        await self._run_steps(self._keepalive_listen_key_steps())
+
+    # User data stream en su propia conexión. Los mensajes los procesa _on_user_message() de BinanceClient.
+    async def _start_user_stream(self):
+        while self.reconnect:
+            self._listen_key = await self._create_listen_key()
+
+            if self._listen_key is not None:
+                try:
+                    async with self._session.ws_connect(self._wss_url + "/" + self._listen_key,
+                                                        autoping=False) as ws:
+                        self.user_ws_health.on_open()
+                        # el user data stream sólo trae mensajes cuando cambia algo de la cuenta
+                        await read_messages(ws, self.user_ws_health, self._on_user_message,
+                                            expects_data=lambda: False)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("Binance error in the user data stream task: %s", e)
+                self.user_ws_health.on_close()
+
+            await asyncio.sleep(self.user_ws_health.reconnect_delay())
+
+    async def _sync_clock(self):
+        await self._run_steps(self._sync_clock_steps())
+
+    async def _maintain_clock(self):
+        while self.reconnect:
+            await asyncio.sleep(CLOCK_SYNC_INTERVAL)
+            await self._sync_clock()
+
+    async def _maintain_balances(self):
+        last_keepalive = time.time()
+
+        while self.reconnect:
+            await asyncio.sleep(BALANCES_RECONCILE_INTERVAL)
+
+            balances = await self.get_balances()
+            if len(balances) > 0:
+                self.balances = balances
+
+            if time.time() - last_keepalive >= LISTEN_KEY_KEEPALIVE_INTERVAL:
+                await self._keepalive_listen_key()
+                last_keepalive = time.time()
+
+    async def _on_reconnect(self, streams: typing.List[str]):
+        await self._backfill_candles(self._stream_symbols(streams))
+
+    # Las velas se piden desde el loop y se cargan en el thread del StrategyWorker, en orden con los trades
+    async def _backfill_candles(self, symbols: typing.List[str]):
+        for contract, timeframe, start_time, strategies in missed_candles(self.strategies, symbols):
+            candles = await self.get_historical_candles(contract, timeframe, start_time)
+            for strat in strategies:
+                self._strategy_worker.call(strat.backfill_candles, candles)
+
+    # Los trades se procesan en el thread del StrategyWorker, así una estrategia que manda una orden no frena el loop
+    def _dispatch_trade(self, symbol: str, price: float, size: float, timestamp: int):
+        if symbol in self._strategies_by_symbol:
+            self._strategy_worker.submit(symbol, price, size, timestamp)
+
+    async def subscribe_channel(self, contracts: typing.List[Contract], channel: str, reconnection=False):
+        for contract in contracts:
+            if contract.symbol not in self.ws_subscriptions[channel]:
+                self.ws_subscriptions[channel].append(contract.symbol)
+
+        # si todavía no se llamó a start(), la suscripción queda en ws_subscriptions y se manda ahí
+        if self.ws is not None:
+            await self.ws.subscribe(self._channel_streams(contracts, channel))
+
+    async def unsubscribe_channel(self, contracts: typing.List[Contract], channel: str):
+        for contract in contracts:
+            if contract.symbol in self.ws_subscriptions[channel]:
+                self.ws_subscriptions[channel].remove(contract.symbol)
+
+        if self.ws is not None:
+            await self.ws.unsubscribe(self._channel_streams(contracts, channel))
+
+    async def subscribe_order_book(self, contract: Contract) -> BinanceOrderBook:
+        if contract.symbol not in self.order_books:
+            self.order_books[contract.symbol] = BinanceOrderBook(contract.symbol, self.futures)
+
+        await self.subscribe_channel([contract], DEPTH_CHANNEL)
+
+        return self.order_books[contract.symbol]
+
+    async def unsubscribe_order_book(self, contract: Contract):
+        await self.unsubscribe_channel([contract], DEPTH_CHANNEL)
+        self.order_books.pop(contract.symbol, None)
+
+    # _on_message() corre en el loop: el snapshot se pide en una task
+    def _request_depth_snapshot(self, book: BinanceOrderBook):
+        task = asyncio.create_task(self._load_depth_snapshot(book))
+        self._tasks.append(task)
+        task.add_done_callback(self._tasks.remove)
+
+    async def _load_depth_snapshot(self, book: BinanceOrderBook):
+        snapshot = await self.get_depth_snapshot(self.contracts[book.symbol])
+
+        if snapshot is None:
+            book.snapshot_failed()
+        elif book.load_snapshot(snapshot):
+            logger.warning("Binance %s: order book snapshot older than the depth stream, requesting another one",
+                           book.symbol)
+            self._request_depth_snapshot(book)
@@ -1,26 +1,104 @@
+import datetime
 import logging
 import time
-import requests
 import hmac
 import hashlib
 import websocket
 import collections
 import json
 import typing
-import dateutil.parser
+import numpy as np
 import threading
 from models import *
 from urllib.parse import urlencode
 
 from strategies import TechnicalStrategy, BreakoutStrategy
+from recorder import TickRecorder
+from connectors.order_tracker import OrderTracker
+from connectors.http_session import create_session, timed_request, run_steps, LatencyStats, RequestSteps
+from connectors.clock_sync import ClockSync, LagHistogram, CLOCK_SYNC_INTERVAL
+from connectors.request_scheduler import RequestScheduler, RateWindow, PRIORITY_ORDER, PRIORITY_NORMAL, PRIORITY_LOW
+from connectors.order_book import BitmexOrderBook
+from connectors.order_batcher import OrderBatcher, OrderRequest
+from connectors.decoder import loads, decode_bitmex_trades
+from connectors.ws_health import ConnectionHealth, StaleMonitor, missed_candles, PING_INTERVAL, PING_TIMEOUT
 
 logger = logging.getLogger()
 
+# Los balances se mantienen al día con la tabla margin del websocket y cada BALANCES_RECONCILE_INTERVAL segundos se
+# reconcilian con get_balances() por si se perdió algún mensaje
+BALANCES_RECONCILE_INTERVAL = 60
+
+# Campos de la tabla margin (en satoshis) -> atributos de Balance
+MARGIN_FIELDS = {'initMargin': 'initial_margin', 'maintMargin': 'maintenance_margin',
+                 'marginBalance': 'margin_balance', 'walletBalance': 'wallet_balance',
+                 'unrealisedPnl': 'unrealized_pnl'}
+
+# Estado de las órdenes que se guarda de las tablas order y execution del websocket. Los updates sólo traen los campos
+# que cambiaron, así que se van mezclando con lo que ya había.
+ORDER_FIELDS = ("orderID", "symbol", "ordStatus", "avgPx", "cumQty")
+MAX_CACHED_ORDERS = 1000
+
+# https://www.bitmex.com/app/restAPI#Request-Rate-Limits: 120 requests por minuto y además 10 por segundo para los
+# endpoints de órdenes. Cada respuesta trae cuántos quedan.
+# Tablas de libros de órdenes L2: 25 niveles de cada lado o el libro completo (ver connectors/order_book.py)
+ORDER_BOOK_TABLES = ("orderBookL2_25", "orderBookL2")
+
+ORDER_ENDPOINTS = ("/api/v1/order", "/api/v1/order/bulk")
+LOW_PRIORITY_ENDPOINTS = ("/api/v1/trade/bucketed", "/api/v1/user/margin", "/api/v1/instrument/active")
+
+
+def create_request_scheduler() -> RequestScheduler:
+    return RequestScheduler([RateWindow("requests", 120, 60, remaining_header="x-ratelimit-remaining",
+                                        reset_header="x-ratelimit-reset"),
+                             RateWindow("orders_1s", 10, 1, remaining_header="x-ratelimit-remaining-1s",
+                                        orders_only=True)])
+
 
 # El init es igual al de Binance (salvo por los url y demás)
 class BitmexClient:
 
-    def __init__(self, public_key: str, secret_key: str, testnet: bool):
+    def __init__(self, public_key: str, secret_key: str, testnet: bool, pool_size: int = 10,
+                 timeout: typing.Tuple[float, float] = (3.05, 10), max_retries: int = 2):
+
+        self._init_config(public_key, secret_key, testnet)
+
+        # sesión keep-alive para los requests REST (ver connectors/http_session.py). timeout = (connect, read)
+        self._session = create_session(pool_size, max_retries)
+        self._timeout = timeout
+
+        self._init_state()
+
+        self.ws: websocket.WebSocketApp
+        # Sin symbols en la tabla instrument la conexión puede pasar mucho tiempo sin mensajes, así que recién ahí
+        # se controla que no esté trabada.
+        self._stale_monitor = StaleMonitor(lambda: [(self.ws_health, self.ws.close)]
+                                           if len(self.ws_subscriptions["instrument"]) > 0 else [])
+
+        self._sync_clock()
+        self.contracts = self.get_contracts()
+        self.balances = self.get_balances()
+
+        # Hay 3 diferencias entre el WS de Bitmex y Binance:
+        #   1- La URL
+        #   2- La data que recibimos en el on_message() está estructurada diferente
+        #   3- La forma que nos suscribimos al feed (channel en Binance). Trae la información para todos los
+        #       contratos, en vez de para uno en particular.
+
+        t = threading.Thread(target=self._start_ws)
+        t.start()
+        self._stale_monitor.start()
+
+        t = threading.Thread(target=self._maintain_balances, daemon=True)
+        t.start()
+
+        t = threading.Thread(target=self._maintain_clock, daemon=True)
+        t.start()
+
+        logger.info("Bitmex Client succesfully initialized")
+
+    # urls y claves de la cuenta. Lo comparten BitmexClient y AsyncBitmexClient (connectors/bitmex_async.py).
+    def _init_config(self, public_key: str, secret_key: str, testnet: bool):
 
         # Agrego futuros
         self.futures = True
@@ -36,38 +114,142 @@ class BitmexClient:
         self._public_key = public_key
         self._secret_key = secret_key
 
-        self.ws: websocket.WebSocketApp
+    # Estado del cliente que no depende del transporte: no se conecta a nada ni arranca threads. Lo usan
+    # BitmexClient, AsyncBitmexClient y ReplayBitmexClient (replay.py).
+    def _init_state(self, orders_client=None):
+
+        """
+        :param orders_client: client used by the OrderTracker and the OrderBatcher, self by default (the async client
+        passes its BlockingClient)
+        """
+
+        if orders_client is None:
+            orders_client = self
+
+        # latencia de los requests por endpoint, ver self.latency.summary()
+        self.latency = LatencyStats()
+        # límites de requests del exchange, ver self.scheduler.stats()
+        self.scheduler = create_request_scheduler()
+        # offset del reloj local con el del exchange, para las firmas y el atraso de los trades (ver clock_sync.py)
+        self.clock = ClockSync()
+        self.tick_lag = LagHistogram(self.platform)
+
+        self.ws_connected = False
+        # symbols suscriptos a cada tabla pública (ver subscribe_symbols())
+        self.ws_subscriptions = {"instrument": [], "trade": []}
+        # métricas de la conexión (ver ws_stats())
+        self.ws_health = ConnectionHealth("Bitmex")
 
         # Creo una variable para que se reconecte en caso de caerse el sistema, pero que no se reconecte si
         # elijo cerrarlo (cerrar la ventana del bot)
         self.reconnect = True
 
-        self.contracts = self.get_contracts()
-        self.balances = self.get_balances()
+        self.contracts: typing.Dict[str, Contract] = dict()
+        self.balances: typing.Dict[str, Balance] = dict()
         self.prices = dict()
 
         # Agrego variable para almacenar las candles de cada estrategia que inicie
         # el Union significa que puede adoptar un valor u otro "Technical o Breakout"
         self.strategies: typing.Dict[int, typing.Union[TechnicalStrategy, BreakoutStrategy]] = dict()
 
-        # agrego una lista de logs, que son los que se van a ir mostrando en la interface visual al usuario
-        self.logs = []
+        # índice de las estrategias activas por symbol, para despachar los mensajes del websocket sólo a las
+        # estrategias de ese symbol (ver add_strategy() y remove_strategy())
+        self._strategies_by_symbol: typing.Dict[str, typing.Tuple] = dict()
+        self._strategies_lock = threading.Lock()
 
-        # Hay 3 diferencias entre el WS de Bitmex y Binance:
-        #   1- La URL
-        #   2- La data que recibimos en el on_message() está estructurada diferente
-        #   3- La forma que nos suscribimos al feed (channel en Binance). Trae la información para todos los
-        #       contratos, en vez de para uno en particular.
+        # trades abiertos de todas las estrategias, por symbol, para actualizar su pnl con cada cambio de precio
+        self.open_positions = OpenPositions()
 
-        t = threading.Thread(target=self._start_ws)
-        t.start()
+        # si no es None, graba los mensajes de trades crudos del websocket (ver start_recording())
+        self._recorder: typing.Optional[TickRecorder] = None
 
-        logger.info("Bitmex Client succesfully initialized")
+        # un solo thread que sigue todas las órdenes pendientes de las estrategias (ver get_orders_status())
+        self.order_tracker = OrderTracker(orders_client)
+        # junta en un solo request las órdenes que las estrategias mandan casi al mismo tiempo (ver order_batcher.py)
+        self.order_batcher = OrderBatcher(orders_client)
+
+        # orderID -> último estado conocido de la orden (tablas order y execution del websocket)
+        self._orders: typing.OrderedDict[str, typing.Dict] = collections.OrderedDict()
+        self._orders_lock = threading.Lock()
+
+        # libros de órdenes locales por symbol (ver subscribe_order_book())
+        self.order_books: typing.Dict[str, BitmexOrderBook] = dict()
+
+        # agrego una lista de logs, que son los que se van a ir mostrando en la interface visual al usuario
+        self.logs = []
 
     def _add_log(self, msg: str):
         logger.info("%s", msg)
         self.logs.append({"log": msg, "displayed": False})
 
+    # Las estrategias se agregan y quitan sólo con estos métodos, para mantener actualizado el índice symbol ->
+    # estrategias que usa _on_message(). Ambos diccionarios se reemplazan (copy-on-write) en vez de modificarse,
+    # así el thread del websocket y el de la interface siempre iteran una versión completa y nunca ven el error
+    # "dictionary changed size during iteration".
+    def add_strategy(self, b_index: int, strategy: typing.Union[TechnicalStrategy, BreakoutStrategy]):
+        with self._strategies_lock:
+            strategies = dict(self.strategies)
+            strategies[b_index] = strategy
+
+            by_symbol = dict(self._strategies_by_symbol)
+            by_symbol[strategy.contract.symbol] = by_symbol.get(strategy.contract.symbol, ()) + (strategy,)
+
+            self.strategies = strategies
+            self._strategies_by_symbol = by_symbol
+
+    def remove_strategy(self, b_index: int):
+        with self._strategies_lock:
+            strategies = dict(self.strategies)
+            strategy = strategies.pop(b_index, None)
+            if strategy is None:
+                return
+
+            by_symbol = dict(self._strategies_by_symbol)
+            symbol = strategy.contract.symbol
+            remaining = tuple(s for s in by_symbol.get(symbol, ()) if s is not strategy)
+            if len(remaining) > 0:
+                by_symbol[symbol] = remaining
+            else:
+                by_symbol.pop(symbol, None)
+
+            self.strategies = strategies
+            self._strategies_by_symbol = by_symbol
+
+        strategy.stop()
+
+    # Hora actual en milisegundos que usan las estrategias (por ejemplo para medir el atraso de los trades), corregida
+    # con el offset del reloj del exchange. El cliente de replay.py la reemplaza por la hora grabada.
+    def now_ms(self) -> int:
+        return self.clock.now_ms()
+
+    # La raíz de la API devuelve la hora del servidor en ms: {"name": "BitMEX API", ..., "timestamp": 1672531200000}
+    def _sync_clock(self):
+        self._run_steps(self._sync_clock_steps())
+
+    def _sync_clock_steps(self) -> RequestSteps:
+        sent = time.time()
+        server_time = yield "GET", "/api/v1", dict()
+        received = time.time()
+
+        if server_time is not None and 'timestamp' in server_time:
+            self.clock.add_sample(sent, server_time['timestamp'], received)
+
+    def _maintain_clock(self):
+        while self.reconnect:
+            time.sleep(CLOCK_SYNC_INTERVAL)
+            self._sync_clock()
+
+    # Empieza a grabar los mensajes de trades crudos del websocket en path, para reproducirlos con replay.py
+    def start_recording(self, path: str):
+        self.stop_recording()
+        self._recorder = TickRecorder(path)
+
+    def stop_recording(self):
+        if self._recorder is not None:
+            recorder = self._recorder
+            self._recorder = None
+            recorder.close()
+
     # Acá cambian la cantidad de parámetros para el signature, ya que así lo especifica la documentación de Bitmex.
     def _generate_signature(self, method: str, endpoint: str, expires: str, data: typing.Dict) -> str:
 
@@ -82,35 +264,26 @@ class BitmexClient:
 
     def _make_request(self, method: str, endpoint: str, data: typing.Dict):
 
+        if method not in ("GET", "POST", "PUT", "DELETE"):
+            raise ValueError()
+
+        # primero espera lugar en los límites, así la firma no vence mientras tanto
+        self.scheduler.acquire(*self._request_cost(method, endpoint))
+
         headers = dict()
-        expires = str(int(time.time()) + 5)
+        expires = str(int(self.clock.now()) + 5)
         headers['api-expires'] = expires
         headers['api-key'] = self._public_key
         headers['api-signature'] = self._generate_signature(method, endpoint, expires, data)
 
-        if method == "GET":
-            try:
-                response = requests.get(self._base_url + endpoint, params=data, headers=headers)
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
-
-        elif method == "POST":
-            try:
-                response = requests.post(self._base_url + endpoint, params=data, headers=headers)
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
-
-        elif method == "DELETE":
-            try:
-                response = requests.delete(self._base_url + endpoint, params=data, headers=headers)
-            except Exception as e:
-                logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
-                return None
+        try:
+            response = timed_request(self._session, self.latency, method, self._base_url + endpoint, endpoint,
+                                     self._timeout, params=data, headers=headers)
+        except Exception as e:
+            logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+            return None
 
-        else:
-            raise ValueError()
+        self.scheduler.update(response.status_code, response.headers)
 
         if response.status_code == 200:
             return response.json()
@@ -120,8 +293,26 @@ class BitmexClient:
                          method, endpoint, response.json(), response.status_code)
             return None
 
+    # (prioridad, weight, si cuenta para el límite de órdenes) del request, para el scheduler
+    @staticmethod
+    def _request_cost(method: str, endpoint: str) -> typing.Tuple[int, int, int]:
+        if endpoint in ORDER_ENDPOINTS and method in ("POST", "DELETE"):
+            return PRIORITY_ORDER, 1, 1
+        if endpoint in LOW_PRIORITY_ENDPOINTS:
+            return PRIORITY_LOW, 1, 0
+
+        return PRIORITY_NORMAL, 1, 0
+
+    # Los métodos REST son generadores de requests (ver run_steps() en connectors/http_session.py), que comparte
+    # AsyncBitmexClient: acá sólo se ejecutan con el _make_request() sincrónico.
+    def _run_steps(self, steps: RequestSteps):
+        return run_steps(steps, self._make_request)
+
     def get_contracts(self) -> typing.Dict[str, Contract]:
-        instruments = self._make_request("GET", "/api/v1/instrument/active", dict())
+        return self._run_steps(self._get_contracts_steps())
+
+    def _get_contracts_steps(self) -> RequestSteps:
+        instruments = yield "GET", "/api/v1/instrument/active", dict()
 
         contracts = dict()
 
@@ -133,11 +324,14 @@ class BitmexClient:
         return collections.OrderedDict(sorted(contracts.items()))
 
     def get_balances(self) -> typing.Dict[str, Balance]:
+        return self._run_steps(self._get_balances_steps())
+
+    def _get_balances_steps(self) -> RequestSteps:
         # genero los datos para identificarse, para pasarle al make_request().
         data = dict()
         data['currency'] = "all"
 
-        margin_data = self._make_request("GET", "/api/v1/user/margin", data)
+        margin_data = yield "GET", "/api/v1/user/margin", data
         balances = dict()
 
         if margin_data is not None:
@@ -146,7 +340,12 @@ class BitmexClient:
 
         return balances
 
-    def get_historical_candles(self, contract: Contract, timeframe: str) -> typing.List[Candle]:
+    def get_historical_candles(self, contract: Contract, timeframe: str,
+                               start_time: typing.Optional[int] = None) -> typing.List[Candle]:
+        return self._run_steps(self._get_historical_candles_steps(contract, timeframe, start_time))
+
+    def _get_historical_candles_steps(self, contract: Contract, timeframe: str,
+                                      start_time: typing.Optional[int] = None) -> RequestSteps:
         data = dict()
 
         data['symbol'] = contract.symbol
@@ -159,11 +358,21 @@ class BitmexClient:
         data['count'] = 500
         data['reverse'] = True
 
-        raw_candles = self._make_request("GET", "/api/v1/trade/bucketed", data)
+        # si paso start_time (ms) trae las 500 velas desde ahí (en orden) en vez de las últimas 500. El timestamp de
+        # las velas de Bitmex es el del cierre, por eso le sumo el timeframe.
+        if start_time is not None:
+            start = datetime.datetime.utcfromtimestamp(start_time / 1000 + BITMEX_TF_MINUTES[timeframe] * 60)
+            data['startTime'] = start.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+            data['reverse'] = False
+
+        raw_candles = yield "GET", "/api/v1/trade/bucketed", data
         candles = []
 
         if raw_candles is not None:
-            for c in reversed(raw_candles):
+            if data['reverse']:
+                raw_candles = reversed(raw_candles)
+
+            for c in raw_candles:
 
                 # Some candles returned by Bitmex miss data
                 if c['open'] is None or c['close'] is None:
@@ -172,8 +381,54 @@ class BitmexClient:
 
         return candles
 
+    # Una página de velas entre start_time y end_time (ms, aperturas incluidas) en formato columnar (CANDLE_DTYPE).
+    # La usa history.download_history() para bajar rangos más largos que un request.
+    def get_candles_page(self, contract: Contract, timeframe: str, start_time: int,
+                         end_time: int) -> typing.Optional[np.ndarray]:
+        return self._run_steps(self._get_candles_page_steps(contract, timeframe, start_time, end_time))
+
+    def _get_candles_page_steps(self, contract: Contract, timeframe: str, start_time: int,
+                                end_time: int) -> RequestSteps:
+        tf_seconds = BITMEX_TF_MINUTES[timeframe] * 60
+
+        data = dict()
+        data['symbol'] = contract.symbol
+        data['partial'] = True
+        data['binSize'] = timeframe
+        data['count'] = 500
+        # el timestamp de las velas de Bitmex es el del cierre
+        data['startTime'] = datetime.datetime.utcfromtimestamp(start_time / 1000 + tf_seconds).strftime(
+            "%Y-%m-%dT%H:%M:%S.000Z")
+        data['endTime'] = datetime.datetime.utcfromtimestamp(end_time / 1000 + tf_seconds).strftime(
+            "%Y-%m-%dT%H:%M:%S.000Z")
+
+        raw_candles = yield "GET", "/api/v1/trade/bucketed", data
+
+        if raw_candles is None:
+            return None
+
+        return bitmex_buckets_to_array(raw_candles, timeframe)
+
     def place_order(self, contract: Contract, order_type: str, quantity: int, side: str, price=None,
                     tif=None) -> OrderStatus:
+        return self._run_steps(self._place_order_steps(contract, order_type, quantity, side, price, tif))
+
+    def _place_order_steps(self, contract: Contract, order_type: str, quantity: int, side: str, price=None,
+                           tif=None) -> RequestSteps:
+        data = self._order_data(contract, order_type, quantity, side, price, tif)
+
+        order_status = yield "POST", "/api/v1/order", data
+
+        if order_status is not None:
+            self._remember_order(order_status)
+            order_status = OrderStatus(order_status, "bitmex")
+
+        return order_status
+
+    # Parámetros de una orden, para place_order() y place_orders()
+    @staticmethod
+    def _order_data(contract: Contract, order_type: str, quantity: int, side: str, price=None,
+                    tif=None) -> typing.Dict:
         data = dict()
 
         data['symbol'] = contract.symbol
@@ -187,19 +442,54 @@ class BitmexClient:
         if tif is not None:
             data['timeInForce'] = tif
 
-        order_status = self._make_request("POST", "/api/v1/order", data)
+        return data
 
-        if order_status is not None:
-            order_status = OrderStatus(order_status, "bitmex")
+    def place_orders(self, orders: typing.List[OrderRequest]) -> typing.List[typing.Optional[OrderStatus]]:
 
-        return order_status
+        """
+        Place several orders with one request (POST /api/v1/order/bulk).
+        :return: the OrderStatus of each order in the same order, None for all of them if the request failed
+        """
+
+        return self._run_steps(self._place_orders_steps(orders))
+
+    def _place_orders_steps(self, orders: typing.List[OrderRequest]) -> RequestSteps:
+        data = dict()
+        data['orders'] = json.dumps([self._order_data(o.contract, o.order_type, o.quantity, o.side, o.price, o.tif)
+                                     for o in orders])
+
+        response = yield "POST", "/api/v1/order/bulk", data
+
+        return self._bulk_statuses(response, len(orders))
+
+    # Las órdenes que devuelve Bitmex (en el mismo orden que las del request) como OrderStatus
+    def _bulk_statuses(self, response: typing.Optional[typing.List[typing.Dict]],
+                       count: int) -> typing.List[typing.Optional[OrderStatus]]:
+        if response is None:
+            return [None] * count
+
+        statuses = []
+
+        for order in response:
+            # el DELETE devuelve las órdenes que no pudo cancelar con su error
+            if order.get('error') is not None:
+                logger.error("Bitmex error on order %s: %s", order.get('orderID'), order['error'])
+                statuses.append(None)
+            else:
+                self._remember_order(order)
+                statuses.append(OrderStatus(order, "bitmex"))
+
+        return statuses
 
     def cancel_order(self, order_id: str) -> OrderStatus:
+        return self._run_steps(self._cancel_order_steps(order_id))
+
+    def _cancel_order_steps(self, order_id: str) -> RequestSteps:
         data = dict()
 
         data['orderID'] = order_id
 
-        order_status = self._make_request("DELETE", "/api/v1/order", data)
+        order_status = yield "DELETE", "/api/v1/order", data
 
         if order_status is not None:
             # trae una lista de diccionarios el DELETE, ya que podemos cancelar mas de 1 orden con un request.
@@ -208,23 +498,97 @@ class BitmexClient:
 
         return order_status
 
-    # Este método, a diferencia de Binance, no trae al principio el order_id directamente, sino que trae una lista de
-    # diccionarios. En esa lista debemos buscar nuestro order_id (de nuestra orden pasada previamente) y una vez
-    # encontrado, devolverá el estado.
+    # El DELETE de /api/v1/order acepta una lista de orderID
+    def cancel_orders(self, order_ids: typing.List[str]) -> typing.List[typing.Optional[OrderStatus]]:
+        return self._run_steps(self._cancel_orders_steps(order_ids))
+
+    def _cancel_orders_steps(self, order_ids: typing.List[str]) -> RequestSteps:
+        data = dict()
+        data['orderID'] = json.dumps(order_ids)
+
+        response = yield "DELETE", "/api/v1/order", data
+
+        return self._bulk_statuses(response, len(order_ids))
+
+    # El estado de las órdenes sale de lo que mandó el websocket (tablas order y execution). Sólo las que no están
+    # (por ejemplo si se cayó la conexión) se piden por REST, filtrando por orderID en vez de traer todo el historial.
     def get_order_status(self, contract: Contract, order_id: str) -> OrderStatus:
+        return self._run_steps(self._get_order_status_steps(contract, order_id))
+
+    def _get_order_status_steps(self, contract: Contract, order_id: str) -> RequestSteps:
+        orders_status = yield from self._get_orders_status_steps(contract, [order_id])
+
+        if orders_status is not None:
+            return orders_status.get(order_id)
+
+    def get_orders_status(self, contract: Contract,
+                          order_ids: typing.List[str]) -> typing.Optional[typing.Dict[str, OrderStatus]]:
+        return self._run_steps(self._get_orders_status_steps(contract, order_ids))
+
+    def _get_orders_status_steps(self, contract: Contract, order_ids: typing.List[str]) -> RequestSteps:
+        orders_status = self._cached_orders_status(order_ids)
+        missing = [order_id for order_id in order_ids if order_id not in orders_status]
+
+        if len(missing) == 0:
+            return orders_status
 
         data = dict()
         data['symbol'] = contract.symbol
-        # el reverse = True, significa que de toda la lista de id's que encuentre, traerá los más actuales (nuevos)
-        # primero.
-        data['reverse'] = True
+        data['filter'] = json.dumps({'orderID': missing})
 
-        order_status = self._make_request("GET", "/api/v1/order", data)
+        orders = yield "GET", "/api/v1/order", data
 
-        if order_status is not None:
-            for order in order_status:
-                if order['orderID'] == order_id:
-                    return OrderStatus(order, "bitmex")
+        if orders is None:
+            return None
+
+        for order in orders:
+            orders_status[order['orderID']] = OrderStatus(order, "bitmex")
+
+        return orders_status
+
+    def _cached_orders_status(self, order_ids: typing.List[str]) -> typing.Dict[str, OrderStatus]:
+        with self._orders_lock:
+            return {order_id: OrderStatus(self._orders[order_id], "bitmex") for order_id in order_ids
+                    if order_id in self._orders}
+
+    # Guarda la respuesta de place_order() si el websocket todavía no mandó nada de esa orden (si ya mandó, lo del
+    # websocket puede ser más nuevo)
+    def _remember_order(self, order: typing.Dict):
+        with self._orders_lock:
+            if order['orderID'] not in self._orders:
+                self._orders[order['orderID']] = {'avgPx': order.get('avgPx') or 0, 'cumQty': order.get('cumQty') or 0,
+                                                  'orderID': order['orderID'], 'ordStatus': order['ordStatus']}
+                self._trim_orders()
+
+    # Filas de las tablas order y execution. Las órdenes que llegan a un estado final se le pasan al OrderTracker,
+    # que avisa a la estrategia sin esperar a la próxima consulta.
+    def _update_orders(self, rows: typing.List[typing.Dict], partial: bool = False):
+        updated = []
+
+        with self._orders_lock:
+            # el partial de la tabla order (al suscribirse) trae las órdenes abiertas. Lo que pasó con las demás
+            # mientras no había conexión se pide por REST
+            if partial:
+                self._orders.clear()
+
+            for row in rows:
+                order = self._orders.pop(row['orderID'], {'avgPx': 0, 'cumQty': 0})
+                for field in ORDER_FIELDS:
+                    if row.get(field) is not None:
+                        order[field] = row[field]
+
+                self._orders[row['orderID']] = order
+                if 'ordStatus' in order:
+                    updated.append(OrderStatus(order, "bitmex"))
+
+            self._trim_orders()
+
+        for order_status in updated:
+            self.order_tracker.push(order_status)
+
+    def _trim_orders(self):
+        while len(self._orders) > MAX_CACHED_ORDERS:
+            self._orders.popitem(last=False)
 
     # Websocket Methods
 
@@ -232,40 +596,81 @@ class BitmexClient:
 
         # lleva como argumentos: url y callback functions
         self.ws = websocket.WebSocketApp(self._wss_url, on_open=self._on_open, on_close=self._on_close,
-                                         on_error=self._on_error, on_message=self._on_message)
+                                         on_error=self._on_error, on_message=self._on_ws_message,
+                                         on_pong=self._on_pong)
 
         # inicia el loop infinito esperando mensajes del websocket server
-        # Si llega a dar error o se cae la conexión, espera 2 segundos para reconectarse automaticamente
+        # Si llega a dar error o se cae la conexión, espera (cada vez más si sigue fallando, ver ws_health.py) para
+        # reconectarse automaticamente
         while True:
             try:
                 # determino si la variable está en True or false para reconectarse automaticamente dependiendo si
                 # cierro o no el bot.
                 if self.reconnect:
-                    self.ws.run_forever()
+                    self.ws.run_forever(ping_interval=PING_INTERVAL, ping_timeout=PING_TIMEOUT)
                 else:
                     break
             except Exception as e:
                 logger.error("Bitmex error in run_forever() method: %s", e)
-            time.sleep(2)
+            time.sleep(self.ws_health.reconnect_delay())
 
     def _on_open(self, ws):
         logger.info("Bitmex Websocket connection opened")
-        # Acá se suscribe al channel instrument
-        self.subscribe_channel("instrument")
-
-        # Acá se suscribe al channel trade para sacar datos de las velas del websocket
-        self.subscribe_channel("trade")
+        self.ws_connected = True
+        self.ws_health.on_open()
+
+        # Acá se suscribe al channel instrument (bid / ask) y al channel trade (para sacar datos de las velas del
+        # websocket), sólo de los symbols que se usan
+        for channel in ("instrument", "trade"):
+            symbols = self.ws_subscriptions[channel]
+            if len(symbols) > 0:
+                self._send_subscription("subscribe", [channel + ":" + symbol for symbol in symbols])
+
+        # Las tablas margin (balances), order y execution son privadas, así que primero hay que autenticar la conexión
+        self._authenticate_ws()
+        self.subscribe_channel("margin")
+        self.subscribe_channel("order")
+        self.subscribe_channel("execution")
+
+        # los libros vuelven a empezar con el partial de la nueva suscripción
+        for book in list(self.order_books.values()):
+            book.reset()
+            self.subscribe_channel(book.topic)
+
+        # los mensajes esperan a que termine _on_open(), así las velas perdidas se cargan antes que los trades nuevos
+        if self.ws_health.reconnects > 0:
+            self._backfill_candles(self.ws_subscriptions["trade"])
 
     def _on_close(self, ws):
         logger.warning("Bitmex Websocket connection closed")
+        self.ws_connected = False
+        self.ws_health.on_close()
+
+    def _on_ws_message(self, ws, msg: str):
+        self.ws_health.on_message(len(msg))
+        self._on_message(ws, msg)
+
+    def _on_pong(self, ws, data):
+        self.ws_health.on_pong(ws.last_pong_tm - ws.last_ping_tm)
+
+    # Las velas que faltan de cada estrategia desde la última que tiene guardada, una vez por symbol y timeframe
+    def _backfill_candles(self, symbols: typing.List[str]):
+        for contract, timeframe, start_time, strategies in missed_candles(self.strategies, symbols):
+            candles = self.get_historical_candles(contract, timeframe, start_time)
+            for strat in strategies:
+                strat.backfill_candles(candles)
+
+    # Métricas de la conexión de websocket (ver connectors/ws_health.py)
+    def ws_stats(self) -> typing.Dict[str, typing.Dict]:
+        return {"realtime": self.ws_health.stats()}
 
     def _on_error(self, ws, msg: str):
         logger.error("Bitmex Websocket connection error: %s", msg)
 
     def _on_message(self, ws, msg: str):
 
-        # Una vez recibidos los datos del ws, convierto el jsonString a jsonObject, a fin de mostrarlo claramente
-        data = json.loads(msg)
+        # Una vez recibidos los datos del ws, convierto el jsonString a jsonObject (con orjson si está, ver decoder.py)
+        data = loads(msg)
 
         # la e se refiere al evento (al canal) del cual estoy recibiendo la información
         if "table" in data:
@@ -281,60 +686,120 @@ class BitmexClient:
                     if 'askPrice' in d:
                         self.prices[symbol]['ask'] = d['askPrice']
 
-                    # Para calcular el update del pnl que se muestra en la interface, voy calculando en base a la
-                    # posición que tengo (long o short) y comparo contra cerrar la posición contra el bid o ask
-                    # (dependiendo la posición que tenga)
-                    try:
-                        for b_index, strat in self.strategies.items():
-                            if strat.contract.symbol == symbol:
-                                for trade in strat.trades:
-                                    if trade.status == "open" and trade.entry_price is not None:
-
-                                        if trade.side == "long":
-                                            price = self.prices[symbol]['bid']
-                                        else:
-                                            price = self.prices[symbol]['ask']
-                                        multiplier = trade.contract.multiplier
-
-                                        if trade.contract.inverse:
-                                            if trade.side == "long":
-                                                trade.pnl = (1 / trade.entry_price - 1 / price) * multiplier \
-                                                            * trade.quantity
-                                            elif trade.side == "short":
-                                                trade.pnl = (1 / price - 1 / trade.entry_price) * multiplier \
-                                                            * trade.quantity
-
-                                        else:
-                                            if trade.side == "long":
-                                                trade.pnl = (price - trade.entry_price) * multiplier * trade.quantity
-                                            elif trade.side == "short":
-                                                trade.pnl = (trade.entry_price - price) * multiplier * trade.quantity
-                    except RuntimeError as e:
-                        logger.error("Error while looping through the Bitmex strategies: %s", e)
+                    # Update del pnl que se muestra en la interface, sólo de los trades abiertos de este symbol
+                    # (con la lógica de contratos inverse / quanto de Bitmex en OpenPositions)
+                    self.open_positions.mark_to_market(symbol, self.prices[symbol]['bid'], self.prices[symbol]['ask'])
+
+            if data['table'] == "margin":
+                for d in data['data']:
+                    self._update_balance(d)
+
+            if data['table'] == "order":
+                self._update_orders(data['data'], partial=data['action'] == "partial")
+
+            if data['table'] == "execution":
+                # sólo las ejecuciones de trades (no funding, cancelaciones...)
+                self._update_orders([d for d in data['data'] if d.get('execType') == "Trade"])
+
+            if data['table'] in ORDER_BOOK_TABLES:
+                self._update_order_books(data)
 
             if data['table'] == "trade":
 
-                for d in data['data']:
+                if self._recorder is not None:
+                    self._recorder.record(msg)
 
-                    symbol = d['symbol']
-                    # convierto de ISO 8601 a timestamp y como queda en milisegundos multiplico por 1000 para pasar
-                    # a segundos  y luego lo paso a int
-                    ts = int(dateutil.parser.isoparse(d['timestamp']).timestamp() * 1000)
-
-                    # Hago loop en la estrategia cada vez que recibo nueva información de precios de candles
-                    # para ir viendo como afecta el nuevo precio a la estrategia (TP, SL , etc)
-                    for key, strat in self.strategies.items():
-                        if strat.contract.symbol == symbol:
-                            # paso para parsear el trade: precio (p), quantity (q) y timestamp (T)
-                            # lo guardo en una variable result. Ese result es para update la candle o crear una nueva
-                            res = strat.parse_trades(float(d['price']), float(d['size']), ts)
-                            strat.check_trade(res)
+                # (symbol, precio, size, timestamp) de cada trade
+                for tick in decode_bitmex_trades(data['data']):
+                    self._dispatch_trade(*tick)
+
+    # Un mensaje de las tablas orderBookL2 puede traer filas de varios symbols
+    def _update_order_books(self, data: typing.Dict):
+        rows_by_symbol = dict()
+        for d in data['data']:
+            rows_by_symbol.setdefault(d['symbol'], []).append(d)
+
+        for symbol, rows in rows_by_symbol.items():
+            book = self.order_books.get(symbol)
+            if book is None or book.table != data['table']:
+                continue
+
+            if book.on_message(data['action'], rows):
+                logger.warning("Bitmex %s: unknown order book level, subscribing to %s again", symbol, book.topic)
+                self._resync_order_book(book)
+
+    # Hago loop en las estrategias de este symbol cada vez que recibo nueva información de precios
+    # de candles para ir viendo como afecta el nuevo precio a la estrategia (TP, SL , etc)
+    def _dispatch_trade(self, symbol: str, price: float, size: float, timestamp: int):
+        for strat in self._strategies_by_symbol.get(symbol, ()):
+            strat.on_trade(price, size, timestamp)
+
+    # https://www.bitmex.com/app/wsAPI#Authentication
+    def _authenticate_ws(self):
+        expires = str(int(self.clock.now()) + 5)
+        signature = self._generate_signature("GET", "/realtime", expires, dict())
+
+        try:
+            self.ws.send(json.dumps({'op': "authKeyExpires", 'args': [self._public_key, int(expires), signature]}))
+        except Exception as e:
+            logger.error("Websocket error while authenticating: %s", e)
+
+    # Actualiza self.balances con una fila de la tabla margin. Los updates sólo traen los campos que cambiaron.
+    def _update_balance(self, margin: typing.Dict):
+        currency = margin['currency']
+
+        if currency not in self.balances:
+            if all(margin.get(field) is not None for field in MARGIN_FIELDS):
+                self.balances[currency] = Balance(margin, "bitmex")
+            return
+
+        balance = self.balances[currency]
+        for field, attribute in MARGIN_FIELDS.items():
+            if margin.get(field) is not None:
+                setattr(balance, attribute, margin[field] * BITMEX_MULTIPLIER)
+
+    # Reconciliación periódica de los balances por REST
+    def _maintain_balances(self):
+        while self.reconnect:
+            time.sleep(BALANCES_RECONCILE_INTERVAL)
+
+            balances = self.get_balances()
+            if len(balances) > 0:
+                self.balances = balances
 
     def subscribe_channel(self, topic: str):
+        self._send_subscription("subscribe", [topic])
+
+    def unsubscribe_channel(self, topic: str):
+        self._send_subscription("unsubscribe", [topic])
+
+    # Tablas instrument y trade sólo de los symbols de la watchlist y de las estrategias (trade:XBTUSD), en vez de
+    # las de todos los contratos de Bitmex. Se vuelven a suscribir al reconectar, en _on_open().
+    def subscribe_symbols(self, contracts: typing.List[Contract], channel: str):
+        new_symbols = [c.symbol for c in contracts if c.symbol not in self.ws_subscriptions[channel]]
+        if len(new_symbols) == 0:
+            return
+
+        self.ws_subscriptions[channel] = self.ws_subscriptions[channel] + new_symbols
+
+        # si todavía no se conectó, la suscripción se manda en _on_open()
+        if self.ws_connected:
+            self._send_subscription("subscribe", [channel + ":" + symbol for symbol in new_symbols])
+
+    def unsubscribe_symbols(self, contracts: typing.List[Contract], channel: str):
+        symbols = [c.symbol for c in contracts if c.symbol in self.ws_subscriptions[channel]]
+        if len(symbols) == 0:
+            return
+
+        self.ws_subscriptions[channel] = [s for s in self.ws_subscriptions[channel] if s not in symbols]
+
+        if self.ws_connected:
+            self._send_subscription("unsubscribe", [channel + ":" + symbol for symbol in symbols])
+
+    def _send_subscription(self, op: str, topics: typing.List[str]):
         data = dict()
-        data['op'] = "subscribe"
-        data['args'] = []
-        data['args'].append(topic)
+        data['op'] = op
+        data['args'] = topics
 
         # La función json.dumps() convertirá un subconjunto de objetos de Python en una cadena json.
         # No todos los objetos son convertibles
@@ -343,15 +808,44 @@ class BitmexClient:
         try:
             self.ws.send(json.dumps(data))
         except Exception as e:
-            logger.error("Websocket error while subscribing to %s %s", topic, e)
+            logger.error("Websocket error while sending %s to %s: %s", op, ','.join(topics), e)
+
+    # Libro de órdenes local del contrato, en self.order_books[symbol]. full_depth usa la tabla orderBookL2 (todos
+    # los niveles) en vez de orderBookL2_25.
+    def subscribe_order_book(self, contract: Contract, full_depth: bool = False) -> BitmexOrderBook:
+        if contract.symbol not in self.order_books:
+            table = ORDER_BOOK_TABLES[1] if full_depth else ORDER_BOOK_TABLES[0]
+            self.order_books[contract.symbol] = BitmexOrderBook(contract.symbol, table)
+            self.subscribe_channel(self.order_books[contract.symbol].topic)
+
+        return self.order_books[contract.symbol]
+
+    def unsubscribe_order_book(self, contract: Contract):
+        book = self.order_books.pop(contract.symbol, None)
+        if book is not None:
+            self.unsubscribe_channel(book.topic)
+
+    # Con una suscripción nueva Bitmex vuelve a mandar el partial del libro
+    def _resync_order_book(self, book: BitmexOrderBook):
+        self.unsubscribe_channel(book.topic)
+        self.subscribe_channel(book.topic)
 
     # Determino el tamaño del trade en base a lo establecido en la UI (el número que paso)
     # Necesito pasar como parámetro el contract para determinar a través del redondeo (round) la cant que voy a
     # entrar como posición.
     def get_trade_size(self, contract: Contract, price: float, balance_pct: float):
+        return self._run_steps(self._get_trade_size_steps(contract, price, balance_pct))
+
+    def _get_trade_size_steps(self, contract: Contract, price: float, balance_pct: float) -> RequestSteps:
+        # los balances se mantienen al día con la tabla margin del websocket, así que no hace falta pedirlos por REST
+        # (salvo que todavía no se hayan podido cargar)
+        balances = self.balances if len(self.balances) > 0 else (yield from self._get_balances_steps())
+
+        return self._trade_size(contract, balances, price, balance_pct)
 
-        # averiguamos si el balance está updateado.
-        balance = self.get_balances()
+    # Cálculo de la cantidad de contratos a partir de los balances
+    def _trade_size(self, contract: Contract, balance: typing.Optional[typing.Dict[str, Balance]], price: float,
+                    balance_pct: float):
         if balance is not None:
             # Definimos que usaremos XBt para operar. OJO con esto porque si usamos otro stable o crypto no
             # funcionará el trade, ya que no lo estamos definiendo como moneda de margen.
@@ -0,0 +1,293 @@
+# Versión asyncio de BitmexClient (ver connectors/async_support.py y connectors/binance_async.py).
+# Mismos métodos públicos, pero los que van al exchange son corutinas (aiohttp) y el websocket es una task del loop.
+# Lo que no va al exchange (add_strategy(), remove_strategy(), _on_message()...) se hereda de BitmexClient, y los
+# métodos REST corren los mismos generadores de requests que los de BitmexClient (ver _run_steps()).
+import asyncio
+import logging
+import threading
+import typing
+import json
+
+import aiohttp
+import numpy as np
+
+from models import *
+from connectors.bitmex import BitmexClient, BALANCES_RECONCILE_INTERVAL, ORDER_BOOK_TABLES
+from connectors.clock_sync import CLOCK_SYNC_INTERVAL
+from connectors.http_session import RequestSteps
+from connectors.order_book import BitmexOrderBook
+from connectors.order_batcher import OrderRequest
+from connectors.async_support import create_async_session, timed_async_request, run_async_steps, BlockingClient, \
+    StrategyWorker, read_messages
+from connectors.ws_health import missed_candles
+
+logger = logging.getLogger()
+
+
+class AsyncBitmexClient(BitmexClient):
+    def __init__(self, public_key: str, secret_key: str, testnet: bool, pool_size: int = 10,
+                 timeout: typing.Tuple[float, float] = (3.05, 10), max_retries: int = 2):
+
+        # No se conecta a nada hasta start(), que tiene que correr dentro del event loop. BitmexClient.__init__()
+        # sí se conecta, por eso no se llama: la configuración y el estado vienen de los mismos métodos que usa.
+        self._init_config(public_key, secret_key, testnet)
+
+        self._pool_size = pool_size
+        self._timeout = timeout
+        self._max_retries = max_retries
+        self._session: typing.Optional[aiohttp.ClientSession] = None
+
+        self.loop: typing.Optional[asyncio.AbstractEventLoop] = None
+        self.loop_thread_id: typing.Optional[int] = None
+
+        # cliente sincrónico para las estrategias y el OrderTracker, que corren en sus propios threads
+        self.blocking = BlockingClient(self)
+        self._init_state(self.blocking)
+        self._strategy_worker = StrategyWorker(self)
+
+        self.ws: typing.Optional[aiohttp.ClientWebSocketResponse] = None
+        # tasks del loop: websocket, reconciliación de balances y sincronización del reloj
+        self._tasks: typing.List[asyncio.Task] = []
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loop_thread_id = threading.get_ident()
+
+        self._session = create_async_session(self._pool_size, self._timeout)
+
+        await self._sync_clock()
+        self.contracts = await self.get_contracts()
+        self.balances = await self.get_balances()
+
+        self._strategy_worker.start()
+        self._tasks.append(asyncio.create_task(self._start_ws()))
+        self._tasks.append(asyncio.create_task(self._maintain_balances()))
+        self._tasks.append(asyncio.create_task(self._maintain_clock()))
+
+        logger.info("Bitmex async client succesfully initialized")
+
+    async def close(self):
+        self.reconnect = False
+
+        if self.ws is not None:
+            await self.ws.close()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        self._strategy_worker.stop()
+        self.order_tracker.stop()
+        self.order_batcher.stop()
+
+        if self._session is not None:
+            await self._session.close()
+
+    async def _make_request(self, method: str, endpoint: str, data: typing.Dict):
+        if method not in ("GET", "POST", "PUT", "DELETE"):
+            raise ValueError()
+
+        await self.scheduler.acquire_async(*self._request_cost(method, endpoint))
+
+        headers = dict()
+        expires = str(int(self.clock.now()) + 5)
+        headers['api-expires'] = expires
+        headers['api-key'] = self._public_key
+        headers['api-signature'] = self._generate_signature(method, endpoint, expires, data)
+
+        try:
+            status, response, response_headers = await timed_async_request(self._session, self.latency, method,
+                                                                           self._base_url, endpoint, data, headers,
+                                                                           max_retries=self._max_retries)
+        except Exception as e:
+            logger.error("Connection error while making %s request to %s: %s", method, endpoint, e)
+            return None
+
+        self.scheduler.update(status, response_headers)
+
+        if status == 200:
+            return response
+        else:
+            logger.error("Error while making %s request to %s: %s (error code %s)",
+                         method, endpoint, response, status)
+            return None
+
+    # Los requests y las respuestas se arman en los generadores de BitmexClient (_get_contracts_steps()...): estos
+    # métodos sólo los corren con el _make_request() de aiohttp
+    async def _run_steps(self, steps: RequestSteps):
+        return await run_async_steps(steps, self._make_request)
+
+    async def get_contracts(self) -> typing.Dict[str, Contract]:
+        return await self._run_steps(self._get_contracts_steps())
+
+    async def get_balances(self) -> typing.Dict[str, Balance]:
+        return await self._run_steps(self._get_balances_steps())
+
+    async def get_historical_candles(self, contract: Contract, timeframe: str,
+                                     start_time: typing.Optional[int] = None) -> typing.List[Candle]:
+        return await self._run_steps(self._get_historical_candles_steps(contract, timeframe, start_time))
+
+    async def get_candles_page(self, contract: Contract, timeframe: str, start_time: int,
+                               end_time: int) -> typing.Optional[np.ndarray]:
+        return await self._run_steps(self._get_candles_page_steps(contract, timeframe, start_time, end_time))
+
+    async def place_order(self, contract: Contract, order_type: str, quantity: int, side: str, price=None,
+                          tif=None) -> OrderStatus:
+        return await self._run_steps(self._place_order_steps(contract, order_type, quantity, side, price, tif))
+
+    async def cancel_order(self, order_id: str) -> OrderStatus:
+        return await self._run_steps(self._cancel_order_steps(order_id))
+
+    async def place_orders(self, orders: typing.List[OrderRequest]) -> typing.List[typing.Optional[OrderStatus]]:
+        return await self._run_steps(self._place_orders_steps(orders))
+
+    async def cancel_orders(self, order_ids: typing.List[str]) -> typing.List[typing.Optional[OrderStatus]]:
+        return await self._run_steps(self._cancel_orders_steps(order_ids))
+
+    async def get_order_status(self, contract: Contract, order_id: str) -> OrderStatus:
+        return await self._run_steps(self._get_order_status_steps(contract, order_id))
+
+    async def get_orders_status(self, contract: Contract,
+                                order_ids: typing.List[str]) -> typing.Optional[typing.Dict[str, OrderStatus]]:
+        return await self._run_steps(self._get_orders_status_steps(contract, order_ids))
+
+    async def get_trade_size(self, contract: Contract, price: float, balance_pct: float):
+        return await self._run_steps(self._get_trade_size_steps(contract, price, balance_pct))
+
+    # Websocket: una task del loop que se reconecta sola cada 2 segundos si se cae la conexión
+
+    async def _start_ws(self):
+        while self.reconnect:
+            try:
+                # los pings los manda keep_alive() (ver connectors/ws_health.py), así se mide la latencia
+                async with self._session.ws_connect(self._wss_url, autoping=False) as ws:
+                    self.ws = ws
+                    await self._on_open(ws)
+
+                    await read_messages(ws, self.ws_health, self._on_message, self._on_error,
+                                        expects_data=lambda: len(self.ws_subscriptions["instrument"]) > 0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Bitmex error in the websocket task: %s", e)
+
+            self._on_close(self.ws)
+
+            if self.reconnect:
+                await asyncio.sleep(self.ws_health.reconnect_delay())
+
+    async def _on_open(self, ws):
+        logger.info("Bitmex Websocket connection opened")
+        self.ws_connected = True
+        self.ws_health.on_open()
+
+        for channel in ("instrument", "trade"):
+            symbols = self.ws_subscriptions[channel]
+            if len(symbols) > 0:
+                await self._send_subscription("subscribe", [channel + ":" + symbol for symbol in symbols])
+
+        # Las tablas margin (balances), order y execution son privadas, así que primero hay que autenticar la
+        # conexión. Las filas las procesa _on_message() de BitmexClient.
+        expires = str(int(self.clock.now()) + 5)
+        signature = self._generate_signature("GET", "/realtime", expires, dict())
+        await ws.send_str(json.dumps({'op': "authKeyExpires", 'args': [self._public_key, int(expires), signature]}))
+        await self.subscribe_channel("margin")
+        await self.subscribe_channel("order")
+        await self.subscribe_channel("execution")
+
+        for book in list(self.order_books.values()):
+            book.reset()
+            await self.subscribe_channel(book.topic)
+
+        # los mensajes se leen recién después de _on_open()
+        if self.ws_health.reconnects > 0:
+            await self._backfill_candles(self.ws_subscriptions["trade"])
+
+    # Las velas se piden desde el loop y se cargan en el thread del StrategyWorker, en orden con los trades
+    async def _backfill_candles(self, symbols: typing.List[str]):
+        for contract, timeframe, start_time, strategies in missed_candles(self.strategies, symbols):
+            candles = await self.get_historical_candles(contract, timeframe, start_time)
+            for strat in strategies:
+                self._strategy_worker.call(strat.backfill_candles, candles)
+
+    async def _sync_clock(self):
+        await self._run_steps(self._sync_clock_steps())
+
+    async def _maintain_clock(self):
+        while self.reconnect:
+            await asyncio.sleep(CLOCK_SYNC_INTERVAL)
+            await self._sync_clock()
+
+    async def _maintain_balances(self):
+        while self.reconnect:
+            await asyncio.sleep(BALANCES_RECONCILE_INTERVAL)
+
+            balances = await self.get_balances()
+            if len(balances) > 0:
+                self.balances = balances
+
+    # Los trades se procesan en el thread del StrategyWorker, así una estrategia que manda una orden no frena el loop
+    def _dispatch_trade(self, symbol: str, price: float, size: float, timestamp: int):
+        if symbol in self._strategies_by_symbol:
+            self._strategy_worker.submit(symbol, price, size, timestamp)
+
+    async def subscribe_channel(self, topic: str):
+        await self._send_subscription("subscribe", [topic])
+
+    async def unsubscribe_channel(self, topic: str):
+        await self._send_subscription("unsubscribe", [topic])
+
+    async def subscribe_symbols(self, contracts: typing.List[Contract], channel: str):
+        new_symbols = [c.symbol for c in contracts if c.symbol not in self.ws_subscriptions[channel]]
+        if len(new_symbols) == 0:
+            return
+
+        self.ws_subscriptions[channel] = self.ws_subscriptions[channel] + new_symbols
+
+        if self.ws_connected:
+            await self._send_subscription("subscribe", [channel + ":" + symbol for symbol in new_symbols])
+
+    async def unsubscribe_symbols(self, contracts: typing.List[Contract], channel: str):
+        symbols = [c.symbol for c in contracts if c.symbol in self.ws_subscriptions[channel]]
+        if len(symbols) == 0:
+            return
+
+        self.ws_subscriptions[channel] = [s for s in self.ws_subscriptions[channel] if s not in symbols]
+
+        if self.ws_connected:
+            await self._send_subscription("unsubscribe", [channel + ":" + symbol for symbol in symbols])
+
+    async def _send_subscription(self, op: str, topics: typing.List[str]):
+        data = dict()
+        data['op'] = op
+        data['args'] = topics
+
+        if self.ws is None or self.ws.closed:
+            return
+
+        try:
+            await self.ws.send_str(json.dumps(data))
+        except Exception as e:
+            logger.error("Websocket error while sending %s to %s: %s", op, ','.join(topics), e)
+
+    async def subscribe_order_book(self, contract: Contract, full_depth: bool = False) -> BitmexOrderBook:
+        if contract.symbol not in self.order_books:
+            table = ORDER_BOOK_TABLES[1] if full_depth else ORDER_BOOK_TABLES[0]
+            self.order_books[contract.symbol] = BitmexOrderBook(contract.symbol, table)
+            await self.subscribe_channel(self.order_books[contract.symbol].topic)
+
+        return self.order_books[contract.symbol]
+
+    async def unsubscribe_order_book(self, contract: Contract):
+        book = self.order_books.pop(contract.symbol, None)
+        if book is not None:
+            await self.unsubscribe_channel(book.topic)
+
+    # _on_message() corre en el loop: la nueva suscripción se manda desde una task
+    def _resync_order_book(self, book: BitmexOrderBook):
+        task = asyncio.create_task(self._resubscribe(book.topic))
+        self._tasks.append(task)
+        task.add_done_callback(self._tasks.remove)
+
+    async def _resubscribe(self, topic: str):
+        await self.unsubscribe_channel(topic)
+        await self.subscribe_channel(topic)
@@ -0,0 +1,176 @@
+# Sincronización del reloj local con el del exchange y medición del atraso de los trades.
+# Los requests firmados de Binance llevan un timestamp (y los de Bitmex un api-expires) del reloj local: si la
+# máquina se atrasa o adelanta más que el recvWindow, el exchange rechaza las órdenes. Y Strategy.parse_trades()
+# medía el atraso de cada trade contra ese mismo reloj y escribía un warning por cada trade atrasado más de 2
+# segundos, así que un reloj corrido llenaba el log.
+# - ClockSync estima el offset (hora del exchange - hora local) y el round-trip con la hora del servidor que traen
+#   los requests de _maintain_clock(), suavizados con un promedio exponencial. now_ms() es la hora local corregida.
+#   Si el round-trip sube para quedarse (otra ruta, otra red) y se descartan varias muestras seguidas, la estimación
+#   vuelve a empezar desde la muestra nueva.
+# - LagHistogram acumula el atraso de los trades por symbol en buckets y loguea un resumen cada tanto.
+import bisect
+import logging
+import threading
+import time
+import typing
+
+logger = logging.getLogger()
+
+# Cada cuánto los clientes piden la hora del servidor
+CLOCK_SYNC_INTERVAL = 60
+
+# Peso de cada muestra nueva en el promedio exponencial
+CLOCK_SMOOTHING = 0.2
+
+# Las muestras con un round-trip mayor que RTT_OUTLIER_FACTOR veces el promedio (más RTT_OUTLIER_MIN_MS) se
+# descartan: la respuesta pudo haber quedado esperando en cualquier punto del camino y su hora no es confiable
+RTT_OUTLIER_FACTOR = 3
+RTT_OUTLIER_MIN_MS = 50
+# Después de esta cantidad de muestras descartadas seguidas el round-trip de referencia quedó viejo: la siguiente
+# muestra se acepta como nueva referencia
+RTT_MAX_REJECTIONS = 3
+
+# Límites superiores de los buckets del histograma, en ms (el último bucket es "más de 5000")
+LAG_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2000, 5000)
+# Atraso a partir del cual un trade cuenta como atrasado en el resumen del log
+LAG_WARNING_MS = 2000
+LAG_REPORT_INTERVAL = 60
+
+
+class ClockSync:
+    def __init__(self, smoothing: float = CLOCK_SMOOTHING):
+        self.smoothing = smoothing
+
+        # hora del exchange - hora local, y round-trip del request de la hora, en ms
+        self.offset_ms = 0.
+        self.rtt_ms: typing.Optional[float] = None
+
+        self.samples = 0
+        self.rejected = 0
+        self.reseeds = 0
+        self._consecutive_rejected = 0
+        self.last_sync: typing.Optional[float] = None
+
+        self._lock = threading.Lock()
+
+    def now(self) -> float:
+        return time.time() + self.offset_ms / 1000
+
+    def now_ms(self) -> int:
+        return int(time.time() * 1000 + self.offset_ms)
+
+    def add_sample(self, sent: float, server_ms: float, received: float) -> bool:
+
+        """
+        Update the offset estimate with the server time of a request.
+        :param sent: local time (time.time()) when the request was sent
+        :param server_ms: server time in the response, in ms
+        :param received: local time when the response arrived
+        :return: False if the sample was discarded because of its round-trip (after RTT_MAX_REJECTIONS discarded in a
+        row, the next one is accepted as the new reference)
+        """
+
+        rtt_ms = (received - sent) * 1000
+        # se asume que el servidor tomó la hora a mitad del round-trip
+        offset_ms = server_ms - (sent + received) * 500
+
+        with self._lock:
+            if self.rtt_ms is None:
+                self.offset_ms = offset_ms
+                self.rtt_ms = rtt_ms
+            elif rtt_ms > self.rtt_ms * RTT_OUTLIER_FACTOR + RTT_OUTLIER_MIN_MS:
+                if self._consecutive_rejected < RTT_MAX_REJECTIONS:
+                    self._consecutive_rejected += 1
+                    self.rejected += 1
+                    return False
+
+                logger.warning("Clock sync: round-trip of %.0f ms after %s rejected samples (reference %.0f ms), "
+                               "starting over from this sample", rtt_ms, self._consecutive_rejected, self.rtt_ms)
+                self.offset_ms = offset_ms
+                self.rtt_ms = rtt_ms
+                self.reseeds += 1
+            else:
+                self.offset_ms += self.smoothing * (offset_ms - self.offset_ms)
+                self.rtt_ms += self.smoothing * (rtt_ms - self.rtt_ms)
+
+            self._consecutive_rejected = 0
+            self.samples += 1
+            self.last_sync = received
+
+        return True
+
+    def stats(self) -> typing.Dict:
+        with self._lock:
+            return {"offset_ms": self.offset_ms, "rtt_ms": self.rtt_ms, "samples": self.samples,
+                    "rejected": self.rejected, "reseeds": self.reseeds, "last_sync": self.last_sync}
+
+
+class LagHistogram:
+    def __init__(self, name: str, buckets_ms: typing.Tuple[int, ...] = LAG_BUCKETS_MS,
+                 warning_ms: int = LAG_WARNING_MS, report_interval: float = LAG_REPORT_INTERVAL):
+        self.name = name
+        self.buckets_ms = buckets_ms
+        self.warning_ms = warning_ms
+        self.report_interval = report_interval
+
+        # symbol -> cantidad de trades en cada bucket
+        self._counts: typing.Dict[str, typing.List[int]] = dict()
+        self._max_ms: typing.Dict[str, int] = dict()
+
+        # trades atrasados desde el último resumen del log
+        self._late: typing.Dict[str, int] = dict()
+        self._late_max_ms: typing.Dict[str, int] = dict()
+        self._last_report = time.monotonic()
+
+        # las estrategias de Binance reciben trades desde el thread de cada conexión del pool
+        self._lock = threading.Lock()
+
+    def record(self, symbol: str, lag_ms: int):
+        with self._lock:
+            counts = self._counts.get(symbol)
+            if counts is None:
+                counts = self._counts[symbol] = [0] * (len(self.buckets_ms) + 1)
+                self._max_ms[symbol] = lag_ms
+
+            counts[bisect.bisect_left(self.buckets_ms, lag_ms)] += 1
+            if lag_ms > self._max_ms[symbol]:
+                self._max_ms[symbol] = lag_ms
+
+            if lag_ms >= self.warning_ms:
+                self._late[symbol] = self._late.get(symbol, 0) + 1
+                self._late_max_ms[symbol] = max(self._late_max_ms.get(symbol, lag_ms), lag_ms)
+
+            if len(self._late) == 0:
+                return
+
+            now = time.monotonic()
+            if now - self._last_report < self.report_interval:
+                return
+
+            late, late_max_ms = self._late, self._late_max_ms
+            self._late, self._late_max_ms = dict(), dict()
+            self._last_report = now
+
+        # una línea por symbol y por intervalo, en vez de una por trade
+        for s, count in late.items():
+            logger.warning("%s %s: %s trades with more than %s milliseconds of lag in the last %s seconds "
+                           "(max %s ms)", self.name, s, count, self.warning_ms, self.report_interval,
+                           late_max_ms[s])
+
+    def summary(self) -> typing.Dict[str, typing.Dict]:
+
+        """
+        :return: by symbol, the trade count in each bucket ("<=10", ..., ">5000"), total count and max lag in ms
+        """
+
+        labels = ["<=" + str(b) for b in self.buckets_ms] + [">" + str(self.buckets_ms[-1])]
+
+        with self._lock:
+            return {symbol: {"buckets": dict(zip(labels, counts)), "count": sum(counts),
+                             "max_ms": self._max_ms[symbol]}
+                    for symbol, counts in self._counts.items()}
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._max_ms.clear()
@@ -0,0 +1,53 @@
+# Cantidad y monto ejecutado de las órdenes de Binance Spot, para calcular su precio promedio sin requests extra.
+# Spot no trae avgPrice como Futures: antes se bajaban los últimos /api/v3/myTrades del symbol (sin filtrar por orden)
+# en cada place_order(), cancel_order() y consulta de estado. Ahora el ledger se llena con los fills de la respuesta
+# de place_order() (newOrderRespType=FULL) y con los executionReport del user data stream.
+import collections
+import threading
+import typing
+
+MAX_LEDGER_ORDERS = 1000
+
+
+class FillLedger:
+    def __init__(self, max_orders: int = MAX_LEDGER_ORDERS):
+        self.max_orders = max_orders
+
+        # order id -> (cantidad ejecutada acumulada, monto acumulado en quote asset)
+        self._orders: typing.OrderedDict[int, typing.Tuple[float, float]] = collections.OrderedDict()
+        # se llena desde el thread del user data stream y se lee desde el de la estrategia / OrderTracker
+        self._lock = threading.Lock()
+
+    # Los executionReport traen los acumulados (z y Z), así que un mensaje repetido no cambia nada
+    def update(self, order_id: int, executed_qty: float, quote_qty: float):
+        with self._lock:
+            previous = self._orders.pop(order_id, None)
+            if previous is not None and previous[0] > executed_qty:
+                executed_qty, quote_qty = previous
+
+            self._orders[order_id] = (executed_qty, quote_qty)
+
+            while len(self._orders) > self.max_orders:
+                self._orders.popitem(last=False)
+
+    def add_fills(self, order_id: int, fills: typing.List[typing.Dict]):
+        executed_qty = sum(float(f['qty']) for f in fills)
+        quote_qty = sum(float(f['qty']) * float(f['price']) for f in fills)
+
+        self.update(order_id, executed_qty, quote_qty)
+
+    def avg_price(self, order_id: int, executed_qty: float) -> typing.Optional[float]:
+
+        """
+        :param executed_qty: quantity executed according to the order status
+        :return: average fill price, or None if the ledger hasn't seen all the fills of the order yet
+        """
+
+        with self._lock:
+            fills = self._orders.get(order_id)
+
+        # la suma de los fills en float puede dar apenas menos que executedQty
+        if fills is None or fills[0] <= 0 or fills[0] < executed_qty * (1 - 1e-9):
+            return None
+
+        return fills[1] / fills[0]
@@ -0,0 +1,114 @@
+# Sesión HTTP compartida por todos los requests REST de un cliente.
+# requests.get() / post() / delete() abren una conexión TCP + TLS nueva en cada llamada, lo que suma el handshake
+# completo a cada place_order(), get_balances() o get_order_status(). Con una requests.Session las conexiones quedan
+# abiertas (keep-alive) en un pool y se reusan.
+import collections
+import threading
+import time
+import typing
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Métodos que se pueden reintentar si el servidor responde con error o se corta la respuesta. POST no, porque una
+# orden podría quedar enviada dos veces. Los errores de conexión (el request nunca llegó) se reintentan siempre.
+IDEMPOTENT_METHODS = ["GET", "PUT", "DELETE"]
+RETRY_STATUS_CODES = [500, 502, 503, 504]
+
+
+def create_session(pool_size: int = 10, max_retries: int = 2, backoff_factor: float = 0.1) -> requests.Session:
+
+    """
+    Create a keep-alive session with a connection pool and a retry policy.
+    :param pool_size: connections kept open per host
+    :param max_retries: retries after a connection error, or a 5xx on GET / PUT / DELETE
+    :param backoff_factor: wait backoff_factor * 2 ** (retry - 1) seconds between retries
+    :return:
+    """
+
+    retry = Retry(total=max_retries, connect=max_retries, read=max_retries, status=max_retries,
+                  backoff_factor=backoff_factor, status_forcelist=RETRY_STATUS_CODES,
+                  allowed_methods=IDEMPOTENT_METHODS, raise_on_status=False)
+
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+# Latencias de los requests REST por endpoint ("GET /fapi/v1/order"...), en ms, para poder medir el round-trip de
+# las órdenes. Guarda las últimas max_samples de cada endpoint.
+class LatencyStats:
+    def __init__(self, max_samples: int = 1000):
+        self._max_samples = max_samples
+        self._samples: typing.Dict[str, typing.Deque[float]] = dict()
+        self._counts: typing.Dict[str, int] = collections.defaultdict(int)
+        # los requests se hacen desde el thread de la interfaz, el del websocket y el del OrderTracker
+        self._lock = threading.Lock()
+
+    def record(self, endpoint: str, latency_ms: float):
+        with self._lock:
+            if endpoint not in self._samples:
+                self._samples[endpoint] = collections.deque(maxlen=self._max_samples)
+            self._samples[endpoint].append(latency_ms)
+            self._counts[endpoint] += 1
+
+    def summary(self) -> typing.Dict[str, typing.Dict[str, float]]:
+        with self._lock:
+            samples = {endpoint: sorted(values) for endpoint, values in self._samples.items()}
+            counts = dict(self._counts)
+
+        result = dict()
+
+        for endpoint, values in samples.items():
+            result[endpoint] = {"count": counts[endpoint],
+                                "mean_ms": sum(values) / len(values),
+                                "p50_ms": _percentile(values, 50),
+                                "p90_ms": _percentile(values, 90),
+                                "p99_ms": _percentile(values, 99),
+                                "max_ms": values[-1]}
+
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+
+# Percentil por el método nearest-rank sobre una lista ya ordenada
+def _percentile(sorted_values: typing.List[float], pct: float) -> float:
+    index = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+# Hace el request con la sesión y registra la latencia (incluye los reintentos)
+def timed_request(session: requests.Session, stats: LatencyStats, method: str, url: str, endpoint: str,
+                  timeout: typing.Tuple[float, float], **kwargs) -> requests.Response:
+    start = time.perf_counter()
+
+    try:
+        return session.request(method, url, timeout=timeout, **kwargs)
+    finally:
+        stats.record(method + " " + endpoint, (time.perf_counter() - start) * 1000)
+
+
+# Los métodos REST de los clientes están escritos una sola vez, como generadores: cada yield es un request
+# (method, endpoint, data) y recibe la respuesta (o None si falló), y el return es el resultado del método. Así armar
+# los requests y parsear las respuestas es igual en BinanceClient y AsyncBinanceClient (lo mismo con Bitmex), y sólo
+# cambia quién hace los requests: run_steps() con el _make_request() de requests, run_async_steps() (ver
+# connectors/async_support.py) con el de aiohttp.
+RequestSteps = typing.Generator[typing.Tuple[str, str, typing.Dict], typing.Any, typing.Any]
+
+
+def run_steps(steps: RequestSteps, make_request: typing.Callable):
+    try:
+        request = next(steps)
+        while True:
+            request = steps.send(make_request(*request))
+    except StopIteration as result:
+        return result.value
@@ -0,0 +1,110 @@
+# Agrupa las órdenes de las estrategias que llegan casi al mismo tiempo en un solo request.
+# Antes cada estrategia mandaba su place_order() y se quedaba esperando la respuesta, así que cuando una vela grande
+# disparaba el TP / SL de muchas estrategias a la vez, cada salida esperaba el round-trip REST de las anteriores.
+# Ahora las estrategias dejan la orden con submit() y siguen: el thread del OrderBatcher espera unos milisegundos
+# (COALESCE_WINDOW) a que lleguen las demás, las manda juntas con client.place_orders() (batchOrders de Binance
+# Futures, order/bulk de Bitmex) y le pasa a cada estrategia el OrderStatus de su orden con el callback.
+import logging
+import threading
+import time
+import typing
+
+from models import *
+
+logger = logging.getLogger()
+
+COALESCE_WINDOW = 0.005
+
+
+class OrderRequest:
+    def __init__(self, contract: Contract, order_type: str, quantity: float, side: str, price=None, tif=None,
+                 callback: typing.Optional[typing.Callable[[typing.Optional[OrderStatus]], None]] = None):
+        self.contract = contract
+        self.order_type = order_type
+        self.quantity = quantity
+        self.side = side
+        self.price = price
+        self.tif = tif
+        self.callback = callback
+
+
+class OrderBatcher:
+    def __init__(self, client, window: float = COALESCE_WINDOW):
+        # el cliente sincrónico, o client.blocking en los clientes asyncio (como el OrderTracker)
+        self._client = client
+        # con window = 0 cada orden se manda enseguida desde el thread que llama a submit() (replay.py)
+        self.window = window
+
+        self._queue: typing.List[OrderRequest] = []
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._thread: typing.Optional[threading.Thread] = None
+        self._running = True
+
+        self.requests = 0
+        self.orders = 0
+
+    def submit(self, contract: Contract, order_type: str, quantity: float, side: str,
+               callback: typing.Callable[[typing.Optional[OrderStatus]], None], price=None, tif=None):
+
+        """
+        Queue an order to be sent with the ones submitted in the next few milliseconds.
+        :param callback: called from the batcher thread with the OrderStatus of the order, or None if it failed
+        """
+
+        order = OrderRequest(contract, order_type, quantity, side, price, tif, callback)
+
+        if self.window == 0:
+            self._send([order])
+            return
+
+        with self._lock:
+            self._queue.append(order)
+
+            # el thread se crea recién con la primera orden
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+        self._wake_up.set()
+
+    def stop(self):
+        self._running = False
+        self._wake_up.set()
+
+    def _run(self):
+        while self._running:
+            self._wake_up.wait()
+            self._wake_up.clear()
+
+            if not self._running:
+                break
+
+            # junta las órdenes que llegan en los próximos milisegundos
+            time.sleep(self.window)
+
+            with self._lock:
+                orders, self._queue = self._queue, []
+
+            if len(orders) > 0:
+                self._send(orders)
+
+    def _send(self, orders: typing.List[OrderRequest]):
+        try:
+            if len(orders) == 1:
+                o = orders[0]
+                statuses = [self._client.place_order(o.contract, o.order_type, o.quantity, o.side, o.price, o.tif)]
+            else:
+                statuses = self._client.place_orders(orders)
+        except Exception as e:
+            logger.error("%s error while placing %s orders: %s", self._client.platform, len(orders), e)
+            statuses = [None] * len(orders)
+
+        self.requests += 1
+        self.orders += len(orders)
+
+        for order, order_status in zip(orders, statuses):
+            try:
+                order.callback(order_status)
+            except Exception as e:
+                logger.error("Error in the callback of the %s order on %s: %s", order.side, order.contract.symbol, e)
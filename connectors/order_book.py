@@ -0,0 +1,315 @@
+# Libros de órdenes L2 locales, actualizados con los mensajes del websocket.
+# Con el bookTicker de Binance y la tabla instrument de Bitmex sólo se conoce el mejor bid / ask, así que no se puede
+# saber a qué precio promedio se llenaría una orden de mercado. Cada OrderBook guarda todos los niveles de precio:
+# - Binance: snapshot REST (/depth) + stream de diferencias @depth@100ms. Cada diferencia trae el rango de update ids
+#   que cubre y, si falta alguna, el libro se vacía y se pide otro snapshot.
+#   https://binance-docs.github.io/apidocs/futures/en/#how-to-manage-a-local-order-book-correctly
+# - Bitmex: tablas orderBookL2_25 / orderBookL2, con un partial y después insert / update / delete de cada nivel por
+#   su id. Un update o delete de un id desconocido significa que se perdió algún mensaje y hay que volver a
+#   suscribirse.
+#   https://www.bitmex.com/app/wsAPI#OrderBookL2
+import bisect
+import threading
+import typing
+
+# Niveles del snapshot REST de Binance
+DEPTH_SNAPSHOT_LIMIT = 1000
+
+# Diferencias que se guardan mientras llega el snapshot
+MAX_BUFFERED_UPDATES = 1000
+
+
+# Un lado del libro: precios ordenados en una lista (con bisect) y sus cantidades en otra, así cada update es una
+# búsqueda O(log n) y los mejores N niveles son un slice.
+class BookSide:
+    def __init__(self, descending: bool):
+        # los bids se ordenan por el precio negativo, así en los dos lados el mejor nivel queda primero. Los precios
+        # van también en su propia lista para no tener que convertir las keys en top().
+        self._sign = -1 if descending else 1
+        self._keys: typing.List[float] = []
+        self._prices: typing.List[float] = []
+        self._sizes: typing.List[float] = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def set(self, price: float, size: float):
+        key = price * self._sign
+        i = bisect.bisect_left(self._keys, key)
+
+        if i < len(self._keys) and self._keys[i] == key:
+            if size == 0:
+                del self._keys[i]
+                del self._prices[i]
+                del self._sizes[i]
+            else:
+                self._sizes[i] = size
+        elif size != 0:
+            self._keys.insert(i, key)
+            self._prices.insert(i, price)
+            self._sizes.insert(i, size)
+
+    def clear(self):
+        self._keys.clear()
+        self._prices.clear()
+        self._sizes.clear()
+
+    def best(self) -> typing.Optional[typing.Tuple[float, float]]:
+        if len(self._keys) == 0:
+            return None
+
+        return self._prices[0], self._sizes[0]
+
+    # (precio, cantidad) de los mejores n niveles
+    def top(self, n: int) -> typing.List[typing.Tuple[float, float]]:
+        return list(zip(self._prices[:n], self._sizes[:n]))
+
+    def fill_price(self, quantity: float) -> typing.Optional[float]:
+        remaining = quantity
+        cost = 0.
+
+        for price, size in zip(self._prices, self._sizes):
+            filled = min(size, remaining)
+            cost += filled * price
+            remaining -= filled
+            if remaining <= 0:
+                return cost / quantity
+
+        # no alcanza la profundidad del libro
+        return None
+
+
+class OrderBook:
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+
+        # False hasta cargar el snapshot / partial, y de nuevo False si se detecta un hueco en los updates
+        self.synced = False
+        self.resyncs = 0
+
+        # se actualiza desde el thread del websocket y se lee desde el de las estrategias
+        self.lock = threading.Lock()
+
+    def best_bid_ask(self) -> typing.Optional[typing.Tuple[float, float]]:
+        with self.lock:
+            bid, ask = self.bids.best(), self.asks.best()
+
+        if not self.synced or bid is None or ask is None:
+            return None
+
+        return bid[0], ask[0]
+
+    def top(self, n: int = 5) -> typing.Optional[typing.Dict[str, typing.List[typing.Tuple[float, float]]]]:
+        with self.lock:
+            if not self.synced:
+                return None
+
+            return {"bids": self.bids.top(n), "asks": self.asks.top(n)}
+
+    def estimate_fill_price(self, side: str, quantity: float) -> typing.Optional[float]:
+
+        """
+        Average price a market order would get by walking the book.
+        :param side: "buy" (takes the asks) or "sell" (takes the bids)
+        :return: None if the book is not synced or not deep enough for the quantity
+        """
+
+        with self.lock:
+            if not self.synced:
+                return None
+
+            if side.lower() == "buy":
+                return self.asks.fill_price(quantity)
+
+            return self.bids.fill_price(quantity)
+
+    def _clear(self):
+        self.bids.clear()
+        self.asks.clear()
+        self.synced = False
+
+
+class BinanceOrderBook(OrderBook):
+    def __init__(self, symbol: str, futures: bool):
+        super().__init__(symbol)
+
+        self.futures = futures
+
+        # lastUpdateId del snapshot y después el u de la última diferencia aplicada
+        self.last_update_id: typing.Optional[int] = None
+        self._applied = False
+
+        self._buffer: typing.List[typing.Dict] = []
+        self._snapshot_requested = False
+
+    def on_update(self, event: typing.Dict) -> bool:
+
+        """
+        Apply a depthUpdate event, or buffer it while there's no snapshot.
+        :return: True if the caller has to fetch a snapshot and pass it to load_snapshot()
+        """
+
+        with self.lock:
+            if self.last_update_id is None:
+                self._buffer.append(event)
+                if len(self._buffer) > MAX_BUFFERED_UPDATES:
+                    del self._buffer[0]
+                return self._request_snapshot()
+
+            if not self._apply(event):
+                self._resync(event)
+                return self._request_snapshot()
+
+        return False
+
+    def load_snapshot(self, snapshot: typing.Dict) -> bool:
+
+        """
+        :param snapshot: response of GET /fapi/v1/depth or /api/v3/depth
+        :return: True if the buffered updates don't follow the snapshot and another one is needed
+        """
+
+        with self.lock:
+            self._snapshot_requested = False
+            self._clear()
+
+            for price, size in snapshot['bids']:
+                self.bids.set(float(price), float(size))
+            for price, size in snapshot['asks']:
+                self.asks.set(float(price), float(size))
+
+            self.last_update_id = snapshot['lastUpdateId']
+            self._applied = False
+            self.synced = True
+
+            buffer, self._buffer = self._buffer, []
+            for event in buffer:
+                if not self._apply(event):
+                    self._resync(event)
+                    return self._request_snapshot()
+
+        return False
+
+    # Si falló el request del snapshot, la próxima diferencia lo vuelve a pedir
+    def snapshot_failed(self):
+        with self.lock:
+            self._snapshot_requested = False
+
+    def _request_snapshot(self) -> bool:
+        if self._snapshot_requested:
+            return False
+
+        self._snapshot_requested = True
+        return True
+
+    def _resync(self, event: typing.Dict):
+        self._clear()
+        self.last_update_id = None
+        self.resyncs += 1
+        # la diferencia que no seguía a la anterior puede servir para el snapshot nuevo
+        self._buffer = [event]
+
+    # Devuelve False si hay un hueco entre el evento y lo ya aplicado
+    def _apply(self, event: typing.Dict) -> bool:
+        first, last = event['U'], event['u']
+
+        if not self._applied:
+            # diferencias anteriores al snapshot: se descartan
+            if last < self.last_update_id or (not self.futures and last == self.last_update_id):
+                return True
+
+            # la primera diferencia tiene que incluir al lastUpdateId (Futures) o al siguiente (Spot)
+            expected = self.last_update_id if self.futures else self.last_update_id + 1
+            if not first <= expected <= last:
+                return False
+        else:
+            if last <= self.last_update_id:
+                return True
+
+            # Futures trae el u de la diferencia anterior (pu), en Spot los ids son consecutivos
+            if self.futures and event['pu'] != self.last_update_id:
+                return False
+            if not self.futures and first != self.last_update_id + 1:
+                return False
+
+        for price, size in event['b']:
+            self.bids.set(float(price), float(size))
+        for price, size in event['a']:
+            self.asks.set(float(price), float(size))
+
+        self.last_update_id = last
+        self._applied = True
+
+        return True
+
+
+class BitmexOrderBook(OrderBook):
+    def __init__(self, symbol: str, table: str = "orderBookL2_25"):
+        super().__init__(symbol)
+
+        # orderBookL2_25 (25 niveles de cada lado) u orderBookL2 (todos)
+        self.table = table
+
+        # id del nivel -> (side, precio). Los update y delete pueden no traer el precio.
+        self._levels: typing.Dict[int, typing.Tuple[str, float]] = dict()
+
+    @property
+    def topic(self) -> str:
+        return self.table + ":" + self.symbol
+
+    def on_message(self, action: str, rows: typing.List[typing.Dict]) -> bool:
+
+        """
+        Apply the rows of this symbol from an orderBookL2 message.
+        :return: True if an update / delete referenced an unknown level and the table has to be subscribed again
+        """
+
+        with self.lock:
+            if action == "partial":
+                self._reset()
+                self._insert(rows)
+                self.synced = True
+                return False
+
+            # hasta el partial no hay nada que actualizar
+            if not self.synced:
+                return False
+
+            if action == "insert":
+                self._insert(rows)
+                return False
+
+            for row in rows:
+                if action == "update":
+                    level = self._levels.get(row['id'])
+                else:
+                    level = self._levels.pop(row['id'], None)
+
+                if level is None:
+                    self._reset()
+                    self.resyncs += 1
+                    return True
+
+                side, price = level
+                book_side = self.bids if side == "Buy" else self.asks
+                book_side.set(price, row['size'] if action == "update" else 0)
+
+        return False
+
+    # Al reconectar o volver a suscribirse, el libro espera el partial nuevo
+    def reset(self):
+        with self.lock:
+            self._reset()
+
+    def _reset(self):
+        self._clear()
+        self._levels.clear()
+
+    def _insert(self, rows: typing.List[typing.Dict]):
+        for row in rows:
+            self._levels[row['id']] = (row['side'], row['price'])
+            book_side = self.bids if row['side'] == "Buy" else self.asks
+            book_side.set(row['price'], row['size'])
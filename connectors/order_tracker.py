@@ -0,0 +1,211 @@
+# Seguimiento de las órdenes pendientes (que no se llenaron al hacer place_order()) de un cliente.
+# Antes cada estrategia armaba un threading.Timer de 2 segundos por orden, que consultaba su estado por REST y se
+# volvía a armar para siempre hasta que la orden se llenara. Ahora hay un solo thread por cliente que junta las
+# órdenes pendientes por symbol y las consulta todas juntas con client.get_orders_status() (una sola consulta cuando
+# el exchange lo permite), con backoff exponencial y un máximo de reintentos. Pasado el máximo se pide la
+# cancelación, pero la orden sigue en seguimiento (cada max_interval, con un error en el log cada vez) hasta que el
+# exchange devuelva un estado final: si la estrategia la diera por terminada y la orden se llenara después, nadie
+# seguiría esa posición (ni TP / SL ni pnl).
+# Si el cliente recibe los estados por websocket (Bitmex), se los pasa con push() y la estrategia se entera enseguida;
+# la consulta queda como respaldo. Las cancelaciones (las de max_retries y las que pide cancel(), por ejemplo al parar
+# una estrategia) también se juntan por symbol, en un solo client.cancel_orders().
+import logging
+import threading
+import time
+import typing
+
+from models import *
+
+logger = logging.getLogger()
+
+# Estados finales de una orden (en minúscula, como los deja OrderStatus)
+FINAL_STATUSES = ["filled", "canceled", "expired", "rejected"]
+
+
+class PendingOrder:
+    def __init__(self, contract: Contract, order_id, callback: typing.Callable[[OrderStatus], None],
+                 next_check: float):
+        self.contract = contract
+        self.order_id = order_id
+        self.callback = callback
+        self.next_check = next_check
+        self.retries = 0
+        # True cuando pasó max_retries: en cada consulta también se intenta cancelarla
+        self.cancelling = False
+        self.alerted = False
+
+
+class OrderTracker:
+    def __init__(self, client, interval: float = 2.0, max_interval: float = 30.0, max_retries: int = 30):
+        self._client = client
+        self.interval = interval
+        self.max_interval = max_interval
+        self.max_retries = max_retries
+
+        self._pending: typing.Dict[typing.Any, PendingOrder] = dict()
+        self._lock = threading.Lock()
+        # despierta al thread cuando se agrega una orden
+        self._wake_up = threading.Event()
+        self._thread: typing.Optional[threading.Thread] = None
+        self._running = True
+
+    # Agrega una orden al seguimiento. callback(order_status) se llama desde el thread del tracker cuando la orden
+    # llega a un estado final (filled, canceled, expired, rejected).
+    def track(self, contract: Contract, order_id, callback: typing.Callable[[OrderStatus], None]):
+        with self._lock:
+            self._pending[order_id] = PendingOrder(contract, order_id, callback, time.time() + self.interval)
+
+            # el thread se crea recién con la primera orden pendiente
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+        self._wake_up.set()
+
+    # Estado que llegó por websocket (tablas order / execution de Bitmex). Si la orden está en seguimiento y llegó a
+    # un estado final, se avisa enseguida en vez de esperar a la próxima consulta.
+    def push(self, order_status: OrderStatus):
+        if order_status.status not in FINAL_STATUSES:
+            return
+
+        with self._lock:
+            pending = self._pending.get(order_status.order_id)
+
+        if pending is not None and self._remove(pending):
+            logger.info("%s order %s status: %s", self._client.platform, pending.order_id, order_status.status)
+            pending.callback(order_status)
+
+    # Pide la cancelación de órdenes en seguimiento, sin esperar a max_retries. La hace el thread del tracker, con el
+    # mismo reintento que las demás hasta que el exchange devuelva un estado final (que se le pasa al callback).
+    def cancel(self, contract: Contract, order_ids: typing.List):
+        with self._lock:
+            for order_id in order_ids:
+                pending = self._pending.get(order_id)
+                if pending is not None and pending.contract.symbol == contract.symbol:
+                    pending.cancelling = True
+                    pending.next_check = time.time()
+
+        self._wake_up.set()
+
+    def stop(self):
+        self._running = False
+        self._wake_up.set()
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _run(self):
+        while self._running:
+            with self._lock:
+                next_check = min([p.next_check for p in self._pending.values()], default=None)
+
+            if next_check is None:
+                self._wake_up.wait()
+            else:
+                self._wake_up.wait(max(next_check - time.time(), 0))
+            self._wake_up.clear()
+
+            if not self._running:
+                break
+
+            # agrupo por symbol las órdenes pendientes. Si a alguna orden de un symbol le toca, consulto todas las de
+            # ese symbol, ya que es la misma consulta
+            now = time.time()
+            by_symbol: typing.Dict[str, typing.List[PendingOrder]] = dict()
+            with self._lock:
+                for pending in self._pending.values():
+                    by_symbol.setdefault(pending.contract.symbol, []).append(pending)
+
+            due = {symbol: orders for symbol, orders in by_symbol.items()
+                   if any(p.next_check <= now for p in orders)}
+
+            for symbol, orders in due.items():
+                try:
+                    self._check_orders(orders)
+                except Exception as e:
+                    logger.error("Error while checking the %s pending orders on %s: %s", len(orders), symbol, e)
+                    for pending in orders:
+                        self._retry_later(pending)
+
+                # las que hay que cancelar y siguen sin estado final
+                with self._lock:
+                    cancelling = [p for p in orders if p.cancelling and p.order_id in self._pending]
+
+                if len(cancelling) > 0:
+                    self._cancel(cancelling)
+
+    def _check_orders(self, orders: typing.List[PendingOrder]):
+        statuses = self._client.get_orders_status(orders[0].contract, [p.order_id for p in orders])
+
+        for pending in orders:
+            order_status = statuses.get(pending.order_id) if statuses is not None else None
+
+            if order_status is not None and order_status.status in FINAL_STATUSES:
+                # si ya la sacó push(), la estrategia ya fue avisada
+                if self._remove(pending):
+                    logger.info("%s order %s status: %s", self._client.platform, pending.order_id,
+                                order_status.status)
+                    pending.callback(order_status)
+            else:
+                self._retry_later(pending)
+
+    def _retry_later(self, pending: PendingOrder):
+        pending.retries += 1
+
+        if pending.retries > self.max_retries:
+            if not pending.cancelling:
+                logger.error("%s order %s on %s still not filled after %s checks, cancelling it",
+                             self._client.platform, pending.order_id, pending.contract.symbol, self.max_retries)
+                pending.cancelling = True
+
+            pending.next_check = time.time() + self.max_interval
+            return
+
+        # backoff exponencial: 2, 4, 8... segundos hasta max_interval
+        pending.next_check = time.time() + min(self.interval * 2 ** pending.retries, self.max_interval)
+
+    # Cancela juntas órdenes del mismo symbol. Las que el exchange confirma (o que devuelven otro estado final) se le
+    # avisan a la estrategia. Las demás pueden seguir abiertas en el exchange: quedan en seguimiento y se vuelven a
+    # consultar y cancelar en max_interval.
+    def _cancel(self, orders: typing.List[PendingOrder]):
+        contract = orders[0].contract
+        statuses = None
+        try:
+            # cancel_orders() de Bitmex sólo recibe los ids
+            if self._client.platform == "bitmex":
+                statuses = self._client.cancel_orders([p.order_id for p in orders])
+            else:
+                statuses = self._client.cancel_orders(contract, [p.order_id for p in orders])
+        except Exception as e:
+            logger.error("Error while cancelling %s %s orders on %s: %s", len(orders), self._client.platform,
+                         contract.symbol, e)
+
+        if statuses is None:
+            statuses = [None] * len(orders)
+
+        for pending, order_status in zip(orders, statuses):
+            if order_status is not None and order_status.status in FINAL_STATUSES:
+                if self._remove(pending):
+                    logger.info("%s order %s status: %s", self._client.platform, pending.order_id,
+                                order_status.status)
+                    pending.callback(order_status)
+                continue
+
+            pending.next_check = time.time() + self.max_interval
+
+            # la cancelación pudo fallar porque la orden se llenó mientras tanto: lo dirá la próxima consulta
+            logger.error("%s order %s on %s could not be cancelled (%s checks): it may still be open on the exchange, "
+                         "retrying in %s seconds", self._client.platform, pending.order_id, contract.symbol,
+                         pending.retries, self.max_interval)
+
+            # también en los logs de la interface, una vez por orden
+            if not pending.alerted:
+                pending.alerted = True
+                self._client._add_log(f"Could not cancel the {contract.symbol} order {pending.order_id}, check it "
+                                      f"on the exchange (still retrying)")
+
+    # Devuelve False si la orden ya no estaba en seguimiento
+    def _remove(self, pending: PendingOrder) -> bool:
+        with self._lock:
+            return self._pending.pop(pending.order_id, None) is not None
@@ -0,0 +1,196 @@
+# Control de los límites de requests REST de cada exchange, uno por cliente.
+# Antes _make_request() mandaba todo enseguida y un 429 / 418 sólo quedaba en el log, así que con muchas estrategias
+# arrancando a la vez (históricos), el OrderTracker y la reconciliación de balances se llegaba al límite y el
+# exchange bloqueaba la IP. Ahora antes de cada request se pide lugar al RequestScheduler:
+#   - lleva el uso de cada ventana (weight por minuto, órdenes cada 10 segundos...) con lo que informa el exchange en
+#     los headers de cada respuesta (X-MBX-USED-WEIGHT-1M, X-MBX-ORDER-COUNT-10S, x-ratelimit-remaining...);
+#   - las órdenes (place / cancel) tienen prioridad: los requests de prioridad normal y baja (históricos, balances)
+#     dejan libre una parte de cada ventana y esperan si hay un request más prioritario esperando;
+#   - si el exchange responde 429 o 418, nada sale hasta que pase el Retry-After.
+# scheduler.stats() devuelve los contadores para monitoreo.
+import asyncio
+import threading
+import time
+import typing
+
+PRIORITY_ORDER = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+PRIORITY_NAMES = {PRIORITY_ORDER: "order", PRIORITY_NORMAL: "normal", PRIORITY_LOW: "low"}
+
+# Parte de cada ventana que no pueden usar los requests de esa prioridad (queda para los más prioritarios)
+PRIORITY_RESERVE = {PRIORITY_ORDER: 0., PRIORITY_NORMAL: 0.05, PRIORITY_LOW: 0.2}
+
+# Espera si el exchange responde 429 / 418 sin Retry-After
+DEFAULT_RETRY_AFTER = 60
+
+# Cada cuánto se vuelve a mirar si ya hay lugar
+MAX_POLL_INTERVAL = 0.25
+
+
+# Uso de una ventana fija de `period` segundos (las de Binance arrancan con el minuto, los 10 segundos... del reloj)
+class RateWindow:
+    def __init__(self, name: str, limit: int, period: float, used_header: typing.Optional[str] = None,
+                 remaining_header: typing.Optional[str] = None, reset_header: typing.Optional[str] = None,
+                 orders_only: bool = False):
+        self.name = name
+        self.limit = limit
+        self.period = period
+        # headers de la respuesta con el uso de la ventana según el exchange: lo usado (Binance) o lo que queda y
+        # cuándo se recarga, en epoch (Bitmex)
+        self.used_header = used_header
+        self.remaining_header = remaining_header
+        self.reset_header = reset_header
+        # las ventanas de órdenes sólo cuentan los requests que mandan o cancelan órdenes
+        self.orders_only = orders_only
+
+        self.used = 0
+        self.window_end = 0.
+
+    def refresh(self, now: float):
+        if now >= self.window_end:
+            self.used = 0
+            self.window_end = (now // self.period + 1) * self.period
+
+
+class RequestScheduler:
+    def __init__(self, windows: typing.List[RateWindow]):
+        self.windows = {w.name: w for w in windows}
+
+        self.banned_until = 0.
+
+        self._lock = threading.Lock()
+        # requests esperando lugar, por prioridad
+        self._waiting = {p: 0 for p in PRIORITY_NAMES}
+
+        self._requests = {p: 0 for p in PRIORITY_NAMES}
+        self._waits = 0
+        self._wait_seconds = 0.
+        self._throttled = 0
+
+    def acquire(self, priority: int, weight: int = 1, orders: int = 0) -> float:
+
+        """
+        Block until the request fits in every window.
+        :param priority: PRIORITY_ORDER, PRIORITY_NORMAL or PRIORITY_LOW
+        :param weight: estimated request weight (corrected with the response headers)
+        :param orders: 1 if the request counts against the order limits
+        :return: seconds waited (signed requests waiting for long must be signed again)
+        """
+
+        delay = self._try_acquire(priority, weight, orders)
+        if delay == 0:
+            return 0.
+
+        start = self._start_waiting(priority)
+        try:
+            while delay > 0:
+                time.sleep(min(delay, MAX_POLL_INTERVAL))
+                delay = self._try_acquire(priority, weight, orders)
+        finally:
+            self._stop_waiting(priority, start)
+
+        return time.time() - start
+
+    # Lo mismo que acquire() pero sin bloquear el event loop, para los clientes asyncio
+    async def acquire_async(self, priority: int, weight: int = 1, orders: int = 0) -> float:
+        delay = self._try_acquire(priority, weight, orders)
+        if delay == 0:
+            return 0.
+
+        start = self._start_waiting(priority)
+        try:
+            while delay > 0:
+                await asyncio.sleep(min(delay, MAX_POLL_INTERVAL))
+                delay = self._try_acquire(priority, weight, orders)
+        finally:
+            self._stop_waiting(priority, start)
+
+        return time.time() - start
+
+    # Devuelve 0 si el request puede salir (y lo cuenta), o los segundos que conviene esperar
+    def _try_acquire(self, priority: int, weight: int, orders: int) -> float:
+        now = time.time()
+
+        with self._lock:
+            delay = self._delay(now, priority, weight, orders)
+            if delay > 0:
+                return delay
+
+            for window in self.windows.values():
+                window.used += orders if window.orders_only else weight
+            self._requests[priority] += 1
+
+            return 0.
+
+    def _start_waiting(self, priority: int) -> float:
+        with self._lock:
+            self._waiting[priority] += 1
+            self._waits += 1
+
+        return time.time()
+
+    def _stop_waiting(self, priority: int, start: float):
+        with self._lock:
+            self._waiting[priority] -= 1
+            self._wait_seconds += time.time() - start
+
+    def _delay(self, now: float, priority: int, weight: int, orders: int) -> float:
+        if now < self.banned_until:
+            return self.banned_until - now
+
+        # primero los más prioritarios
+        if any(self._waiting[p] > 0 for p in PRIORITY_NAMES if p < priority):
+            return MAX_POLL_INTERVAL
+
+        delay = 0.
+
+        for window in self.windows.values():
+            window.refresh(now)
+
+            cost = orders if window.orders_only else weight
+            if cost == 0:
+                continue
+
+            available = window.limit * (1 - PRIORITY_RESERVE[priority]) - window.used
+            if cost > available:
+                delay = max(delay, window.window_end - now)
+
+        return delay
+
+    def update(self, status_code: int, headers: typing.Mapping[str, str]):
+
+        """
+        Sync the windows with the usage reported by the exchange in the response headers.
+        :param headers: case-insensitive headers of the response (requests / aiohttp)
+        """
+
+        now = time.time()
+
+        with self._lock:
+            for window in self.windows.values():
+                window.refresh(now)
+
+                if window.used_header is not None and window.used_header in headers:
+                    window.used = int(headers[window.used_header])
+
+                if window.remaining_header is not None and window.remaining_header in headers:
+                    window.used = window.limit - int(headers[window.remaining_header])
+                    if window.reset_header is not None and window.reset_header in headers:
+                        window.window_end = max(float(headers[window.reset_header]), now)
+
+            # 429: límite superado, 418: IP bloqueada
+            if status_code in (418, 429):
+                self._throttled += 1
+                self.banned_until = max(self.banned_until,
+                                        now + float(headers.get("Retry-After", DEFAULT_RETRY_AFTER)))
+
+    def stats(self) -> typing.Dict:
+        with self._lock:
+            return {"windows": {w.name: {"used": w.used, "limit": w.limit} for w in self.windows.values()},
+                    "requests": {PRIORITY_NAMES[p]: n for p, n in self._requests.items()},
+                    "waiting": {PRIORITY_NAMES[p]: n for p, n in self._waiting.items()},
+                    "waits": self._waits,
+                    "wait_seconds": self._wait_seconds,
+                    "throttled": self._throttled,
+                    "banned_for": max(self.banned_until - time.time(), 0.)}
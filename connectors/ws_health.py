@@ -0,0 +1,260 @@
+# Métricas de las conexiones de websocket y reconexión con espera exponencial.
+# Antes cada conexión se reconectaba a los 2 segundos sin importar cuántas veces hubiera fallado (y todas juntas si
+# se caía la red), no se medía nada de lo que llegaba y una conexión abierta pero sin mensajes (una suscripción que
+# se perdió, un proxy que dejó de pasar datos) no se detectaba nunca.
+# - ConnectionHealth lleva por conexión los mensajes y bytes por segundo, la edad del último mensaje, la latencia del
+#   ping y las reconexiones, y calcula la espera antes de reconectar: exponencial desde RECONNECT_MIN_DELAY hasta
+#   RECONNECT_MAX_DELAY, con jitter para que las conexiones no vuelvan todas en el mismo instante.
+# - StaleMonitor (threads) y keep_alive() (asyncio) cierran las conexiones de datos de mercado que pasan
+#   STALE_TIMEOUT segundos sin mensajes, así el loop de cada conexión se reconecta y vuelve a suscribir.
+# Al reconectarse, los clientes completan por REST las velas que las estrategias perdieron mientras tanto
+# (ver Strategy.backfill_candles()).
+import asyncio
+import logging
+import random
+import threading
+import time
+import typing
+
+logger = logging.getLogger()
+
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+# Una conexión que duró al menos esto se considera estable y la próxima espera vuelve a RECONNECT_MIN_DELAY
+STABLE_CONNECTION = 60
+
+# Segundos sin mensajes a partir de los que una conexión de datos de mercado se da por muerta
+STALE_TIMEOUT = 60
+STALE_CHECK_INTERVAL = 5
+
+# Ping del cliente (la respuesta mide la latencia) y espera máxima del pong
+PING_INTERVAL = 20
+PING_TIMEOUT = 10
+
+# Período sobre el que se calculan los mensajes y bytes por segundo
+RATE_INTERVAL = 5
+
+
+class ConnectionHealth:
+    def __init__(self, name: str):
+        self.name = name
+
+        self.connected = False
+        self.connections = 0
+        self.stale_reconnects = 0
+
+        self.messages = 0
+        self.bytes = 0
+        self.ping_ms: typing.Optional[float] = None
+
+        # todo en time.monotonic()
+        self.opened_at: typing.Optional[float] = None
+        self.last_message: typing.Optional[float] = None
+        self._ping_sent: typing.Optional[float] = None
+
+        self._rate_start = time.monotonic()
+        self._rate_messages = 0
+        self._rate_bytes = 0
+        self.msgs_per_sec = 0.
+        self.bytes_per_sec = 0.
+
+        # intentos de conexión fallidos seguidos
+        self._attempts = 0
+
+    @property
+    def reconnects(self) -> int:
+        return max(self.connections - 1, 0)
+
+    def on_open(self):
+        self.connected = True
+        self.connections += 1
+        self.opened_at = time.monotonic()
+        self._ping_sent = None
+
+    def on_close(self):
+        self.connected = False
+
+    def on_message(self, size: int):
+        now = time.monotonic()
+        self.last_message = now
+        self.messages += 1
+        self.bytes += size
+
+        self._rate_messages += 1
+        self._rate_bytes += size
+
+        elapsed = now - self._rate_start
+        if elapsed >= RATE_INTERVAL:
+            self.msgs_per_sec = self._rate_messages / elapsed
+            self.bytes_per_sec = self._rate_bytes / elapsed
+            self._rate_start = now
+            self._rate_messages = 0
+            self._rate_bytes = 0
+
+    def on_pong(self, latency: float):
+        self.ping_ms = latency * 1000
+        self._ping_sent = None
+
+    # Payload del ping de los clientes asyncio: el pong lo devuelve igual, así se sabe a qué ping responde
+    def ping_payload(self) -> bytes:
+        self._ping_sent = time.monotonic()
+        return repr(self._ping_sent).encode()
+
+    def on_pong_payload(self, payload: bytes):
+        try:
+            sent = float(payload)
+        except ValueError:
+            # el pong de un ping que no mandamos nosotros
+            return
+
+        self.on_pong(time.monotonic() - sent)
+
+    def reconnect_delay(self) -> float:
+
+        """
+        Seconds to wait before connecting again, called each time the connection closes or fails to open.
+        """
+
+        if self.opened_at is not None and time.monotonic() - self.opened_at >= STABLE_CONNECTION:
+            self._attempts = 0
+        self.opened_at = None
+
+        delay = min(RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY * 2 ** self._attempts)
+        if delay < RECONNECT_MAX_DELAY:
+            self._attempts += 1
+
+        # "equal jitter": entre la mitad de la espera y la espera completa
+        return random.uniform(delay / 2, delay)
+
+    def is_stale(self) -> bool:
+        if not self.connected or self.opened_at is None:
+            return False
+
+        last = max(self.last_message or 0., self.opened_at)
+        return time.monotonic() - last > STALE_TIMEOUT
+
+    # Un ping de los clientes asyncio sin respuesta después de PING_TIMEOUT
+    def ping_timed_out(self) -> bool:
+        return self._ping_sent is not None and time.monotonic() - self._ping_sent > PING_TIMEOUT
+
+    def stats(self) -> typing.Dict:
+        now = time.monotonic()
+
+        # si no llegan mensajes, el período en curso no se cierra nunca en on_message()
+        elapsed = now - self._rate_start
+        if elapsed >= RATE_INTERVAL:
+            msgs_per_sec, bytes_per_sec = self._rate_messages / elapsed, self._rate_bytes / elapsed
+        else:
+            msgs_per_sec, bytes_per_sec = self.msgs_per_sec, self.bytes_per_sec
+
+        return {"connected": self.connected,
+                "messages": self.messages,
+                "bytes": self.bytes,
+                "msgs_per_sec": msgs_per_sec,
+                "bytes_per_sec": bytes_per_sec,
+                "last_message_age": None if self.last_message is None else now - self.last_message,
+                "ping_ms": self.ping_ms,
+                "reconnects": self.reconnects,
+                "stale_reconnects": self.stale_reconnects}
+
+
+def _check_stale(health: ConnectionHealth) -> bool:
+    if not health.is_stale():
+        return False
+
+    logger.warning("%s websocket: no messages for more than %s seconds, reconnecting", health.name, STALE_TIMEOUT)
+    health.stale_reconnects += 1
+    # así no se vuelve a cerrar mientras se reconecta
+    health.on_close()
+
+    return True
+
+
+# Thread que cierra las conexiones (websocket.WebSocketApp) sin mensajes. run_forever() termina y el loop de la
+# conexión se reconecta.
+class StaleMonitor:
+    def __init__(self, connections: typing.Callable[[], typing.List[typing.Tuple[ConnectionHealth,
+                                                                                typing.Callable[[], None]]]]):
+
+        """
+        :param connections: returns the (health, close function) of the connections to watch, only the ones that
+        should be receiving market data
+        """
+
+        self._connections = connections
+        self._thread: typing.Optional[threading.Thread] = None
+        self._running = True
+
+    # el thread se crea recién con la primera conexión
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def _run(self):
+        while self._running:
+            time.sleep(STALE_CHECK_INTERVAL)
+
+            for health, close in self._connections():
+                if _check_stale(health):
+                    try:
+                        close()
+                    except Exception as e:
+                        logger.error("Error while closing the %s websocket: %s", health.name, e)
+
+
+# Task de cada conexión de los clientes asyncio: manda el ping que mide la latencia (aiohttp no avisa de sus pongs)
+# y cierra la conexión si no contesta o si deja de recibir datos de mercado
+async def keep_alive(ws, health: ConnectionHealth, expects_data: typing.Callable[[], bool] = lambda: True):
+    last_ping = time.monotonic()
+
+    while not ws.closed:
+        await asyncio.sleep(STALE_CHECK_INTERVAL)
+
+        if health.ping_timed_out():
+            logger.warning("%s websocket: no pong in %s seconds, reconnecting", health.name, PING_TIMEOUT)
+            health.on_close()
+            await ws.close()
+            return
+
+        if expects_data() and _check_stale(health):
+            await ws.close()
+            return
+
+        if time.monotonic() - last_ping >= PING_INTERVAL:
+            last_ping = time.monotonic()
+            try:
+                await ws.ping(health.ping_payload())
+            except Exception as e:
+                # la conexión se está cerrando, el loop de la conexión se encarga
+                logger.error("%s websocket: error while sending the ping: %s", health.name, e)
+                return
+
+
+# Agrupa las estrategias de los symbols por symbol y timeframe, así las velas perdidas se piden en un solo request
+# desde la última vela guardada más vieja del grupo
+def missed_candles(strategies: typing.Dict, symbols: typing.List[str]) -> typing.List[typing.Tuple]:
+
+    """
+    :param strategies: client.strategies
+    :return: (contract, timeframe, start time in ms, strategies) for each request
+    """
+
+    groups = dict()
+
+    for strat in list(strategies.values()):
+        if strat.contract.symbol not in symbols or strat.candles is None or len(strat.candles) == 0:
+            continue
+
+        last_ts = int(strat.candles.timestamp[-1])
+        key = (strat.contract.symbol, strat.tf)
+
+        if key not in groups:
+            groups[key] = [strat.contract, strat.tf, last_ts, []]
+        groups[key][2] = min(groups[key][2], last_ts)
+        groups[key][3].append(strat)
+
+    return [tuple(group) for group in groups.values()]
@@ -0,0 +1,280 @@
+# Pool de conexiones de websocket para los datos de mercado de Binance (bookTicker, aggTrade).
+# Binance permite como mucho 200 streams por conexión: con más, la suscripción falla ("invalid close opcode") y se
+# cae la conexión. El pool reparte los streams en tantas conexiones (shards) como hagan falta, abre una nueva cuando
+# se llenan las que hay y al desuscribir cierra las que quedan vacías o las junta si entran en menos conexiones.
+# Cada conexión se reconecta sola (con la espera de ws_health.py) y al reconectarse vuelve a suscribir sólo sus
+# propios streams, sin tocar al resto.
+import logging
+import threading
+import time
+import typing
+import json
+
+import websocket
+
+from connectors.ws_health import ConnectionHealth, StaleMonitor, PING_INTERVAL, PING_TIMEOUT
+
+logger = logging.getLogger()
+
+MAX_STREAMS_PER_CONNECTION = 200
+
+
+# Reparto de los streams en shards (sin conexiones). Lo usan BinanceStreamPool y AsyncBinanceStreamPool
+# (connectors/async_support.py).
+class StreamShards:
+    def __init__(self, max_streams: int = MAX_STREAMS_PER_CONNECTION):
+        self.max_streams = max_streams
+
+        self._shards: typing.Dict[int, typing.List[str]] = dict()
+        self._shard_of: typing.Dict[str, int] = dict()
+        self._next_id = 0
+
+    def streams(self, shard_id: int) -> typing.List[str]:
+        return list(self._shards.get(shard_id, ()))
+
+    def shard_ids(self) -> typing.List[int]:
+        return list(self._shards.keys())
+
+    def __contains__(self, stream: str) -> bool:
+        return stream in self._shard_of
+
+    def __len__(self) -> int:
+        return len(self._shard_of)
+
+    def add(self, streams: typing.List[str]) -> typing.Dict[int, typing.List[str]]:
+
+        """
+        Assign the new streams to the shards with free room, creating shards when all of them are full.
+        :param streams: streams like "btcusdt@aggTrade", the ones already assigned are ignored
+        :return: new streams by shard id (the ids not seen before are new shards)
+        """
+
+        added = dict()
+
+        for stream in streams:
+            if stream in self._shard_of:
+                continue
+
+            shard_id = self._free_shard()
+            self._shards[shard_id].append(stream)
+            self._shard_of[stream] = shard_id
+            added.setdefault(shard_id, []).append(stream)
+
+        return added
+
+    def remove(self, streams: typing.List[str]) -> typing.Dict[int, typing.List[str]]:
+
+        """
+        :return: removed streams by shard id. The shards left empty are deleted.
+        """
+
+        removed = dict()
+
+        for stream in streams:
+            shard_id = self._shard_of.pop(stream, None)
+            if shard_id is None:
+                continue
+
+            self._shards[shard_id].remove(stream)
+            removed.setdefault(shard_id, []).append(stream)
+
+            if len(self._shards[shard_id]) == 0:
+                del self._shards[shard_id]
+
+        return removed
+
+    def rebalance(self) -> typing.Optional[typing.Tuple[int, typing.Dict[int, typing.List[str]]]]:
+
+        """
+        If the streams fit in one shard less, move the streams of the smallest shard to the others.
+        :return: (id of the emptied shard, moved streams by destination shard id), or None if nothing moved
+        """
+
+        if len(self._shards) < 2:
+            return None
+
+        needed = -(-len(self._shard_of) // self.max_streams)
+        if needed >= len(self._shards):
+            return None
+
+        source = min(self._shards, key=lambda s: len(self._shards[s]))
+        moved = dict()
+
+        for stream in self._shards.pop(source):
+            shard_id = self._free_shard()
+            self._shards[shard_id].append(stream)
+            self._shard_of[stream] = shard_id
+            moved.setdefault(shard_id, []).append(stream)
+
+        return source, moved
+
+    # El shard con más lugar libre (así se llenan parejos), o uno nuevo si están todos llenos
+    def _free_shard(self) -> int:
+        shard_id = min(self._shards, key=lambda s: len(self._shards[s]), default=None)
+
+        if shard_id is None or len(self._shards[shard_id]) >= self.max_streams:
+            shard_id = self._next_id
+            self._next_id += 1
+            self._shards[shard_id] = []
+
+        return shard_id
+
+
+class _Connection:
+    def __init__(self, pool: "BinanceStreamPool", shard_id: int):
+        self.shard_id = shard_id
+        self.connected = False
+
+        self._pool = pool
+        self._active = True
+        self.health = ConnectionHealth("Binance connection " + str(shard_id))
+        self.ws = websocket.WebSocketApp(pool.url, on_open=self._on_open, on_close=self._on_close,
+                                         on_error=pool.on_error, on_message=self._on_message, on_pong=self._on_pong)
+
+        t = threading.Thread(target=self._run, daemon=True)
+        t.start()
+
+    def _run(self):
+        # Si se cae la conexión, espera (cada vez más si sigue fallando) y se reconecta
+        while self._active:
+            try:
+                self.ws.run_forever(ping_interval=PING_INTERVAL, ping_timeout=PING_TIMEOUT)
+            except Exception as e:
+                logger.error("Binance error in run_forever() method (connection %s): %s", self.shard_id, e)
+
+            if self._active:
+                time.sleep(self.health.reconnect_delay())
+
+    def _on_open(self, ws):
+        logger.info("Binance Websocket connection %s opened", self.shard_id)
+
+        self.health.on_open()
+
+        # vuelve a suscribir sólo los streams de este shard
+        with self._pool.lock:
+            self.connected = True
+            streams = self._pool.shards.streams(self.shard_id)
+            self.send("SUBSCRIBE", streams)
+
+        if self._pool.on_open is not None:
+            self._pool.on_open(ws)
+
+        # los mensajes de esta conexión esperan a que termine on_reconnect (las velas perdidas van antes que los
+        # trades nuevos)
+        if self.health.reconnects > 0 and self._pool.on_reconnect is not None:
+            self._pool.on_reconnect(streams)
+
+    def _on_close(self, ws, *args):
+        self.connected = False
+        self.health.on_close()
+
+        if self._pool.on_close is not None:
+            self._pool.on_close(ws)
+
+    def _on_message(self, ws, msg: str):
+        self.health.on_message(len(msg))
+        self._pool.on_message(ws, msg)
+
+    def _on_pong(self, ws, data):
+        self.health.on_pong(ws.last_pong_tm - ws.last_ping_tm)
+
+    def send(self, method: str, streams: typing.List[str]):
+        if not self.connected or len(streams) == 0:
+            return
+
+        data = dict()
+        data['method'] = method
+        data['params'] = streams
+        data['id'] = self._pool.next_id()
+
+        try:
+            self.ws.send(json.dumps(data))
+            logger.info("Binance: %s to: %s", method.lower(), ','.join(streams))
+        except Exception as e:
+            logger.error("Websocket error while sending %s to connection %s: %s", method, self.shard_id, e)
+
+    def close(self):
+        self._active = False
+        self.connected = False
+        self.ws.close()
+
+
+class BinanceStreamPool:
+    def __init__(self, url: str, on_message: typing.Callable, on_error: typing.Optional[typing.Callable] = None,
+                 on_open: typing.Optional[typing.Callable] = None, on_close: typing.Optional[typing.Callable] = None,
+                 on_reconnect: typing.Optional[typing.Callable[[typing.List[str]], None]] = None,
+                 max_streams: int = MAX_STREAMS_PER_CONNECTION):
+
+        # los callbacks reciben el websocket de la conexión, como los de websocket.WebSocketApp. on_reconnect recibe
+        # los streams de una conexión que se volvió a abrir.
+        self.url = url
+        self.on_message = on_message
+        self.on_error = on_error
+        self.on_open = on_open
+        self.on_close = on_close
+        self.on_reconnect = on_reconnect
+
+        self.shards = StreamShards(max_streams)
+        self._connections: typing.Dict[int, _Connection] = dict()
+        self._ws_id = 1
+
+        # se suscribe desde el thread de la interfaz y se reconecta desde el de cada conexión
+        self.lock = threading.Lock()
+        self._closed = False
+
+        self._stale_monitor = StaleMonitor(lambda: [(c.health, c.ws.close) for c in list(self._connections.values())])
+
+    @property
+    def connected(self) -> bool:
+        return any(c.connected for c in self._connections.values())
+
+    @property
+    def connection_count(self) -> int:
+        return len(self._connections)
+
+    def next_id(self) -> int:
+        ws_id = self._ws_id
+        self._ws_id += 1
+        return ws_id
+
+    # Las conexiones nuevas se suscriben a sus streams al abrirse, en _Connection._on_open()
+    def subscribe(self, streams: typing.List[str]):
+        with self.lock:
+            if self._closed:
+                return
+
+            for shard_id, shard_streams in self.shards.add(streams).items():
+                if shard_id in self._connections:
+                    self._connections[shard_id].send("SUBSCRIBE", shard_streams)
+                else:
+                    self._connections[shard_id] = _Connection(self, shard_id)
+                    self._stale_monitor.start()
+
+    def unsubscribe(self, streams: typing.List[str]):
+        with self.lock:
+            for shard_id, shard_streams in self.shards.remove(streams).items():
+                if shard_id not in self.shards.shard_ids():
+                    self._connections.pop(shard_id).close()
+                else:
+                    self._connections[shard_id].send("UNSUBSCRIBE", shard_streams)
+
+            moves = self.shards.rebalance()
+            if moves is not None:
+                # primero se suscriben los destinos, así no se pierde ningún mensaje
+                source, moved = moves
+                for shard_id, shard_streams in moved.items():
+                    self._connections[shard_id].send("SUBSCRIBE", shard_streams)
+                self._connections.pop(source).close()
+
+    # Métricas de cada conexión (ver ConnectionHealth.stats())
+    def stats(self) -> typing.Dict[int, typing.Dict]:
+        return {shard_id: c.health.stats() for shard_id, c in list(self._connections.items())}
+
+    def close(self):
+        self._stale_monitor.stop()
+
+        with self.lock:
+            self._closed = True
+            for connection in self._connections.values():
+                connection.close()
+            self._connections.clear()
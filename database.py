@@ -40,6 +40,18 @@ class WorkspaceData:
         self.cursor.executemany(sql_statement, data)
         self.conn.commit()
 
+    # igual que save(), pero agrega las filas sin borrar lo que ya tenía la tabla (por ejemplo las estrategias que
+    # salen del optimizador de parámetros)
+    def append(self, table: str, data: typing.List[typing.Tuple]):
+        table_data = self.cursor.execute(f"SELECT * FROM {table}")
+
+        columns = [description[0] for description in table_data.description]
+
+        sql_statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES({', '.join(['?'] * len(columns))})"
+
+        self.cursor.executemany(sql_statement, data)
+        self.conn.commit()
+
     # get data de la tabla
     def get(self, table: str) -> typing.List[sqlite3.Row]:
         self.cursor.execute(f"SELECT * FROM {table}")
@@ -0,0 +1,78 @@
+# Descarga de históricos más largos que lo que trae un request de get_historical_candles() (1000 velas en Binance,
+# 500 en Bitmex), por ejemplo para indicadores con un ema_slow largo o para backtests de varios meses.
+# Divide el rango en páginas (startTime / endTime), las baja en paralelo con un pool de threads y las une en un array
+# columnar (CANDLE_DTYPE) ordenado y sin velas repetidas, en vez de miles de objetos Candle.
+# Cada página pasa por el RequestScheduler del cliente (client.scheduler, ver connectors/request_scheduler.py) con
+# PRIORITY_LOW, como todos los requests de velas: comparte los límites del exchange con el resto del bot y deja
+# siempre lugar para las órdenes.
+#
+# Ejemplo:
+#   candles = download_history(binance, contract, "1h", start_time=1672531200000)   # desde el 1/1/2023
+#   result = run_backtest("Technical", candles, 2, 1, {"ema_fast": 12, "ema_slow": 26, ...})
+# Con AsyncBinanceClient / AsyncBitmexClient se le pasa client.blocking.
+import concurrent.futures
+import logging
+import typing
+
+import numpy as np
+
+from models import *
+from strategies import TF_EQUIV
+
+logger = logging.getLogger()
+
+# Velas que trae cada request
+HISTORY_PAGE_SIZE = {"binance_futures": 1000, "binance_spot": 1000, "bitmex": 500}
+
+PAGE_RETRIES = 3
+
+
+def download_history(client, contract: Contract, timeframe: str, start_time: int,
+                     end_time: typing.Optional[int] = None, max_workers: int = 4) -> np.ndarray:
+
+    """
+    Download every candle between start_time and end_time, splitting the range in pages fetched concurrently.
+    :param client: BinanceClient or BitmexClient
+    :param start_time: open time (ms) of the first candle
+    :param end_time: open time (ms) of the last candle, None for up to now
+    :param max_workers: pages downloaded at the same time
+    :return: structured array with CANDLE_DTYPE, sorted by timestamp. Pages that failed PAGE_RETRIES times are
+    missing (logged as errors).
+    """
+
+    platform = client.platform
+    tf_ms = TF_EQUIV[timeframe] * 1000
+    page_ms = HISTORY_PAGE_SIZE[platform] * tf_ms
+
+    if end_time is None:
+        end_time = client.now_ms()
+
+    start_time = start_time // tf_ms * tf_ms
+    pages = [(page_start, min(page_start + page_ms - tf_ms, end_time))
+             for page_start in range(start_time, end_time + 1, page_ms)]
+
+    if len(pages) == 0:
+        return np.empty(0, dtype=CANDLE_DTYPE)
+
+    def fetch(page: typing.Tuple[int, int]) -> np.ndarray:
+        for _ in range(PAGE_RETRIES):
+            candles = client.get_candles_page(contract, timeframe, page[0], page[1])
+            if candles is not None:
+                return candles
+
+        logger.error("%s %s %s: could not download the candles from %s to %s", platform, contract.symbol,
+                     timeframe, page[0], page[1])
+        return np.empty(0, dtype=CANDLE_DTYPE)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(pages))) as executor:
+        candles = np.concatenate(list(executor.map(fetch, pages)))
+
+    candles = candles[(candles['timestamp'] >= start_time) & (candles['timestamp'] <= end_time)]
+
+    # np.unique ordena y se queda con una vela por timestamp (las páginas pueden solaparse en los bordes)
+    _, unique_index = np.unique(candles['timestamp'], return_index=True)
+
+    logger.info("%s %s %s: %s candles downloaded in %s pages", platform, contract.symbol, timeframe,
+                len(unique_index), len(pages))
+
+    return candles[unique_index]
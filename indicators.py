@@ -0,0 +1,110 @@
+# En este módulo calculo los indicadores técnicos de forma incremental (streaming).
+# En vez de copiar todos los cierres a un pd.Series y recalcular ewm() sobre toda la historia en cada vela nueva,
+# cada indicador guarda su estado (promedio ponderado y peso acumulado) y lo actualiza en O(1) por vela cerrada.
+# Las fórmulas replican exactamente el algoritmo de pandas (pandas/_libs/window/aggregations.pyx -> ewm) con
+# adjust=True, de manera que los resultados son idénticos hasta el último dígito.
+import math
+import typing
+
+import numpy as np
+
+
+class EmaState:
+    """
+    Exponential moving average equivalent to pd.Series.ewm(com=com, min_periods=min_periods).mean(),
+    updated one value at a time.
+    """
+
+    def __init__(self, com: float, min_periods: int = 0):
+        alpha = 1. / (1. + com)
+        self._old_wt_factor = 1. - alpha
+        # adjust=True en pandas usa un peso nuevo de 1
+        self._new_wt = 1.
+        self._old_wt = 1.
+        self._weighted = math.nan
+        self._nobs = 0
+        # pandas nunca usa un min_periods menor a 1
+        self._min_periods = max(int(min_periods), 1)
+
+    @classmethod
+    def from_span(cls, span: int, min_periods: int = 0) -> "EmaState":
+        # misma conversión que pandas get_center_of_mass()
+        return cls((span - 1) / 2, min_periods)
+
+    @property
+    def value(self) -> float:
+        return self._weighted if self._nobs >= self._min_periods else math.nan
+
+    def update(self, cur: float) -> float:
+        if self._nobs == 0:
+            self._weighted = cur
+            self._old_wt = 1.
+        else:
+            self._old_wt *= self._old_wt_factor
+            # pandas evita errores numéricos en series constantes
+            if self._weighted != cur:
+                self._weighted = self._old_wt * self._weighted + self._new_wt * cur
+                self._weighted /= (self._old_wt + self._new_wt)
+            self._old_wt += self._new_wt
+
+        self._nobs += 1
+
+        return self.value
+
+
+class MacdState:
+    """
+    Incremental MACD line and signal line, same values as the ewm(span=...) computation over the closes.
+    """
+
+    def __init__(self, ema_fast: int, ema_slow: int, ema_signal: int):
+        self._fast = EmaState.from_span(ema_fast)
+        self._slow = EmaState.from_span(ema_slow)
+        self._signal = EmaState.from_span(ema_signal)
+
+        self.macd_line = math.nan
+        self.macd_signal = math.nan
+
+    def update(self, close: float) -> typing.Tuple[float, float]:
+        self.macd_line = self._fast.update(close) - self._slow.update(close)
+        self.macd_signal = self._signal.update(self.macd_line)
+
+        return self.macd_line, self.macd_signal
+
+
+class RsiState:
+    """
+    Incremental RSI using Wilder averages (ewm with com = length - 1), rounded to 2 decimals like the pandas version.
+    """
+
+    def __init__(self, rsi_length: int):
+        self._avg_gain = EmaState(rsi_length - 1, min_periods=rsi_length)
+        self._avg_loss = EmaState(rsi_length - 1, min_periods=rsi_length)
+
+        self._last_close = None
+        self.rsi = math.nan
+
+    def update(self, close: float) -> float:
+        # la primera vela no tiene variación (equivale al dropna() del diff())
+        if self._last_close is None:
+            self._last_close = close
+            return self.rsi
+
+        delta = close - self._last_close
+        self._last_close = close
+
+        # separo las variaciones positivas de las negativas
+        up = delta if delta > 0 else 0.
+        down = -delta if delta < 0 else 0.
+
+        avg_gain = self._avg_gain.update(up)
+        avg_loss = self._avg_loss.update(down)
+
+        # uso floats de numpy para tener la misma semántica que pandas al dividir por 0 (inf o nan, sin excepción)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rs = np.float64(avg_gain) / np.float64(avg_loss)
+            rsi = 100 - 100 / (1 + rs)
+
+        self.rsi = float(np.round(rsi, 2))
+
+        return self.rsi
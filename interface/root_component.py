@@ -74,6 +74,8 @@ class Root(tk.Tk):
             self.bitmex.reconnect = False
             self.binance.ws.close()
             self.bitmex.ws.close()
+            self.binance.order_tracker.stop()
+            self.bitmex.order_tracker.stop()
 
             self.destroy()
 
@@ -158,6 +160,10 @@ class Root(tk.Tk):
                     if symbol not in self.bitmex.contracts:
                         continue
 
+                    # sólo la tabla instrument de los symbols de la watchlist (y de las estrategias)
+                    if symbol not in self.bitmex.ws_subscriptions["instrument"]:
+                        self.bitmex.subscribe_symbols([self.bitmex.contracts[symbol]], "instrument")
+
                     if symbol not in self.bitmex.prices:
                         continue
 
@@ -10,6 +10,7 @@ from connectors.bitmex import BitmexClient
 from strategies import TechnicalStrategy, BreakoutStrategy
 from utils import *
 from database import WorkspaceData
+from candle_store import CandleStore
 
 if typing.TYPE_CHECKING:
     from interface.root_component import Root
@@ -31,6 +32,8 @@ class StrategyEditor(tk.Frame):
         self.root = root
 
         self.db = WorkspaceData()
+        # caché en disco de las velas históricas (candles.db)
+        self._candle_store = CandleStore()
 
         self._valid_integer = self.register(check_integer_format)
         self._valid_float = self.register(check_float_format)
@@ -351,21 +354,27 @@ class StrategyEditor(tk.Frame):
             else:
                 return
 
-            # las candles de la nueva estrategia, van al [exchange] (BinanceClient o BitmexClient)
-            new_strategy.candles = self._exchanges[exchange].get_historical_candles(contract, timeframe)
+            # las candles de la nueva estrategia, van al [exchange] (BinanceClient o BitmexClient). Salen del caché en
+            # disco y sólo se bajan las que faltan desde la última vez
+            candles = self._candle_store.load(self._exchanges[exchange], contract, timeframe)
 
             # si el len de la lista es 0, no ha traído datos del exchange, por ende hay un error de request y lo informo
-            if len(new_strategy.candles) == 0:
+            if len(candles) == 0:
                 self.root.logging_frame.add_log(f"No historical data retrieved for {contract.symbol}")
                 return
 
+            # cargo las velas en el buffer de la estrategia (y hago el warm-up de sus indicadores)
+            new_strategy.load_candles(candles)
+
             if exchange == "Binance":
                 self._exchanges[exchange].subscribe_channel([contract], "aggTrade")
                 self._exchanges[exchange].subscribe_channel([contract], "bookTicker")
+            elif exchange == "Bitmex":
+                self._exchanges[exchange].subscribe_symbols([contract], "trade")
+                self._exchanges[exchange].subscribe_symbols([contract], "instrument")
 
-
-            # si el len es succesful , avanzamos
-            self._exchanges[exchange].strategies[b_index] = new_strategy
+            # si el len es succesful , avanzamos. add_strategy() también actualiza el índice por symbol del conector
+            self._exchanges[exchange].add_strategy(b_index, new_strategy)
 
             # Activar estrategia
             for param in self._base_params:
@@ -380,7 +389,16 @@ class StrategyEditor(tk.Frame):
         else:
 
             # Si paramos la estrategia dejamos de alimentar con datos el diccionario de la estrategia
-            del self._exchanges[exchange].strategies[b_index]
+            self._exchanges[exchange].remove_strategy(b_index)
+
+            # si no queda otra estrategia de este symbol, dejo de recibir sus trades (el bookTicker queda para la
+            # watchlist y el instrument de Bitmex también)
+            if all(s.contract.symbol != symbol for s in self._exchanges[exchange].strategies.values()):
+                if exchange == "Binance":
+                    self._exchanges[exchange].unsubscribe_channel([contract], "aggTrade")
+                elif exchange == "Bitmex":
+                    self._exchanges[exchange].unsubscribe_symbols([contract], "trade")
+
             # Desactivar estrategia
             for param in self._base_params:
                 code_name = param['code_name']
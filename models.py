@@ -5,14 +5,50 @@
 
 # https://binance-docs.github.io/apidocs/testnet/en/#account-information-v2-user_data
 import datetime
+import threading
+import typing
 
 import dateutil.parser
+import numpy as np
 
 # Defino una variable global para bitmex, ya que este exchange da los balances en satoshis.
 # Entonces defino el valor para la equivalencia con BTC 1 satoshi = 0.00000001 BTC
 BITMEX_MULTIPLIER = 0.00000001
 BITMEX_TF_MINUTES = {"1m": 1, "5m": 5, "1h": 60, "1d": 1400}
 
+# Formato columnar de velas (array estructurado de NumPy) que usan el backtesting y el almacenamiento de históricos
+CANDLE_DTYPE = np.dtype([('timestamp', np.int64), ('open', np.float64), ('high', np.float64),
+                         ('low', np.float64), ('close', np.float64), ('volume', np.float64)])
+
+
+# Parser de los timestamps de Bitmex ("2023-11-14T22:13:20.123Z", siempre UTC y con milisegundos) a epoch en ms,
+# usado por el websocket (tabla trade) y por las velas de REST. dateutil.parser.isoparse() tarda unos 10 us por
+# timestamp. Acá se cachea el prefijo de fecha, hora y minuto (los trades de un mensaje, y en general los seguidos,
+# son del mismo minuto) y el resto se suma con aritmética entera.
+# Lo que no tenga exactamente ese formato pasa por dateutil (sin zona horaria se toma como UTC).
+_BITMEX_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_bitmex_minute_cache = ("", 0)
+
+
+def bitmex_timestamp_ms(timestamp: str) -> int:
+    global _bitmex_minute_cache
+
+    if len(timestamp) != 24 or timestamp[10] != "T" or timestamp[19] != "." or timestamp[23] != "Z":
+        parsed = dateutil.parser.isoparse(timestamp)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+        return (parsed - _BITMEX_EPOCH) // datetime.timedelta(milliseconds=1)
+
+    # la tupla se reemplaza entera, así que es seguro usarla desde varios threads
+    prefix, minute_ms = _bitmex_minute_cache
+    if timestamp[:16] != prefix:
+        minute = datetime.datetime(int(timestamp[:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                                   int(timestamp[11:13]), int(timestamp[14:16]), tzinfo=datetime.timezone.utc)
+        minute_ms = (minute - _BITMEX_EPOCH) // datetime.timedelta(milliseconds=1)
+        _bitmex_minute_cache = (timestamp[:16], minute_ms)
+
+    return minute_ms + int(timestamp[17:19]) * 1000 + int(timestamp[20:23])
+
 
 class Balance:
     def __init__(self, info, exchange):
@@ -48,12 +84,9 @@ class Candle:
             self.volume = float(candle_info[5])
 
         elif exchange == "bitmex":
-            # convierto el string ISO 8601 que trae Bitmex a un datetime object
-            self.timestamp = dateutil.parser.isoparse(candle_info['timestamp'])
-            self.timestamp = self.timestamp - datetime.timedelta(minutes=BITMEX_TF_MINUTES[timeframe])
-            # ahora convierto el datetime object a timestamp (ahora queda igual al de binance cuando lo convierto
-            # a un entero y lo multiplico por 1000)
-            self.timestamp = int(self.timestamp.timestamp() * 1000)
+            # convierto el string ISO 8601 que trae Bitmex a timestamp en ms (igual al de binance). Bitmex da la hora
+            # de cierre de la vela, así que le resto el timeframe para tener la de apertura
+            self.timestamp = bitmex_timestamp_ms(candle_info['timestamp']) - BITMEX_TF_MINUTES[timeframe] * 60000
             self.open = candle_info['open']
             self.high = candle_info['high']
             self.low = candle_info['low']
@@ -70,6 +103,174 @@ class Candle:
             self.volume = candle_info['volume']
 
 
+# Almacén de velas de capacidad fija y por columnas (un array de NumPy por campo) para reemplazar las listas de Candle
+# de cada estrategia. Antes la lista crecía para siempre (incluyendo las velas de relleno) y cada indicador la
+# recorría entera. Acá sólo se guardan las últimas `capacity` velas.
+# Los arrays tienen el doble de la capacidad y la "cabeza" (head) avanza con cada vela nueva. Cuando llega al final,
+# se copian las últimas velas al principio (costo amortizado O(1)). Así las velas guardadas siempre están contiguas
+# en memoria y las columnas se pueden exponer como vistas (sin copiar) a los indicadores.
+class CandleBuffer:
+    def __init__(self, capacity: int):
+        if capacity < 2:
+            raise ValueError("CandleBuffer capacity must be at least 2")
+
+        self.capacity = capacity
+
+        self._timestamp = np.zeros(2 * capacity, dtype=np.int64)
+        self._open = np.zeros(2 * capacity, dtype=np.float64)
+        self._high = np.zeros(2 * capacity, dtype=np.float64)
+        self._low = np.zeros(2 * capacity, dtype=np.float64)
+        self._close = np.zeros(2 * capacity, dtype=np.float64)
+        self._volume = np.zeros(2 * capacity, dtype=np.float64)
+
+        # índice siguiente a la última vela y cantidad de velas guardadas
+        self._head = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    # Devuelve una copia de la vela como objeto Candle (por ejemplo candles[-1]). Para cálculos usar las columnas.
+    def __getitem__(self, index: int) -> Candle:
+        if index < 0:
+            index += self._size
+        if index < 0 or index >= self._size:
+            raise IndexError("CandleBuffer index out of range")
+
+        i = self._head - self._size + index
+        candle_info = {'ts': int(self._timestamp[i]), 'open': float(self._open[i]), 'high': float(self._high[i]),
+                       'low': float(self._low[i]), 'close': float(self._close[i]), 'volume': float(self._volume[i])}
+
+        return Candle(candle_info, None, "parse_trade")
+
+    # Vistas de NumPy (sin copia) de cada columna, de la vela más vieja a la más nueva.
+    # Son válidas hasta el próximo append(), ya que éste puede mover los datos al inicio de los arrays.
+    @property
+    def timestamp(self) -> np.ndarray:
+        return self._timestamp[self._head - self._size:self._head]
+
+    @property
+    def open(self) -> np.ndarray:
+        return self._open[self._head - self._size:self._head]
+
+    @property
+    def high(self) -> np.ndarray:
+        return self._high[self._head - self._size:self._head]
+
+    @property
+    def low(self) -> np.ndarray:
+        return self._low[self._head - self._size:self._head]
+
+    @property
+    def close(self) -> np.ndarray:
+        return self._close[self._head - self._size:self._head]
+
+    @property
+    def volume(self) -> np.ndarray:
+        return self._volume[self._head - self._size:self._head]
+
+    def append(self, timestamp: int, open_price: float, high: float, low: float, close: float, volume: float):
+
+        # si llegué al final de los arrays, muevo las últimas capacity - 1 velas al inicio
+        if self._head == 2 * self.capacity:
+            keep = self.capacity - 1
+            for column in (self._timestamp, self._open, self._high, self._low, self._close, self._volume):
+                column[:keep] = column[self._head - keep:self._head]
+            self._head = keep
+            self._size = keep
+
+        i = self._head
+        self._timestamp[i] = timestamp
+        self._open[i] = open_price
+        self._high[i] = high
+        self._low[i] = low
+        self._close[i] = close
+        self._volume[i] = volume
+
+        self._head += 1
+        if self._size < self.capacity:
+            self._size += 1
+
+    def extend(self, candles: typing.List[Candle]):
+        # sólo tiene sentido copiar las velas que van a quedar guardadas
+        for candle in candles[-self.capacity:]:
+            self.append(candle.timestamp, candle.open, candle.high, candle.low, candle.close, candle.volume)
+
+    # Copia de las velas guardadas en formato columnar (CANDLE_DTYPE)
+    def to_array(self) -> np.ndarray:
+        array = np.empty(self._size, dtype=CANDLE_DTYPE)
+        for field in CANDLE_DTYPE.names:
+            array[field] = getattr(self, field)
+
+        return array
+
+    # Reemplaza la última vela, por ejemplo por la versión completa que trae el exchange (ver
+    # Strategy.backfill_candles())
+    def replace_last(self, open_price: float, high: float, low: float, close: float, volume: float):
+        i = self._head - 1
+
+        self._open[i] = open_price
+        self._high[i] = high
+        self._low[i] = low
+        self._close[i] = close
+        self._volume[i] = volume
+
+    # Actualiza en el lugar la vela que se está formando (la última) con un nuevo trade
+    def update_last(self, price: float, size: float):
+        i = self._head - 1
+
+        self._close[i] = price
+        self._volume[i] += size
+        if price > self._high[i]:
+            self._high[i] = price
+        elif price < self._low[i]:
+            self._low[i] = price
+
+
+# Convierte una lista de Candle (por ejemplo la que devuelve get_historical_candles()) al formato columnar
+def candles_to_array(candles: typing.List[Candle]) -> np.ndarray:
+    array = np.empty(len(candles), dtype=CANDLE_DTYPE)
+    for i, c in enumerate(candles):
+        array[i] = (c.timestamp, c.open, c.high, c.low, c.close, c.volume)
+
+    return array
+
+
+# Klines de Binance (listas [open time, open, high, low, close, volume, ...] con los precios como string) directo al
+# formato columnar, sin crear un objeto Candle por vela
+def binance_klines_to_array(raw_candles: typing.List[typing.List]) -> np.ndarray:
+    array = np.empty(len(raw_candles), dtype=CANDLE_DTYPE)
+    if len(raw_candles) == 0:
+        return array
+
+    columns = list(zip(*raw_candles))
+    for i, field in enumerate(CANDLE_DTYPE.names):
+        array[field] = np.array(columns[i], dtype=CANDLE_DTYPE[field])
+
+    return array
+
+
+# Velas de /trade/bucketed de Bitmex al formato columnar. Igual que Candle, el timestamp pasa de cierre a apertura y
+# se saltean las velas sin datos.
+def bitmex_buckets_to_array(raw_candles: typing.List[typing.Dict], timeframe: str) -> np.ndarray:
+    raw_candles = [c for c in raw_candles if c['open'] is not None and c['close'] is not None]
+    tf_ms = BITMEX_TF_MINUTES[timeframe] * 60000
+
+    array = np.empty(len(raw_candles), dtype=CANDLE_DTYPE)
+    for i, c in enumerate(raw_candles):
+        ts = bitmex_timestamp_ms(c['timestamp']) - tf_ms
+        array[i] = (ts, c['open'], c['high'], c['low'], c['close'], c['volume'])
+
+    return array
+
+
+# Lo inverso: de formato columnar a lista de Candle (por ejemplo para Strategy.load_candles())
+def array_to_candles(array: np.ndarray) -> typing.List[Candle]:
+    return [Candle({'ts': int(row['timestamp']), 'open': float(row['open']), 'high': float(row['high']),
+                    'low': float(row['low']), 'close': float(row['close']), 'volume': float(row['volume'])},
+                   None, "parse_trade") for row in array]
+
+
 def tick_to_decimals(tick_size: float) -> int:
     # Se usa para convertir el tick_size a string y a un máximo de 8 caracteres, sino mostrara la notación cientifica
     # ilegible tipo 1.43e-05 (como pasa en excel).
@@ -187,3 +388,66 @@ class Trade:
         self.pnl: float = trade_info['pnl']
         self.quantity = trade_info['quantity']
         self.entry_id = trade_info['entry_id']
+
+
+# Registro de las posiciones abiertas de un conector, agrupadas por symbol. Con cada bookTicker (Binance) o
+# instrument (Bitmex) sólo recalculo el pnl de los trades abiertos de ese symbol, en vez de recorrer todas las
+# estrategias y todo el historial de trades (incluidos los cerrados).
+# Igual que el índice de estrategias de los conectores, las listas por symbol son tuplas que se reemplazan
+# (copy-on-write), así el thread del websocket puede iterarlas mientras otro thread agrega o quita trades.
+class OpenPositions:
+    def __init__(self):
+        self._by_symbol: typing.Dict[str, typing.Tuple[Trade, ...]] = dict()
+        self._lock = threading.Lock()
+
+    def add(self, trade: Trade):
+        with self._lock:
+            symbol = trade.contract.symbol
+            self._by_symbol[symbol] = self._by_symbol.get(symbol, ()) + (trade,)
+
+    def remove(self, trade: Trade):
+        with self._lock:
+            symbol = trade.contract.symbol
+            remaining = tuple(t for t in self._by_symbol.get(symbol, ()) if t is not trade)
+            if len(remaining) > 0:
+                self._by_symbol[symbol] = remaining
+            else:
+                self._by_symbol.pop(symbol, None)
+
+    def get(self, symbol: str) -> typing.Tuple[Trade, ...]:
+        return self._by_symbol.get(symbol, ())
+
+    # Para calcular el update del pnl que se muestra en la interface, voy calculando en base a la posición que tengo
+    # (long o short) y comparo contra cerrar la posición contra el bid o ask (dependiendo la posición que tenga)
+    def mark_to_market(self, symbol: str, bid: float, ask: float):
+        for trade in self._by_symbol.get(symbol, ()):
+            # la orden de entrada todavía no se completó
+            if trade.entry_price is None:
+                continue
+
+            price = bid if trade.side == "long" else ask
+            if price is None:
+                continue
+
+            if trade.contract.exchange == "bitmex":
+                multiplier = trade.contract.multiplier
+
+                # https://www.bitmex.com/app/inversePerpetualsGuide
+                if trade.contract.inverse:
+                    if trade.side == "long":
+                        trade.pnl = (1 / trade.entry_price - 1 / price) * multiplier * trade.quantity
+                    elif trade.side == "short":
+                        trade.pnl = (1 / price - 1 / trade.entry_price) * multiplier * trade.quantity
+
+                # contratos lineales y quanto https://www.bitmex.com/app/quantoPerpetualsGuide
+                else:
+                    if trade.side == "long":
+                        trade.pnl = (price - trade.entry_price) * multiplier * trade.quantity
+                    elif trade.side == "short":
+                        trade.pnl = (trade.entry_price - price) * multiplier * trade.quantity
+
+            else:
+                if trade.side == "long":
+                    trade.pnl = (price - trade.entry_price) * trade.quantity
+                elif trade.side == "short":
+                    trade.pnl = (trade.entry_price - price) * trade.quantity
@@ -0,0 +1,168 @@
+# Optimizador de parámetros de las estrategias (los extra_params del StrategyEditor: ema_fast, ema_slow, ema_signal,
+# rsi_length, min_volume, más take_profit y stop_loss). Prueba combinaciones (grid o random search) con el backtest
+# vectorizado de backtest.py, repartiéndolas en un pool de procesos.
+# Las velas se copian una sola vez a memoria compartida (multiprocessing.shared_memory) y cada worker las lee desde
+# ahí cuando arranca, en vez de mandarlas serializadas (pickle) con cada combinación.
+import concurrent.futures
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import typing
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from backtest import run_backtest
+from models import CANDLE_DTYPE
+
+logger = logging.getLogger()
+
+# Parámetros que cada estrategia lee de other_params (los extra_params del StrategyEditor), en el orden del popup
+STRATEGY_PARAMS = {"Technical": ("rsi_length", "ema_fast", "ema_slow", "ema_signal"), "Breakout": ("min_volume",)}
+
+# Velas del worker, cargadas una vez por proceso en _init_worker()
+_worker_shm: typing.Optional[SharedMemory] = None
+_worker_candles: typing.Optional[np.ndarray] = None
+
+
+# Abre la memoria compartida sin registrarla en el resource_tracker. Antes de Python 3.13 SharedMemory(name=...) la
+# registra siempre, y el tracker la borra (o avisa de un "leaked shared_memory") cuando termina el worker. Sacarla del
+# registro con unregister() tampoco sirve: los workers comparten el tracker del proceso principal, así que también
+# borraría el registro del dueño.
+def _attach_shared_memory(shm_name: str) -> SharedMemory:
+    if sys.version_info >= (3, 13):
+        return SharedMemory(name=shm_name, track=False)
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return SharedMemory(name=shm_name)
+    finally:
+        resource_tracker.register = register
+
+
+def _init_worker(shm_name: str, candles_count: int):
+    global _worker_shm, _worker_candles
+
+    # El proceso principal es el dueño de la memoria compartida y la libera (unlink) al terminar el sweep
+    _worker_shm = _attach_shared_memory(shm_name)
+    _worker_candles = np.ndarray((candles_count,), dtype=CANDLE_DTYPE, buffer=_worker_shm.buf)
+
+
+def _run_combination(combination: typing.Tuple[str, typing.Dict]) -> typing.Dict:
+    strategy_type, params = combination
+
+    other_params = {k: v for k, v in params.items() if k not in ("take_profit", "stop_loss")}
+    result = run_backtest(strategy_type, _worker_candles, params.get('take_profit'), params.get('stop_loss'),
+                          other_params)
+
+    # Devuelvo sólo el resumen (no la lista de trades) para que viaje poco entre procesos
+    return {"strategy_type": strategy_type, "params": params, "pnl": result.pnl,
+            "max_drawdown": result.max_drawdown, "win_rate": result.win_rate, "trades": len(result.trades)}
+
+
+def _run_sweep(strategy_type: str, candles: np.ndarray, combinations: typing.List[typing.Dict],
+               max_workers: typing.Optional[int]) -> typing.List[typing.Dict]:
+
+    if len(combinations) == 0 or len(candles) == 0:
+        return []
+
+    # sin todos los parámetros, el backtest fallaría en cada worker y la fila guardada no se podría cargar
+    missing = [name for name in STRATEGY_PARAMS[strategy_type] if name not in combinations[0]]
+    if len(missing) > 0:
+        raise ValueError(f"Missing {strategy_type} parameters in the grid: {', '.join(missing)}")
+
+    candles = np.ascontiguousarray(candles, dtype=CANDLE_DTYPE)
+
+    shm = SharedMemory(create=True, size=candles.nbytes)
+
+    try:
+        shared_candles = np.ndarray(candles.shape, dtype=CANDLE_DTYPE, buffer=shm.buf)
+        shared_candles[:] = candles
+
+        workers = max_workers or os.cpu_count() or 1
+        # reparto las combinaciones en bloques para no pagar la comunicación entre procesos por cada una
+        chunksize = max(1, len(combinations) // (4 * workers))
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                                    initargs=(shm.name, len(candles))) as executor:
+            results = list(executor.map(_run_combination, [(strategy_type, c) for c in combinations],
+                                        chunksize=chunksize))
+        del shared_candles
+    finally:
+        shm.close()
+        shm.unlink()
+
+    # Tabla ordenada: mayor pnl primero y, a igual pnl, menor drawdown
+    results.sort(key=lambda r: (-r['pnl'], r['max_drawdown']))
+
+    logger.info("Parameter sweep of %s %s combinations on %s candles done", len(results), strategy_type,
+                len(candles))
+
+    return results
+
+
+def grid_search(strategy_type: str, candles: np.ndarray, param_grid: typing.Dict[str, typing.List],
+                max_workers: typing.Optional[int] = None) -> typing.List[typing.Dict]:
+
+    """
+    Backtest every combination of the parameter grid and return the results ranked by PnL.
+    :param strategy_type: "Technical" or "Breakout"
+    :param candles: structured array with CANDLE_DTYPE
+    :param param_grid: list of values for each parameter, e.g. {"ema_fast": [8, 12], "take_profit": [1, 2], ...}
+    :param max_workers: number of worker processes (None = number of CPUs)
+    :return:
+    """
+
+    names = list(param_grid.keys())
+    combinations = [dict(zip(names, values)) for values in itertools.product(*param_grid.values())]
+
+    return _run_sweep(strategy_type, candles, combinations, max_workers)
+
+
+def random_search(strategy_type: str, candles: np.ndarray, param_grid: typing.Dict[str, typing.List], n_iter: int,
+                  seed: typing.Optional[int] = None,
+                  max_workers: typing.Optional[int] = None) -> typing.List[typing.Dict]:
+
+    """
+    Same as grid_search() but only backtest n_iter different combinations picked at random from the grid.
+    """
+
+    rng = random.Random(seed)
+    names = list(param_grid.keys())
+    grid_size = 1
+    for values in param_grid.values():
+        grid_size *= len(values)
+
+    combinations = []
+    # elijo índices de la grilla sin repetir y sin armar el producto entero (puede ser enorme)
+    for index in rng.sample(range(grid_size), min(n_iter, grid_size)):
+        combination = dict()
+        for name in reversed(names):
+            index, position = divmod(index, len(param_grid[name]))
+            combination[name] = param_grid[name][position]
+        combinations.append({name: combination[name] for name in names})
+
+    return _run_sweep(strategy_type, candles, combinations, max_workers)
+
+
+# Convierte los mejores resultados en filas de la tabla strategies de database.db (mismo formato que
+# Root._save_workspace()), para guardarlas con WorkspaceData.save() o WorkspaceData.append(). Los extra_params
+# llevan todos los parámetros de la estrategia, así la fila se carga en el StrategyEditor lista para arrancar.
+def to_strategy_rows(results: typing.List[typing.Dict], contract: str, timeframe: str, balance_pct: float,
+                     top: int = 1) -> typing.List[typing.Tuple]:
+
+    rows = []
+
+    for r in results[:top]:
+        params = r['params']
+        extra_params = {name: params[name] for name in STRATEGY_PARAMS[r['strategy_type']]}
+
+        rows.append((r['strategy_type'], contract, timeframe, balance_pct, params.get('take_profit'),
+                     params.get('stop_loss'), json.dumps(extra_params),))
+
+    return rows
@@ -0,0 +1,47 @@
+# Grabación de los mensajes de trades crudos del websocket (aggTrade de Binance, trade de Bitmex) a un archivo,
+# para después reproducirlos con replay.py por el mismo camino que en vivo (_on_message -> parse_trades ->
+# check_trade) y medir cuántos ticks por segundo procesa el bot.
+# Formato: una línea por mensaje, "<hora de recepción en ms> <mensaje json tal cual llegó>".
+import logging
+import threading
+import time
+import typing
+
+logger = logging.getLogger()
+
+
+class TickRecorder:
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+
+        self._file = open(path, "a", encoding="utf-8")
+        # el websocket de cada exchange corre en su propio thread y pueden grabar en el mismo archivo
+        self._lock = threading.Lock()
+
+    def record(self, msg: str, received_ms: typing.Optional[int] = None):
+        if received_ms is None:
+            received_ms = int(time.time() * 1000)
+
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(f"{received_ms} {msg}\n")
+            self.count += 1
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+        logger.info("%s messages recorded to %s", self.count, self.path)
+
+
+# Lee un archivo grabado y devuelve (hora de recepción en ms, mensaje) en el orden en que llegaron
+def read_ticks(path: str) -> typing.Iterator[typing.Tuple[int, str]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if line == "":
+                continue
+            received_ms, msg = line.split(" ", 1)
+            yield int(received_ms), msg
@@ -0,0 +1,188 @@
+# Reproducción de trades grabados con recorder.TickRecorder (BinanceClient.start_recording() /
+# BitmexClient.start_recording()) por el camino real del bot: _on_message -> Strategy.parse_trades -> check_trade.
+# Los clientes de replay no se conectan a nada: las órdenes van a un stub que las llena al último precio y los
+# balances son fijos. Sirve para medir los ticks por segundo del hot path y detectar regresiones antes de deployar.
+#
+# Ejemplo:
+#   client = ReplayBinanceClient({"BTCUSDT": contract}, futures=True)
+#   strategy = BreakoutStrategy(client, contract, "Binance", "1m", 10, 1, 1, {"min_volume": 5})
+#   strategy.load_candles(candles)
+#   client.add_strategy(0, strategy)
+#   stats = replay(client, "ticks.txt")              # lo más rápido posible
+#   stats = replay(client, "ticks.txt", speed=1.0)   # a la velocidad real en que se grabó
+import logging
+import time
+import typing
+
+from connectors.binance import BinanceClient
+from connectors.bitmex import BitmexClient
+from connectors.order_batcher import OrderBatcher
+from models import *
+from recorder import read_ticks
+
+logger = logging.getLogger()
+
+
+# Estado del cliente real (_init_state(), sin REST ni websocket) con los cambios del replay
+def _init_replay_state(client, contracts: typing.Dict[str, Contract], balances: typing.Dict[str, float]):
+    client._init_state()
+    client.contracts = contracts
+    # las órdenes se mandan enseguida, así el replay es determinístico
+    client.order_batcher = OrderBatcher(client, window=0)
+    client.reconnect = False
+
+    client.replay_now_ms = 0
+    client.stub_balances = balances
+    # órdenes recibidas por el stub, para poder revisarlas después del replay
+    client.orders = []
+    client._order_id = 0
+
+
+# Precio de llenado de las órdenes del stub: el último cierre de alguna estrategia del symbol
+def _last_price(client, contract: Contract) -> float:
+    strategies = client._strategies_by_symbol.get(contract.symbol, ())
+    if len(strategies) == 0 or strategies[0].candles is None:
+        return 0.
+
+    return float(strategies[0].candles.close[-1])
+
+
+class ReplayBinanceClient(BinanceClient):
+    def __init__(self, contracts: typing.Dict[str, Contract], futures: bool = True,
+                 balances: typing.Optional[typing.Dict[str, float]] = None):
+        self.futures = futures
+        self.platform = "binance_futures" if futures else "binance_spot"
+
+        _init_replay_state(self, contracts, balances if balances is not None else {"USDT": 10000})
+        self.balances = self.get_balances()
+
+    def now_ms(self) -> int:
+        return self.replay_now_ms
+
+    def get_balances(self) -> typing.Dict[str, Balance]:
+        balances = dict()
+
+        for asset, amount in self.stub_balances.items():
+            if self.futures:
+                info = {'initialMargin': 0, 'maintMargin': 0, 'marginBalance': amount, 'walletBalance': amount,
+                        'unrealizedProfit': 0}
+            else:
+                info = {'free': amount, 'locked': 0}
+            balances[asset] = Balance(info, self.platform)
+
+        return balances
+
+    def place_order(self, contract: Contract, order_type: str, quantity: float, side: str,
+                    price=None, tif=None) -> OrderStatus:
+        self._order_id += 1
+        fill_price = _last_price(self, contract) if price is None else price
+
+        self.orders.append({"time": self.replay_now_ms, "symbol": contract.symbol, "side": side,
+                            "type": order_type, "quantity": quantity, "price": fill_price})
+
+        return OrderStatus({'orderId': self._order_id, 'status': "FILLED", 'avgPrice': fill_price,
+                            'executedQty': quantity}, self.platform)
+
+    def cancel_order(self, contract: Contract, order_id: int) -> OrderStatus:
+        return OrderStatus({'orderId': order_id, 'status': "CANCELED", 'avgPrice': 0, 'executedQty': 0},
+                           self.platform)
+
+    def cancel_orders(self, contract: Contract, order_ids: typing.List[int]) -> typing.List[OrderStatus]:
+        return [self.cancel_order(contract, order_id) for order_id in order_ids]
+
+    def get_order_status(self, contract: Contract, order_id: int) -> OrderStatus:
+        return OrderStatus({'orderId': order_id, 'status': "FILLED", 'avgPrice': _last_price(self, contract),
+                            'executedQty': 0}, self.platform)
+
+    def subscribe_channel(self, contracts: typing.List[Contract], channel: str, reconnection=False):
+        pass
+
+    def unsubscribe_channel(self, contracts: typing.List[Contract], channel: str):
+        pass
+
+
+class ReplayBitmexClient(BitmexClient):
+    def __init__(self, contracts: typing.Dict[str, Contract],
+                 balances: typing.Optional[typing.Dict[str, float]] = None):
+        self.futures = True
+        self.platform = "bitmex"
+
+        # los balances de Bitmex van en satoshis, como los devuelve la API
+        _init_replay_state(self, contracts, balances if balances is not None else {"XBt": 100000000})
+        self.balances = self.get_balances()
+
+    def now_ms(self) -> int:
+        return self.replay_now_ms
+
+    def get_balances(self) -> typing.Dict[str, Balance]:
+        balances = dict()
+
+        for currency, amount in self.stub_balances.items():
+            info = {'initMargin': 0, 'maintMargin': 0, 'marginBalance': amount, 'walletBalance': amount,
+                    'unrealisedPnl': 0}
+            balances[currency] = Balance(info, self.platform)
+
+        return balances
+
+    def place_order(self, contract: Contract, order_type: str, quantity: int, side: str, price=None,
+                    tif=None) -> OrderStatus:
+        self._order_id += 1
+        fill_price = _last_price(self, contract) if price is None else price
+
+        self.orders.append({"time": self.replay_now_ms, "symbol": contract.symbol, "side": side,
+                            "type": order_type, "quantity": quantity, "price": fill_price})
+
+        return OrderStatus({'orderID': str(self._order_id), 'ordStatus': "Filled", 'avgPx': fill_price,
+                            'cumQty': quantity}, self.platform)
+
+    def cancel_order(self, order_id: str) -> OrderStatus:
+        return OrderStatus({'orderID': order_id, 'ordStatus': "Canceled", 'avgPx': 0, 'cumQty': 0}, self.platform)
+
+    def cancel_orders(self, order_ids: typing.List[str]) -> typing.List[OrderStatus]:
+        return [self.cancel_order(order_id) for order_id in order_ids]
+
+    def get_order_status(self, contract: Contract, order_id: str) -> OrderStatus:
+        return OrderStatus({'orderID': order_id, 'ordStatus': "Filled", 'avgPx': _last_price(self, contract),
+                            'cumQty': 0}, self.platform)
+
+    def subscribe_channel(self, topic: str):
+        pass
+
+
+def replay(client: typing.Union[ReplayBinanceClient, ReplayBitmexClient], path: str,
+           speed: typing.Optional[float] = None) -> typing.Dict:
+
+    """
+    Feed the recorded messages to client._on_message() and measure the throughput.
+    :param client: a ReplayBinanceClient or ReplayBitmexClient with its strategies already added
+    :param path: file written by TickRecorder
+    :param speed: None to replay as fast as possible, 1.0 for the recorded (wall-clock) speed, 2.0 for twice as fast...
+    :return: messages, elapsed seconds and messages per second
+    """
+
+    # cargo todo antes de empezar para no medir la lectura del archivo
+    ticks = list(read_ticks(path))
+
+    if len(ticks) == 0:
+        return {"messages": 0, "elapsed": 0., "messages_per_second": 0.}
+
+    first_received_ms = ticks[0][0]
+    start = time.perf_counter()
+
+    for received_ms, msg in ticks:
+        if speed is not None:
+            delay = (received_ms - first_received_ms) / 1000 / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+        client.replay_now_ms = received_ms
+        client._on_message(None, msg)
+
+    elapsed = time.perf_counter() - start
+
+    stats = {"messages": len(ticks), "elapsed": elapsed, "messages_per_second": len(ticks) / elapsed}
+
+    logger.info("Replayed %s messages in %.3f s (%.0f messages/s)", stats['messages'], elapsed,
+                stats['messages_per_second'])
+
+    return stats
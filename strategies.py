@@ -1,10 +1,12 @@
+import functools
 import logging
+import threading
 import time
 
-import pandas as pd
 from typing import *
 from models import *
-from threading import Timer
+from indicators import MacdState, RsiState
+import numpy as np
 
 # TYPE_CHECKING es una variable que inicializa en False y que evita un error de importación circular
 # Ya que en el modulo de strategy_component, que ya se usar en este módulo, ya importamos los connectores,
@@ -20,6 +22,19 @@ logger = logging.getLogger()
 # Creo la variable global TF_EQUIV (timeframe equivalent) para representar los tf en milisegundos
 TF_EQUIV = {"1m": 60, "5m": 300, "15m": 900, "30m": 1800, "1h": 3600, "4h": 14400, "1d": 86400}
 
+# Cantidad de velas que guarda cada estrategia en memoria por encima de su lookback más largo
+CANDLES_RETENTION_MARGIN = 100
+
+
+# Los métodos con este decorador corren con el lock de la estrategia tomado (ver Strategy.__init__())
+def _synchronized(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
 
 # Clase base de cualquier estrategia que tenga el TradingBot
 class Strategy:
@@ -27,7 +42,8 @@ class Strategy:
     # Agrego el nombre de la estrategia como parámetro para pasarlo dentro del objeto nuevo creado en models Trade
     # que pide guardar la estrategia en el nuevo trade
     def __init__(self, client: Union["BitmexClient", "BinanceClient"], contract: Contract, exchange: str,
-                 timeframe: str, balance_pct: float, take_profit: float, stop_loss: float, strat_name):
+                 timeframe: str, balance_pct: float, take_profit: float, stop_loss: float, strat_name,
+                 candles_retention: Optional[int] = None):
 
         # Atributos comunes a cualquier estrategia del TradingBot
         self.client = client
@@ -42,9 +58,21 @@ class Strategy:
         self.strat_name = strat_name
 
         self.ongoing_position = False
-
-        # Cada vez que creo una estrategia traigo las candles del contrato que voy a operar
-        self.candles: List[Candle] = []
+        # True desde que el cliente la saca con remove_strategy() (ver stop())
+        self.stopped = False
+
+        # Los trades llegan por el thread del websocket (o el StrategyWorker en los clientes asyncio) y las respuestas
+        # de las órdenes por el del OrderBatcher y el del OrderTracker. Todos modifican ongoing_position, trades y el
+        # status de cada trade, así que on_trade(), backfill_candles() y los callbacks de las órdenes toman este
+        # lock. Es reentrante porque con OrderBatcher(window=0) (replay.py) el callback corre dentro de submit(),
+        # desde el mismo thread que ya lo tiene.
+        self._lock = threading.RLock()
+
+        # Cada vez que creo una estrategia traigo las candles del contrato que voy a operar. Se guardan en un
+        # CandleBuffer de capacidad fija que se crea en load_candles(), cuando ya conozco los parámetros de la
+        # estrategia (y por ende su lookback). Si candles_retention es None, se calcula con _lookback().
+        self._candles_retention = candles_retention
+        self.candles: Optional[CandleBuffer] = None
 
         self.trades: List[Trade] = []
 
@@ -55,18 +83,52 @@ class Strategy:
         logger.info("%s", msg)
         self.logs.append({"log": msg, "displayed": False})
 
+    # La llama el cliente en remove_strategy(). Sus trades dejan de actualizarse (como antes, que sólo se recorrían las
+    # estrategias activas), y como toma el lock, la respuesta de una orden de entrada que llegue después (el
+    # OrderBatcher la manda al terminar su ventana) ya ve la estrategia parada y no agrega otro trade.
+    @_synchronized
+    def stop(self):
+        self.stopped = True
+
+        for trade in self.trades:
+            if trade.status in ("open", "closing"):
+                self.client.open_positions.remove(trade)
+
+        # las órdenes de entrada que todavía no se llenaron (las sigue el OrderTracker) se cancelan juntas
+        working = [trade.entry_id for trade in self.trades if trade.status == "open" and trade.entry_price is None]
+        if len(working) > 0:
+            self.client.order_tracker.cancel(self.contract, working)
+
+    # Cantidad de velas cerradas que necesita la estrategia para calcular su señal
+    def _lookback(self) -> int:
+        return 2
+
+    # Carga las velas históricas (de get_historical_candles()) en el buffer de la estrategia
+    def load_candles(self, candles: List[Candle]):
+        retention = self._candles_retention
+        if retention is None:
+            retention = self._lookback() + CANDLES_RETENTION_MARGIN
+
+        self.candles = CandleBuffer(retention)
+        self.candles.extend(candles)
+
+    # Entrada de cada trade del websocket: parse_trades() y check_trade() con el lock tomado una sola vez, así la
+    # respuesta de una orden no se mete entre la actualización de la vela y el chequeo de la señal
+    def on_trade(self, price: float, size: float, timestamp: int):
+        with self._lock:
+            # lo guardo en una variable result. Ese result es para update la candle o crear una nueva
+            res = self.parse_trades(price, size, timestamp)
+            self.check_trade(res)
+
     # creo un método para parsear la información del trade (precio, quantity, stop, etc)
     def parse_trades(self, price: float, size: float, timestamp: int) -> str:
 
-        # Creo el timestamp_diff y el if condicional para no empezar a pasar trades a lo loco y que todo el sistema
-        # de updates candles se ralentice y se haga imposible de operar por los delays. Le establezco al menos 2
-        # segundos entre trades.
-        timestamp_diff = int(time.time() * 1000) - timestamp
-        if timestamp_diff >= 2000:
-            logger.warning("%s %s: %s milliseconds of difference between the current time and the trade time",
-                           self.exchange, self.contract.symbol, timestamp_diff)
+        # Atraso del trade respecto de la hora del exchange (now_ms() ya corrige el offset del reloj local). Va al
+        # histograma del cliente, que loguea un resumen de los trades atrasados más de 2 segundos en vez de una línea
+        # por trade (ver connectors/clock_sync.py).
+        self.client.tick_lag.record(self.contract.symbol, self.client.now_ms() - timestamp)
 
-        last_candle = self.candles[-1]
+        last_ts = int(self.candles.timestamp[-1])
 
         # A su vez este método tendrá 3 posibilidades:
 
@@ -74,14 +136,10 @@ class Strategy:
         # definamos que estamos en un timeframe de 30m, es decir 1800 segundos
         # esto sería si el timestamp de la candle es 1020, quiere decir que estamos en el candle, ya que va
         # de 0 a 1800 (30m en segundos) + los milisegundos y sigue en la misma candle, haremos el update
-        if timestamp < last_candle.timestamp + self.tf_equiv:
+        if timestamp < last_ts + self.tf_equiv:
 
-            last_candle.close = price
-            last_candle.volume += size
-            if price > last_candle.high:
-                last_candle.high = price
-            elif price < last_candle.low:
-                last_candle.low = price
+            # actualizo en el lugar la vela que se está formando
+            self.candles.update_last(price, size)
 
             # Agrego para chequear take profit o stop loss
             for trade in self.trades:
@@ -96,77 +154,96 @@ class Strategy:
         # esto sería si el timestamp de la candle es 4000, quiere decir que estamos en el candle, ya que va
         # de 0 a 1800 (30m en segundos) + los milisegundos y es en otra candle siguiente a la próxima (1800 a 3600).
         # significa que hemos perdido la 2a candle
-        elif timestamp >= last_candle.timestamp + 2 * self.tf_equiv:
+        elif timestamp >= last_ts + 2 * self.tf_equiv:
 
             # debo calcular cuántas candles perdi
             # resto el timestamp actual y el de la última candle y divido por el tiempo en milisegundos para tener la
             # cantidad de candles
             # ejemplo: tf 1h (3600) timestamp actual 20000, last_candle timestamp = 3600.
             # 4,55 si lo paso a int = 5 , menos 1 = 4. Perdí 4 velas. es correcto.
-            missing_candles = int((timestamp - last_candle.timestamp) / self.tf_equiv) - 1
+            missing_candles = int((timestamp - last_ts) / self.tf_equiv) - 1
 
             logger.info("%s missing %s candles for %s %s (%s %s)", self.exchange, missing_candles, self.contract.symbol,
-                        self.tf, timestamp, last_candle.timestamp)
+                        self.tf, timestamp, last_ts)
 
-            # agrego las candles perdidas
+            # agrego las candles perdidas, planas al precio de cierre de la última
+            last_close = float(self.candles.close[-1])
             for missing in range(missing_candles):
-                new_ts = last_candle.timestamp + self.tf_equiv
-                candle_info = {'ts': new_ts, 'open': last_candle.close, 'high': last_candle.close,
-                               'low': last_candle.close, 'close': last_candle.close, 'volume': 0}
-                # creo la nueva candle, con toda la info, el timeframe y el "exchange"
-                new_candle = Candle(candle_info, self.tf, "parse_trade")
-
-                self.candles.append(new_candle)
-
-                # reemplazo la última con la nueva
-                last_candle = new_candle
-
-            new_ts = last_candle.timestamp + self.tf_equiv
-            candle_info = {'ts': new_ts, 'open': price, 'high': price, 'low': price, 'close': price, 'volume': size}
-            # creo la nueva candle, con toda la info, el timeframe y el "exchange"
-            new_candle = Candle(candle_info, self.tf, "parse_trade")
+                last_ts += self.tf_equiv
+                self.candles.append(last_ts, last_close, last_close, last_close, last_close, 0)
 
-            self.candles.append(new_candle)
+            new_ts = last_ts + self.tf_equiv
+            # agrego la nueva candle en el buffer
+            self.candles.append(new_ts, price, price, price, price, size)
 
             return "new_candle"
 
         # Comenzar un nuevo candle
         # Viceversa que lo anterior. No update, es un nuevo candle
-        elif timestamp >= last_candle.timestamp + self.tf_equiv:
-            new_ts = last_candle.timestamp + self.tf_equiv
-            candle_info = {'ts': new_ts, 'open': price, 'high': price, 'low': price, 'close': price, 'volume': size}
-            # creo la nueva candle, con toda la info, el timeframe y el "exchange"
-            new_candle = Candle(candle_info, self.tf, "parse_trade")
-
-            self.candles.append(new_candle)
+        elif timestamp >= last_ts + self.tf_equiv:
+            new_ts = last_ts + self.tf_equiv
+            # agrego la nueva candle en el buffer
+            self.candles.append(new_ts, price, price, price, price, size)
 
             logger.info("%s New candle for %s %s", self.exchange, self.contract.symbol, self.tf)
 
             return "new_candle"
 
-    def _check_order_status(self, order_id):
-
-        order_status = self.client.get_order_status(self.contract, order_id)
-
-        if order_status is not None:
-            logger.info("%s order status: %s", self.exchange, order_status.status)
-
-            if order_status.status == "filled":
-                # loop sobre la lista de trades para identificar a este por el id
-                for trade in self.trades:
-                    if trade.entry_id == order_id:
-                        trade.entry_price = order_status.avg_price
-                        trade.quantity = order_status.executed_qty
-                        break
-                return
+    # Completa el buffer con las velas del exchange (get_historical_candles() desde la última vela guardada) que se
+    # perdieron mientras el websocket estuvo desconectado, en vez de las velas planas de parse_trades(). La vela que
+    # se estaba formando se reemplaza por la del exchange, que tiene todos sus trades. Los clientes la llaman al
+    # reconectarse, antes de pasarle los trades nuevos a la estrategia.
+    @_synchronized
+    def backfill_candles(self, candles: List[Candle]) -> int:
+        if self.candles is None or len(self.candles) == 0:
+            return 0
 
-        # chequeo hasta que el order_status este lleno cada 2 segundos
-        t = Timer(2.0, lambda: self._check_order_status(order_id))
-        t.start()
+        last_ts = int(self.candles.timestamp[-1])
+        added = 0
+
+        for candle in candles:
+            if candle.timestamp == last_ts:
+                self.candles.replace_last(candle.open, candle.high, candle.low, candle.close, candle.volume)
+
+            elif candle.timestamp > last_ts:
+                # Bitmex no trae las velas sin trades: van planas, igual que en parse_trades()
+                last_close = float(self.candles.close[-1])
+                while candle.timestamp > last_ts + self.tf_equiv:
+                    last_ts += self.tf_equiv
+                    self.candles.append(last_ts, last_close, last_close, last_close, last_close, 0)
+                    added += 1
+
+                self.candles.append(candle.timestamp, candle.open, candle.high, candle.low, candle.close,
+                                    candle.volume)
+                last_ts = candle.timestamp
+                added += 1
+
+        if added > 0:
+            logger.info("%s backfilled %s candles for %s %s", self.exchange, added, self.contract.symbol, self.tf)
+
+        return added
+
+    # La llama el OrderTracker del cliente cuando una orden que no se llenó al hacer place_order() termina
+    @_synchronized
+    def _on_order_update(self, order_status: OrderStatus):
+
+        # loop sobre la lista de trades para identificar a este por el id
+        for trade in self.trades:
+            if trade.entry_id == order_status.order_id:
+                if order_status.status == "filled" or order_status.executed_qty > 0:
+                    trade.entry_price = order_status.avg_price
+                    trade.quantity = order_status.executed_qty
+                else:
+                    # la orden se canceló / expiró sin llenarse, así que no hay posición abierta
+                    self._add_log(f"Entry order on {self.contract.symbol} {self.tf} {order_status.status}")
+                    trade.status = "closed"
+                    self.client.open_positions.remove(trade)
+                    self.ongoing_position = False
+                break
 
     def _open_position(self, signal_result: int):
 
-        trade_size = self.client.get_trade_size(self.contract, self.candles[-1].close, self.balance_pct)
+        trade_size = self.client.get_trade_size(self.contract, float(self.candles.close[-1]), self.balance_pct)
         # Si es None, algo anduvo mal
         if trade_size is None:
             return
@@ -176,34 +253,58 @@ class Strategy:
         position_side = "long" if signal_result == 1 else "short"
         self._add_log(f"{position_side.capitalize()} signal on {self.contract.symbol} {self.tf}")
 
-        # pasamos la orden al cliente
-        order_status = self.client.place_order(self.contract, "MARKET", trade_size, order_side)
+        # muy importante: cambio el estado a True al mandar la orden, así no se abre otra mientras se espera la
+        # respuesta. Si la orden falla, _on_entry_placed() lo vuelve a False.
+        self.ongoing_position = True
 
-        if order_status is not None:
-            # request succesful
-            self._add_log(f"{order_side.capitalize()} order placed on {self.exchange} | Status: {order_status.status}")
-            # muy importante: cambio el estado a True cuando se hace place de la orden
-            self.ongoing_position = True
-
-            avg_fill_price = None
-
-            # Binance y Bitmex devuelven filled cuando la orden está completa, pero otros exchanges pueden devolver
-            # otra palabra (executed, etc).
-            if order_status.status == "filled":
-                # guardo el precio promedio de ejecución de la orden
-                avg_fill_price = order_status.avg_price
-            else:
-                # puede pasar que la orden no se complete de una, sino que demore , entonces voy a ir chequeando
-                # cada x tiempo si se completó
-                t = Timer(2.0, lambda: self._check_order_status(order_status.order_id))
-                t.start()
-
-            # Va a ser una lista que guarde el Trade.
-            new_trade = Trade({"time": int(time.time() * 1000), "entry_price": avg_fill_price,
-                               "contract": self.contract, "strategy": self.strat_name, "side": position_side,
-                               "status": "open", "pnl": 0, "quantity": order_status.executed_qty, "entry_id": order_status.order_id})
-
-            self.trades.append(new_trade)
+        # pasamos la orden al cliente, que la junta con las de otras estrategias (ver connectors/order_batcher.py)
+        self.client.order_batcher.submit(self.contract, "MARKET", trade_size, order_side,
+                                         functools.partial(self._on_entry_placed, order_side, position_side))
+
+    # La llama el OrderBatcher del cliente con la respuesta de la orden de entrada
+    @_synchronized
+    def _on_entry_placed(self, order_side: str, position_side: str, order_status: Optional[OrderStatus]):
+        # Si es None, falló el request y no hay posición abierta
+        if order_status is None:
+            self.ongoing_position = False
+            return
+
+        # request succesful
+        self._add_log(f"{order_side.capitalize()} order placed on {self.exchange} | Status: {order_status.status}")
+
+        # la estrategia se paró mientras la orden esperaba en el OrderBatcher: nadie seguiría el trade (ni TP / SL ni
+        # pnl), así que no se registra
+        if self.stopped:
+            self._add_log(f"{self.contract.symbol} {self.tf} strategy was stopped before its entry order "
+                          f"{order_status.order_id} was placed, check the position on {self.exchange}")
+            # si quedó abierta en el exchange, se cancela
+            if order_status.status != "filled":
+                self.client.order_tracker.track(self.contract, order_status.order_id, self._on_order_update)
+                self.client.order_tracker.cancel(self.contract, [order_status.order_id])
+            return
+
+        avg_fill_price = None
+
+        # Binance y Bitmex devuelven filled cuando la orden está completa, pero otros exchanges pueden devolver
+        # otra palabra (executed, etc).
+        if order_status.status == "filled":
+            # guardo el precio promedio de ejecución de la orden
+            avg_fill_price = order_status.avg_price
+
+        # Va a ser una lista que guarde el Trade.
+        new_trade = Trade({"time": int(time.time() * 1000), "entry_price": avg_fill_price,
+                           "contract": self.contract, "strategy": self.strat_name, "side": position_side,
+                           "status": "open", "pnl": 0, "quantity": order_status.executed_qty,
+                           "entry_id": order_status.order_id})
+
+        self.trades.append(new_trade)
+        # lo registro en las posiciones abiertas del conector para que actualice su pnl con cada precio
+        self.client.open_positions.add(new_trade)
+
+        if order_status.status != "filled":
+            # puede pasar que la orden no se complete de una, sino que demore, entonces el cliente la va a ir
+            # chequeando (junto con las demás órdenes pendientes) hasta que se complete
+            self.client.order_tracker.track(self.contract, order_status.order_id, self._on_order_update)
 
     def _check_tp_sl(self, trade: Trade):
 
@@ -212,7 +313,7 @@ class Strategy:
         sl_triggered = False
 
         # comparo el precio actual contra el precio de entrada del trade
-        price = self.candles[-1].close
+        price = float(self.candles.close[-1])
 
         if trade.side == "long":
             if self.stop_loss is not None:
@@ -244,24 +345,36 @@ class Strategy:
 
             if not self.client.futures:
                 # Make sure we don't sell more than what's in the available balance on Binance Spot
-                current_balances = self.client.get_balances()
+                # balances en memoria, que el cliente mantiene al día con el user data stream
+                current_balances = self.client.balances
                 if current_balances is not None:
                     if order_side == "SELL" and self.contract.base_asset in current_balances:
                         trade.quantity = min(current_balances[self.contract.base_asset].free, trade.quantity)
 
-            order_status = self.client.place_order(self.contract, "MARKET", trade.quantity, order_side)
+            # mientras se espera la respuesta el trade no vuelve a chequear el TP / SL (sólo se chequean los "open")
+            trade.status = "closing"
+            self.client.order_batcher.submit(self.contract, "MARKET", trade.quantity, order_side,
+                                             functools.partial(self._on_exit_placed, trade))
 
-            if order_status is not None:
-                self._add_log(f"Exit order on {self.contract.symbol} {self.tf} placed successfully")
-                trade.status = "closed"
-                self.ongoing_position = False
+    # La llama el OrderBatcher del cliente con la respuesta de la orden de salida
+    @_synchronized
+    def _on_exit_placed(self, trade: Trade, order_status: Optional[OrderStatus]):
+        if order_status is not None:
+            self._add_log(f"Exit order on {self.contract.symbol} {self.tf} placed successfully")
+            trade.status = "closed"
+            self.client.open_positions.remove(trade)
+            self.ongoing_position = False
+        else:
+            # si falló, se vuelve a intentar cuando el precio lo vuelva a disparar
+            trade.status = "open"
 
 
 class TechnicalStrategy(Strategy):
     def __init__(self, client, contract: Contract, exchange: str, timeframe: str, balance_pct: float,
                  take_profit: float,
-                 stop_loss: float, other_params: Dict):
-        super().__init__(client, contract, exchange, timeframe, balance_pct, take_profit, stop_loss, "Technical")
+                 stop_loss: float, other_params: Dict, candles_retention: Optional[int] = None):
+        super().__init__(client, contract, exchange, timeframe, balance_pct, take_profit, stop_loss, "Technical",
+                         candles_retention)
 
         # Atributos particulares de la clase
         self._ema_fast = other_params['ema_fast']
@@ -270,58 +383,59 @@ class TechnicalStrategy(Strategy):
 
         self._rsi_length = other_params['rsi_length']
 
-    # el rsi se puede calcular con las ema que figuran como atributos (fast, slow, signal)
-    def _rsi(self):
-        # lista de precios de cierre de cada día para ir armando las ema
-        close_list = []
-        for candle in self.candles:
-            close_list.append(candle.close)
+        # Estado incremental de los indicadores, así no recalculo toda la historia de velas en cada vela nueva
+        self._macd_state = MacdState(self._ema_fast, self._ema_slow, self._ema_signal)
+        self._rsi_state = RsiState(self._rsi_length)
+        # timestamp de la última vela cerrada con la que alimenté los indicadores
+        self._last_indicator_ts = None
 
-        # convierto la lista a un Objeto Series de Pandas
-        closes = pd.Series(close_list)
+    # La ema más lenta más su señal es el período más largo que usan los indicadores
+    def _lookback(self) -> int:
+        return max(self._ema_slow + self._ema_signal, self._rsi_length + 1)
 
-        delta = closes.diff().dropna()
+    # Antes de guardar las velas en el buffer (que sólo retiene las últimas), hago el warm-up de los indicadores con
+    # todas las velas históricas cerradas (la última se está formando).
+    def load_candles(self, candles: List[Candle]):
+        for candle in candles[:-1]:
+            self._macd_state.update(candle.close)
+            self._rsi_state.update(candle.close)
+            self._last_indicator_ts = candle.timestamp
 
-        # separo las variaciones positivas de las negativas
-        up, down = delta.copy(), delta.copy()
-        # si es menor a 0 la seteo en 0, ya que la lista solo registra up
-        up[up < 0] = 0
-        # si es mayor a 0 la seteo en 0, ya que la lista solo registra down
-        down[down > 0] = 0
+        super().load_candles(candles)
 
-        # calculo las ema para el rsi - com significa center of mass
-        avg_gain = up.ewm(com=(self._rsi_length - 1), min_periods=self._rsi_length).mean()
-        # convierto los negativos a positivos para registrarlos en la lista con abs()
-        avg_loss = down.abs().ewm(com=(self._rsi_length - 1), min_periods=self._rsi_length).mean()
+    # Alimento los indicadores con las velas cerradas que todavía no procesé. La última vela del buffer es la que se
+    # está formando, así que nunca entra. Normalmente es 1 vela por llamado, o más si hubo velas faltantes.
+    def _update_indicators(self):
 
-        rs = avg_gain / avg_loss
+        # las columnas son vistas del buffer, no copias
+        timestamps = self.candles.timestamp[:-1]
+        closes = self.candles.close[:-1]
 
-        rsi = 100 - 100 / (1 + rs)
-        rsi = rsi.round(2)
-
-        return rsi.iloc[-2]
+        if self._last_indicator_ts is None:
+            first_new = 0
+        else:
+            # busco (en O(log n)) la primera vela cerrada posterior a la última que ya procesé
+            first_new = int(np.searchsorted(timestamps, self._last_indicator_ts, side='right'))
 
-    # el macd se puede calcular con las ema que figuran como atributos (fast, slow, signal)
-    def _macd(self) -> Tuple[float, float]:
+        for i in range(first_new, len(closes)):
+            close = float(closes[i])
+            self._macd_state.update(close)
+            self._rsi_state.update(close)
+            self._last_indicator_ts = int(timestamps[i])
 
-        # lista de precios de cierre de cada día para ir armando las ema
-        close_list = []
-        for candle in self.candles:
-            close_list.append(candle.close)
+    # el rsi se calcula con promedios de Wilder que se actualizan vela a vela en indicators.RsiState
+    def _rsi(self) -> float:
+        self._update_indicators()
 
-        # convierto la lista a un Objeto Series de Pandas
-        closes = pd.Series(close_list)
+        # rsi de la candle previa (ya que la última se está formando)
+        return self._rsi_state.rsi
 
-        # ewm provee los calculos para exponencial weighted functions. Lo calculo junto a un mean y sale la ema
-        # podría usar una librería también, pero por ahora lo hacemos así
-        # el span es el periodo elegido en la interface de parameters del GUI para la ema_fast
-        ema_fast = closes.ewm(span=self._ema_fast).mean()
-        ema_slow = closes.ewm(span=self._ema_slow).mean()
-        macd_line = ema_fast - ema_slow
-        macd_signal = macd_line.ewm(span=self._ema_signal).mean()
+    # el macd se calcula con las ema que figuran como atributos (fast, slow, signal), mantenidas en indicators.MacdState
+    def _macd(self) -> Tuple[float, float]:
+        self._update_indicators()
 
-        # retorno la linea y señal de la candle previa [-2] (ya que [-1] es la última
-        return macd_line.iloc[-2], macd_signal.iloc[-2]
+        # retorno la linea y señal de la candle previa (ya que la última se está formando)
+        return self._macd_state.macd_line, self._macd_state.macd_signal
 
     # método para determinar si debemos ir long o short y definir cómo actua la estrategia. Fundamental
     # definir cómo actua la estrategia acá, en check_signal()
@@ -342,6 +456,10 @@ class TechnicalStrategy(Strategy):
     # En technical, sólo chequeamos el trade cuando hay un nuevo candle
     def check_trade(self, tick_type: str):
 
+        # Actualizo los indicadores con cada vela cerrada aunque haya una posición abierta, para no acumular atraso
+        if tick_type == "new_candle":
+            self._update_indicators()
+
         # Si viene un nuevo candle y ongoing_position es False (es decir que no hay nada ya abierto)
         if tick_type == "new_candle" and not self.ongoing_position:
             signal_result = self._check_signal()
@@ -355,8 +473,9 @@ class TechnicalStrategy(Strategy):
 class BreakoutStrategy(Strategy):
     def __init__(self, client, contract: Contract, exchange: str, timeframe: str, balance_pct: float,
                  take_profit: float,
-                 stop_loss: float, other_params: Dict):
-        super().__init__(client, contract, exchange, timeframe, balance_pct, take_profit, stop_loss, "Breakout")
+                 stop_loss: float, other_params: Dict, candles_retention: Optional[int] = None):
+        super().__init__(client, contract, exchange, timeframe, balance_pct, take_profit, stop_loss, "Breakout",
+                         candles_retention)
 
         # Atributos particulares de la clase
         self._min_volume = other_params['min_volume']
@@ -367,10 +486,13 @@ class BreakoutStrategy(Strategy):
         # return un int ya que si es long será 1 , short -1 , nada 0
 
         # long
-        if self.candles[-1].close > self.candles[-2].high and self.candles[-1].volume > self._min_volume:
+        close = self.candles.close[-1]
+        volume = self.candles.volume[-1]
+
+        if close > self.candles.high[-2] and volume > self._min_volume:
             return 1
         # short
-        elif self.candles[-1].close < self.candles[-2].low and self.candles[-1].volume > self._min_volume:
+        elif close < self.candles.low[-2] and volume > self._min_volume:
             return -1
         else:
             return 0
@@ -0,0 +1,68 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from connectors.async_support import timed_async_request
+from connectors.http_session import LatencyStats
+
+
+class FakeResponse:
+    status = 200
+    headers = dict()
+
+    async def json(self, content_type=None):
+        return {"ok": True}
+
+
+# Cada request levanta el próximo error de la lista, y cuando no quedan responde 200
+class FakeRequest:
+    def __init__(self, error):
+        self._error = error
+
+    async def __aenter__(self):
+        if self._error is not None:
+            raise self._error
+        return FakeResponse()
+
+    async def __aexit__(self, *args):
+        return False
+
+
+class FakeSession:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.requests = 0
+
+    def request(self, method, url, headers=None):
+        self.requests += 1
+        return FakeRequest(self.errors.pop(0) if len(self.errors) > 0 else None)
+
+
+def _request(session, method):
+    return asyncio.run(timed_async_request(session, LatencyStats(), method, "https://example.com", "/x", dict(),
+                                           max_retries=2, backoff_factor=0))
+
+
+def test_read_errors_are_retried_for_idempotent_methods():
+    for error in (asyncio.TimeoutError(), aiohttp.ServerDisconnectedError(), aiohttp.ClientOSError()):
+        session = FakeSession([error, error])
+
+        assert _request(session, "GET")[0] == 200
+        assert session.requests == 3
+
+
+def test_read_errors_are_not_retried_for_post():
+    session = FakeSession([aiohttp.ServerDisconnectedError()])
+
+    with pytest.raises(aiohttp.ServerDisconnectedError):
+        _request(session, "POST")
+    assert session.requests == 1
+
+
+def test_retries_are_limited():
+    session = FakeSession([asyncio.TimeoutError()] * 3)
+
+    with pytest.raises(asyncio.TimeoutError):
+        _request(session, "DELETE")
+    assert session.requests == 3
@@ -0,0 +1,91 @@
+import asyncio
+
+import connectors.binance_async
+from connectors.binance import BinanceClient
+from connectors.binance_async import AsyncBinanceClient
+from models import Contract
+
+
+class FakeStreamPool:
+    def __init__(self, *args, **kwargs):
+        self.streams = []
+
+    async def subscribe(self, streams):
+        self.streams.extend(streams)
+
+
+async def _noop(*args):
+    return None
+
+
+def test_start_skips_channels_without_symbols(monkeypatch):
+    monkeypatch.setattr(connectors.binance_async, "AsyncBinanceStreamPool", FakeStreamPool)
+    monkeypatch.setattr(connectors.binance_async, "create_async_session", lambda *args: None)
+
+    contract = Contract({'symbol': "ETHUSDT", 'baseAsset': "ETH", 'quoteAsset': "USDT", 'pricePrecision': 2,
+                         'quantityPrecision': 3}, "binance_futures")
+
+    async def get_contracts():
+        return {"ETHUSDT": contract}
+
+    async def get_balances():
+        return dict()
+
+    client = AsyncBinanceClient("key", "secret", True, True)
+    client._sync_clock = _noop
+    client.get_contracts = get_contracts
+    client.get_balances = get_balances
+    client._start_user_stream = _noop
+    client._maintain_balances = _noop
+    client._maintain_clock = _noop
+
+    # suscripciones hechas antes de start(): un symbol que ya no existe y canales vacíos
+    client.ws_subscriptions["aggTrade"] = ["ETHUSDT", "OLDUSDT"]
+
+    asyncio.run(client.start())
+    client._strategy_worker.stop()
+
+    assert client.ws.streams == ["ethusdt@aggTrade"]
+
+
+# Respuestas por endpoint, y los requests que se hicieron
+class FakeExchange:
+    def __init__(self):
+        self.requests = []
+
+    def respond(self, method, endpoint, data):
+        self.requests.append((method, endpoint))
+
+        if endpoint == "/api/v3/order":
+            # orden de Spot sin fills ni cummulativeQuoteQty: el precio promedio sale de /api/v3/myTrades
+            return {'orderId': 7, 'status': "FILLED", 'executedQty': "2"}
+        if endpoint == "/api/v3/myTrades":
+            return [{'price': "100", 'qty': "1"}, {'price': "102", 'qty': "1"}]
+
+
+def test_async_client_makes_the_same_requests_as_the_sync_client():
+    contract = Contract({'symbol': "ETHUSDT", 'baseAsset': "ETH", 'quoteAsset': "USDT",
+                         'filters': [{'filterType': "PRICE_FILTER", 'tickSize': "0.01"},
+                                     {'filterType': "LOT_SIZE", 'stepSize': "0.001"}]}, "binance_spot")
+
+    sync_exchange = FakeExchange()
+    sync_client = BinanceClient.__new__(BinanceClient)
+    sync_client.futures = False
+    sync_client._init_config("key", "secret", True)
+    sync_client._init_state()
+    sync_client._make_request = sync_exchange.respond
+
+    async_exchange = FakeExchange()
+    async_client = AsyncBinanceClient("key", "secret", True, False)
+
+    async def make_request(method, endpoint, data):
+        return async_exchange.respond(method, endpoint, data)
+
+    async_client._make_request = make_request
+
+    sync_status = sync_client.place_order(contract, "MARKET", 2, "BUY")
+    async_status = asyncio.run(async_client.place_order(contract, "MARKET", 2, "BUY"))
+
+    assert sync_exchange.requests == [("POST", "/api/v3/order"), ("GET", "/api/v3/myTrades")]
+    assert async_exchange.requests == sync_exchange.requests
+    assert sync_status.avg_price == async_status.avg_price == 101.
@@ -0,0 +1,32 @@
+from connectors.binance_async import AsyncBinanceClient
+from connectors.bitmex_async import AsyncBitmexClient
+from replay import ReplayBinanceClient, ReplayBitmexClient
+
+
+# Los atributos que _init_state() crea en un objeto vacío, sin pasar por __init__()
+def _state_attributes(cls, **attributes) -> set:
+    client = cls.__new__(cls)
+    client.__dict__.update(attributes)
+    client._init_state()
+    return set(vars(client)) - set(attributes)
+
+
+def test_async_clients_share_the_client_state():
+    for cls, args in ((AsyncBinanceClient, ("key", "secret", True, True)),
+                      (AsyncBitmexClient, ("key", "secret", True))):
+        client = cls(*args)
+        expected = _state_attributes(cls, futures=True, platform=client.platform)
+
+        assert expected <= set(vars(client))
+        # las órdenes de las estrategias pasan por el cliente sincrónico
+        assert client.order_tracker._client is client.blocking
+        assert client.order_batcher._client is client.blocking
+
+
+def test_replay_clients_share_the_client_state():
+    for client in (ReplayBinanceClient({}), ReplayBitmexClient({})):
+        expected = _state_attributes(type(client), futures=True, platform=client.platform)
+
+        assert expected <= set(vars(client))
+        assert client.order_batcher._client is client
+        assert client.reconnect is False
@@ -0,0 +1,36 @@
+from connectors.clock_sync import ClockSync, RTT_MAX_REJECTIONS
+
+
+# Muestra con el round-trip rtt_ms y el reloj del exchange offset_ms adelante del local
+def _add(clock: ClockSync, t: float, rtt_ms: float, offset_ms: float) -> bool:
+    received = t + rtt_ms / 1000
+    return clock.add_sample(t, (t + received) * 500 + offset_ms, received)
+
+
+def test_single_slow_sample_is_rejected():
+    clock = ClockSync()
+
+    assert _add(clock, 1000., 20, 100)
+    assert not _add(clock, 1001., 500, 5000)
+    assert _add(clock, 1002., 20, 100)
+
+    assert abs(clock.offset_ms - 100) < 1
+    assert clock.rejected == 1
+    assert clock.reseeds == 0
+
+
+def test_rtt_baseline_adapts_to_a_slower_network():
+    clock = ClockSync()
+    assert _add(clock, 1000., 20, 100)
+
+    # la red pasa a tener 400 ms de round-trip y el offset cambió
+    results = [_add(clock, 1001. + i, 400, 300) for i in range(RTT_MAX_REJECTIONS + 3)]
+
+    assert results == [False] * RTT_MAX_REJECTIONS + [True] * 3
+    assert clock.reseeds == 1
+    assert abs(clock.offset_ms - 300) < 1
+    assert abs(clock.rtt_ms - 400) < 1
+
+    # y las muestras normales de la red nueva se siguen promediando
+    assert _add(clock, 2000., 420, 310)
+    assert clock.reseeds == 1
@@ -0,0 +1,52 @@
+from connectors.binance import BinanceClient
+from history import download_history
+from models import Contract
+
+
+class FakeResponse:
+    status_code = 200
+    headers = dict()
+
+    def __init__(self, data):
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+# Devuelve las velas de 1m que pide cada request de klines
+class FakeSession:
+    def __init__(self):
+        self.requests = 0
+
+    def request(self, method, url, timeout=None, params=None, headers=None):
+        self.requests += 1
+        klines = [[t, "1", "2", "0.5", "1.5", "10"] for t in range(params['startTime'], params['endTime'] + 1, 60000)]
+        return FakeResponse(klines)
+
+
+def _client() -> BinanceClient:
+    client = BinanceClient.__new__(BinanceClient)
+    client.futures = True
+    client._init_config("key", "secret", True)
+    client._init_state()
+    client._session = FakeSession()
+    client._timeout = (1, 1)
+    return client
+
+
+def test_download_history_goes_through_the_request_scheduler():
+    client = _client()
+    contract = Contract({'symbol': "BTCUSDT", 'baseAsset': "BTC", 'quoteAsset': "USDT", 'pricePrecision': 2,
+                         'quantityPrecision': 3}, "binance_futures")
+
+    # 2500 velas de 1m: 3 páginas de 1000
+    candles = download_history(client, contract, "1m", 0, 2499 * 60000)
+
+    assert len(candles) == 2500
+    assert (candles['timestamp'][1:] > candles['timestamp'][:-1]).all()
+
+    stats = client.scheduler.stats()
+    assert client._session.requests == 3
+    assert stats["requests"]["low"] == 3
+    assert stats["requests"]["normal"] == 0
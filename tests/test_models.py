@@ -0,0 +1,58 @@
+import calendar
+import datetime
+
+import dateutil.parser
+
+from models import bitmex_timestamp_ms
+
+
+# Referencia: dateutil con la conversión a epoch hecha aparte (sin zona horaria se toma como UTC)
+def _isoparse_ms(timestamp: str) -> int:
+    parsed = dateutil.parser.isoparse(timestamp)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc)
+    return calendar.timegm(parsed.utctimetuple()) * 1000 + parsed.microsecond // 1000
+
+
+# Formato de Bitmex, por el camino rápido (y su cache del minuto)
+FAST_PATH = ["2023-11-14T22:13:20.123Z",
+             "2023-11-14T22:13:59.999Z",
+             "2023-11-14T22:14:00.000Z",  # cambio de minuto
+             "2023-11-14T22:13:21.001Z",  # vuelve a un minuto anterior
+             "2023-12-31T23:59:59.999Z",
+             "2024-01-01T00:00:00.000Z",  # cambio de año
+             "2024-02-29T12:00:00.500Z",  # año bisiesto
+             "1970-01-01T00:00:00.000Z",
+             "2038-01-19T03:14:08.000Z"]
+
+# Otros formatos ISO 8601, por dateutil
+FALLBACK = ["2023-11-14T22:13:20Z",
+            "2023-11-14T22:13:20.1Z",
+            "2023-11-14T22:13:20.123456Z",
+            "2023-11-14T22:13:20.123+00:00",
+            "2023-11-14T22:13:20.123+02:00",
+            "2023-11-14T22:13:20.123-03:00",
+            "2023-11-14T22:13:20.123",
+            "2023-11-14T22:13:20",
+            "2023-11-14T22:13",
+            "2023-11-14"]
+
+
+def test_bitmex_timestamp_ms_fast_path_matches_isoparse():
+    for timestamp in FAST_PATH:
+        assert bitmex_timestamp_ms(timestamp) == _isoparse_ms(timestamp), timestamp
+
+
+def test_bitmex_timestamp_ms_fallback_matches_isoparse():
+    for timestamp in FALLBACK:
+        assert bitmex_timestamp_ms(timestamp) == _isoparse_ms(timestamp), timestamp
+
+
+def test_bitmex_timestamp_ms_consecutive_trades():
+    # una hora de trades cada 250 ms, como llegan por el websocket
+    start = datetime.datetime(2023, 11, 14, 22, 0, tzinfo=datetime.timezone.utc)
+
+    for i in range(0, 3600 * 1000, 250):
+        ts = start + datetime.timedelta(milliseconds=i)
+        timestamp = ts.strftime("%Y-%m-%dT%H:%M:%S.") + "%03dZ" % (ts.microsecond // 1000)
+        assert bitmex_timestamp_ms(timestamp) == _isoparse_ms(timestamp), timestamp
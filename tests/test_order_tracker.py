@@ -0,0 +1,160 @@
+import threading
+import time
+
+from connectors.order_tracker import OrderTracker
+from models import Contract, OrderStatus, OpenPositions, Trade
+from strategies import BreakoutStrategy
+
+
+def _status(order_id, status, executed_qty=0., avg_price=0.):
+    return OrderStatus({'orderId': order_id, 'status': status, 'avgPrice': avg_price, 'executedQty': executed_qty},
+                       "binance_futures")
+
+
+class FakeClient:
+    platform = "binance_futures"
+
+    def __init__(self, cancel_status=None, final_status=None):
+        # estado que devuelve la cancelación de cada orden (None: falla)
+        self.cancel_status = cancel_status
+        # lo que devuelve la consulta una vez que se pidió la cancelación (None: la orden sigue abierta)
+        self.final_status = final_status
+        self.cancelled = []
+        self.cancel_requests = []
+        self.logs = []
+        self.open_positions = OpenPositions()
+
+    def get_orders_status(self, contract, order_ids):
+        if len(self.cancelled) > 0 and self.final_status is not None:
+            return {order_id: self.final_status for order_id in order_ids}
+        return {order_id: _status(order_id, "new", executed_qty=0.5, avg_price=100.) for order_id in order_ids}
+
+    def cancel_orders(self, contract, order_ids):
+        self.cancel_requests.append(list(order_ids))
+        self.cancelled.extend(order_ids)
+        if self.cancel_status is None:
+            return [None] * len(order_ids)
+        return [_status(order_id, self.cancel_status) for order_id in order_ids]
+
+    def _add_log(self, msg):
+        self.logs.append(msg)
+
+
+def _contract():
+    return Contract({'symbol': "BTCUSDT", 'baseAsset': "BTC", 'quoteAsset': "USDT", 'pricePrecision': 2,
+                     'quantityPrecision': 3}, "binance_futures")
+
+
+def _track_until_done(client, order_id=1):
+    tracker = OrderTracker(client, interval=0.01, max_interval=0.01, max_retries=2)
+    done = threading.Event()
+    received = []
+
+    def callback(order_status):
+        received.append(order_status)
+        done.set()
+
+    tracker.track(_contract(), order_id, callback)
+    assert done.wait(5)
+    tracker.stop()
+
+    return received[0]
+
+
+def test_give_up_cancels_the_order_and_reports_its_status():
+    client = FakeClient(cancel_status="CANCELED")
+
+    order_status = _track_until_done(client)
+
+    assert client.cancelled == [1]
+    assert order_status.status == "canceled"
+
+
+def test_order_stays_tracked_while_the_cancel_fails():
+    client = FakeClient(cancel_status=None)
+    tracker = OrderTracker(client, interval=0.01, max_interval=0.01, max_retries=2)
+    received = []
+
+    tracker.track(_contract(), 1, received.append)
+    time.sleep(0.3)
+    tracker.stop()
+
+    # nunca se inventa un estado final: la orden puede seguir abierta en el exchange
+    assert received == []
+    assert tracker.pending_count == 1
+    assert len(client.cancelled) > 1
+    assert len(client.logs) == 1
+
+
+def test_failed_cancel_reports_the_status_the_exchange_returns_later():
+    # la cancelación falla porque la orden se llenó mientras tanto
+    client = FakeClient(cancel_status=None, final_status=_status(1, "FILLED", executed_qty=1., avg_price=101.))
+
+    order_status = _track_until_done(client)
+
+    assert client.cancelled == [1]
+    assert order_status.status == "filled"
+    assert order_status.executed_qty == 1.
+
+
+def test_strategy_releases_the_position_when_the_tracker_gives_up():
+    client = FakeClient(cancel_status="CANCELED")
+    contract = _contract()
+    strategy = BreakoutStrategy(client, contract, "Binance", "1m", 10, 1, 1, {"min_volume": 1})
+
+    trade = Trade({"time": 0, "entry_price": None, "contract": contract, "strategy": "Breakout", "side": "long",
+                   "status": "open", "pnl": 0, "quantity": 0, "entry_id": 7})
+    strategy.trades.append(trade)
+    client.open_positions.add(trade)
+    strategy.ongoing_position = True
+
+    strategy._on_order_update(_track_until_done(client, order_id=7))
+
+    assert trade.status == "closed"
+    assert not strategy.ongoing_position
+    assert len(client.open_positions.get("BTCUSDT")) == 0
+
+
+def test_requested_cancels_go_together_in_one_request():
+    client = FakeClient(cancel_status="CANCELED")
+    tracker = OrderTracker(client, interval=60, max_interval=60)
+    received = []
+    done = threading.Event()
+
+    def callback(order_status):
+        received.append(order_status.order_id)
+        if len(received) == 2:
+            done.set()
+
+    for order_id in (1, 2, 3):
+        tracker.track(_contract(), order_id, callback)
+    tracker.cancel(_contract(), [1, 2])
+
+    assert done.wait(5)
+    tracker.stop()
+
+    assert client.cancel_requests == [[1, 2]]
+    assert sorted(received) == [1, 2]
+    assert tracker.pending_count == 1
+
+
+def test_stopped_strategy_cancels_its_working_entry_orders():
+    client = FakeClient(cancel_status="CANCELED")
+    client.order_tracker = OrderTracker(client, interval=60, max_interval=60)
+    contract = _contract()
+    strategy = BreakoutStrategy(client, contract, "Binance", "1m", 10, 1, 1, {"min_volume": 1})
+
+    # la orden de entrada no se llenó al mandarla, así que la sigue el OrderTracker
+    strategy._on_entry_placed("buy", "long", _status(7, "NEW"))
+    trade = strategy.trades[0]
+
+    strategy.stop()
+
+    deadline = time.time() + 5
+    while trade.status != "closed" and time.time() < deadline:
+        time.sleep(0.01)
+    client.order_tracker.stop()
+
+    assert client.cancel_requests == [[7]]
+    assert trade.status == "closed"
+    assert len(client.open_positions.get("BTCUSDT")) == 0
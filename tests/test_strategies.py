@@ -0,0 +1,97 @@
+import threading
+
+from models import Candle, Contract, OrderStatus, OpenPositions, Trade
+from replay import ReplayBinanceClient
+from strategies import BreakoutStrategy
+
+
+class FakeClient:
+    platform = "binance_futures"
+    futures = True
+
+    def __init__(self):
+        self.open_positions = OpenPositions()
+
+
+def _strategy() -> BreakoutStrategy:
+    contract = Contract({'symbol': "BTCUSDT", 'baseAsset': "BTC", 'quoteAsset': "USDT", 'pricePrecision': 2,
+                         'quantityPrecision': 3}, "binance_futures")
+    strategy = BreakoutStrategy(FakeClient(), contract, "Binance", "1m", 10, 1, 1, {"min_volume": 1})
+    strategy.load_candles([Candle([i * 60000, "100", "101", "99", "100", "1"], "1m", "binance_futures")
+                           for i in range(5)])
+    return strategy
+
+
+def _closing_trade(strategy: BreakoutStrategy) -> Trade:
+    trade = Trade({"time": 0, "entry_price": 100., "contract": strategy.contract, "strategy": "Breakout",
+                   "side": "long", "status": "closing", "pnl": 0, "quantity": 1, "entry_id": 1})
+    strategy.trades.append(trade)
+    strategy.client.open_positions.add(trade)
+    strategy.ongoing_position = True
+    return trade
+
+
+def test_order_callback_waits_for_the_tick_in_progress():
+    strategy = _strategy()
+    trade = _closing_trade(strategy)
+    exit_status = OrderStatus({'orderId': 2, 'status': "FILLED", 'avgPrice': 101., 'executedQty': 1},
+                              "binance_futures")
+
+    # el thread del websocket está en medio de un tick
+    with strategy._lock:
+        callback = threading.Thread(target=strategy._on_exit_placed, args=(trade, exit_status))
+        callback.start()
+        callback.join(0.1)
+
+        assert callback.is_alive()
+        assert trade.status == "closing"
+        assert strategy.ongoing_position
+
+    callback.join(5)
+
+    assert trade.status == "closed"
+    assert not strategy.ongoing_position
+    assert len(strategy.client.open_positions.get("BTCUSDT")) == 0
+
+
+def test_failed_exit_reopens_the_trade():
+    strategy = _strategy()
+    trade = _closing_trade(strategy)
+
+    strategy._on_exit_placed(trade, None)
+
+    assert trade.status == "open"
+    assert strategy.ongoing_position
+
+
+def test_entry_callback_in_the_tick_thread_does_not_deadlock():
+    # con el OrderBatcher del replay (window=0) la respuesta de la orden llega dentro de on_trade()
+    strategy = _strategy()
+    client = ReplayBinanceClient({"BTCUSDT": strategy.contract})
+    strategy.client = client
+    client.add_strategy(0, strategy)
+
+    done = threading.Event()
+    worker = threading.Thread(target=lambda: (strategy.on_trade(105., 5, 5 * 60000), done.set()))
+    worker.start()
+
+    assert done.wait(5)
+    assert len(client.orders) == 1
+    assert strategy.ongoing_position
+    assert strategy.trades[0].entry_price == 105.
+
+
+def test_entry_placed_after_the_strategy_was_stopped_is_not_registered():
+    strategy = _strategy()
+    client = ReplayBinanceClient({"BTCUSDT": strategy.contract})
+    strategy.client = client
+    client.add_strategy(0, strategy)
+
+    # la orden estaba esperando en el OrderBatcher cuando se paró la estrategia
+    client.remove_strategy(0)
+    strategy._on_entry_placed("buy", "long", OrderStatus({'orderId': 3, 'status': "FILLED", 'avgPrice': 101.,
+                                                          'executedQty': 1}, "binance_futures"))
+
+    assert strategy.stopped
+    assert strategy.trades == []
+    assert len(client.open_positions.get("BTCUSDT")) == 0